@@ -8,95 +8,221 @@ a max of 500 bp that are greater than 2.5sd greater than the mean log ratio.
 Input is a Nimblegen GFF file.
 Output is a BED file.
 Test data are found in tests/GFFthresholds
+
+Other parameters (per-chromosome stats, a fixed cutoff, other gaps and probe
+counts) can be given with --criteria; several sets are called from one read of
+the file, each into its own BED file.
+
+Only the probes above the threshold matter once the mean and sd are known, so
+with --streaming the file is read twice -- once for the stats, then once to
+pick out those probes -- and only a chunk of probes plus the probes above the
+threshold are ever held in memory.
 """
-from pylab import csv2rec
 import logging
+import os
 import sys
+import numpy as np
 
-def nodate(x):
-    return str(x)
+# Probes per chunk when reading a GFF
+CHUNKSIZE = 1000000
 
-def GFFthreshold(infn,outbed):
+def read_chunks(infn, chunksize=CHUNKSIZE):
     """
-    Thresholds the values in the GFF file *infn* and exports
-    the results to the BED file *outbed*.
+    Yields (chroms, starts, stops, ratios) arrays of up to *chunksize* probes
+    at a time from the GFF file *infn*.
     """
-    converterd = {'probe':nodate,'a':nodate,'b':nodate}
-    logging.debug('reading GFF into record array')
-    a = csv2rec(infn, 
-                delimiter='\t', 
-                names=('chr','prog','id','start','stop','ratio','a','b','probe'),
-                converterd=converterd)
-    logging.debug('sorting record array')
-    a.sort(order=('chr','start'))
-    fout = open(outbed,'w')
-    m = a.ratio.mean()
-    std = a.ratio.std()
-    thresh = m + 2.5 * std
-    allregions = []
-    region = []
-    lastchr = a.chr[0]
-    lastpos = None
-    count = 0
-
-    for data in a:
-        if data.ratio < thresh:
+    chroms, starts, stops, ratios = [], [], [], []
+    for line in open(infn):
+        if line.startswith('#') or not line.strip():
             continue
+        L = line.split('\t', 6)
+        chroms.append(L[0])
+        starts.append(int(L[3]))
+        stops.append(int(L[4]))
+        ratios.append(float(L[5]))
+        if len(ratios) == chunksize:
+            yield (np.array(chroms), np.array(starts, dtype=np.int64),
+                   np.array(stops, dtype=np.int64), np.array(ratios))
+            chroms, starts, stops, ratios = [], [], [], []
+    if ratios:
+        yield (np.array(chroms), np.array(starts, dtype=np.int64),
+               np.array(stops, dtype=np.int64), np.array(ratios))
 
-        if lastpos is None:
-            dist = 0
-        else:
-            dist = data.start - lastpos
-        
-        logging.debug('region is currently')
-        for i in region:
-            logging.debug('\t%s' % i)
-        logging.debug('this data: %s' % data)
-        logging.debug('dist from last: %s' % dist)
-    
-        if dist > 500 or data.chr != lastchr:
-            
-            logging.debug('\ndist > 500; checking region len')
-            logging.debug('regionlen: %s' % len(region))
-            for i in region:
-                logging.debug('\t%s' % i )
-            if len(region) < 4:
-                logging.debug('region not long enough, erasing')
+def chrom_stats(chunks):
+    """
+    Dict of chrom: (n, mean, sum of squared deviations) of the log ratios
+    in *chunks*, an iterable of read_chunks() tuples.  Only one chunk is
+    looked at at a time.
+    """
+    stats = {}
+    for chroms, starts, stops, ratios in chunks:
+        for chrom in np.unique(chroms):
+            r = ratios[chroms == chrom]
+            stats[chrom] = _combine(stats.get(chrom, (0, 0., 0.)),
+                                    (len(r), r.mean(), ((r - r.mean()) ** 2).sum()))
+    return stats
+
+def _combine(a, b):
+    """
+    Combines (n, mean, sum of squared deviations) of two sets of values
+    (Chan et al.)
+    """
+    na, meana, m2a = a
+    nb, meanb, m2b = b
+    n = na + nb
+    delta = meanb - meana
+    return (n, meana + delta * nb / float(n), m2a + m2b + delta ** 2 * na * nb / float(n))
+
+def ratio_stats(infn, chunksize=CHUNKSIZE):
+    """
+    Mean and (population) sd of the log ratios in *infn*, streaming through
+    the file a chunk at a time.
+    """
+    n, mean, m2 = reduce(_combine, chrom_stats(read_chunks(infn, chunksize)).values())
+    return mean, np.sqrt(m2 / n)
+
+def find_runs(starts, stops, maxgap=500, minprobes=4):
+    """
+    Given the sorted *starts* and *stops* of the probes on one chromosome
+    that passed the threshold, returns (starts, stops) of the runs of at
+    least *minprobes* probes where each probe starts no more than *maxgap* bp
+    after the previous one stops.
+    """
+    if len(starts) == 0:
+        return starts, stops
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] - stops[:-1] > maxgap
+    first = np.flatnonzero(new)
+    last = np.r_[first[1:], len(starts)] - 1
+    keep = last - first + 1 >= minprobes
+    return starts[first[keep]], stops[last[keep]]
+
+class Criteria(object):
+    def __init__(self, nsd=2.5, maxgap=500, minprobes=4, per_chrom=False, cutoff=None):
+        """
+        One set of peak-calling parameters.  Probes are kept if their log
+        ratio is at least mean + *nsd* sd -- of the whole array, or of their
+        own chromosome if *per_chrom* -- or at least *cutoff* if that's given
+        instead.  Runs of at least *minprobes* kept probes, each starting no
+        more than *maxgap* bp after the previous one stops, are called as
+        enriched regions.
+        """
+        self.nsd = nsd
+        self.maxgap = maxgap
+        self.minprobes = minprobes
+        self.per_chrom = per_chrom
+        self.cutoff = cutoff
+
+    @classmethod
+    def parse(cls, s):
+        """
+        Criteria from a string like "nsd=3,maxgap=300,minprobes=5,per_chrom"
+        or "cutoff=1.5".  Anything not given keeps its default.
+        """
+        kwargs = {}
+        for item in s.split(','):
+            key, sep, value = item.strip().partition('=')
+            if key == 'per_chrom' and not sep:
+                kwargs[key] = True
+            elif key in ('nsd', 'cutoff') and sep:
+                kwargs[key] = float(value)
+            elif key in ('maxgap', 'minprobes') and sep:
+                kwargs[key] = int(value)
             else:
-                logging.debug('region is long enough!!!!')
-                logging.debug('region to be exported is')
-                for i in region:
-                    logging.debug('\t%s' % i)
-                chr = region[0].chr
-                start = region[0].start
-                stop = region[-1].stop
-                fout.write('%s\t%s\t%s\n' % (chr,start,stop))
-                count += 1
-            region = []
-
-        lastpos = data.stop
-        lastchr = data.chr
-        logging.debug('adding %s to region' % data)
-        region.append(data)
-
-    if len(region) >= 4:
-        logging.debug('last region will be exported')
-        logging.debug('region to be exported is')
-        for i in region:
-            logging.debug('\t%s' % i)
-        
-        chr = region[0].chr
-        start = region[0].start
-        stop = region[-1].stop
-        fout.write('%s\t%s\t%s\n' % (chr,start,stop))
-        count += 1
+                raise ValueError('Unrecognized criterion "%s" in "%s"' % (item, s))
+        return cls(**kwargs)
+
+    @property
+    def name(self):
+        if self.cutoff is not None:
+            rule = 'cutoff%s' % self.cutoff
+        else:
+            rule = 'nsd%s' % self.nsd
+            if self.per_chrom:
+                rule += '-chrom'
+        return '%s-gap%s-min%s' % (rule, self.maxgap, self.minprobes)
 
+    def thresholds(self, stats):
+        """
+        Dict of chrom: threshold, given chrom_stats() *stats*.
+        """
+        if self.cutoff is not None:
+            return dict((chrom, self.cutoff) for chrom in stats)
+        if self.per_chrom:
+            return dict((chrom, mean + self.nsd * np.sqrt(m2 / n))
+                        for chrom, (n, mean, m2) in stats.items())
+        n, mean, m2 = reduce(_combine, stats.values())
+        thresh = mean + self.nsd * np.sqrt(m2 / n)
+        return dict((chrom, thresh) for chrom in stats)
+
+def _above(chunks, lowest):
+    """
+    Dict of chrom: (starts, stops, ratios), sorted by start, of the probes in
+    *chunks* whose ratio is at least *lowest*[chrom].
+    """
+    kept = {}
+    for chroms, starts, stops, ratios in chunks:
+        for chrom in np.unique(chroms):
+            ind = (chroms == chrom) & (ratios >= lowest[chrom])
+            kept.setdefault(chrom, []).append((starts[ind], stops[ind], ratios[ind]))
+    probes = {}
+    for chrom, parts in kept.items():
+        s, e, r = [np.concatenate(i) for i in zip(*parts)]
+        order = np.argsort(s, kind='mergesort')
+        probes[chrom] = (s[order], e[order], r[order])
+    return probes
+
+def call_peaks(infn, criteria, outbeds, streaming=False):
+    """
+    Calls enriched regions in the GFF file *infn* with each of the Criteria
+    in *criteria*, writing them to the matching BED filename in *outbeds*.
+    The file is read once (twice if *streaming*) no matter how many criteria
+    there are.  Returns a list of dicts of chrom: threshold used, one per
+    criteria.
+    """
+    if streaming:
+        logging.debug('computing stats')
+        stats = chrom_stats(read_chunks(infn))
+        chunks = read_chunks(infn)
     else:
-        logging.debug('last region not long enough')
+        logging.debug('reading GFF into arrays')
+        chunks = list(read_chunks(infn))
+        stats = chrom_stats(chunks)
+    thresholds = [c.thresholds(stats) for c in criteria]
 
-    fout.close()
-    logging.debug('Number of enriched regions: %s' % count)
+    # Only probes above the lowest threshold can be in any region
+    lowest = dict((chrom, min(t[chrom] for t in thresholds)) for chrom in stats)
+    logging.debug('collecting probes above threshold')
+    probes = _above(chunks, lowest)
+
+    for c, thresh, outbed in zip(criteria, thresholds, outbeds):
+        fout = open(outbed,'w')
+        count = 0
+        for chrom in sorted(probes):
+            starts, stops, ratios = probes[chrom]
+            ind = ratios >= thresh[chrom]
+            rstarts, rstops = find_runs(starts[ind], stops[ind], c.maxgap, c.minprobes)
+            for start, stop in zip(rstarts, rstops):
+                fout.write('%s\t%s\t%s\n' % (chrom,start,stop))
+            count += len(rstarts)
+        fout.close()
+        logging.debug('%s: %s enriched regions' % (c.name, count))
+    return thresholds
+
+def GFFthreshold(infn,outbed,nsd=2.5,maxgap=500,minprobes=4,streaming=False):
+    """
+    Thresholds the values in the GFF file *infn* and exports
+    the results to the BED file *outbed*.
+
+    Probes with a log ratio of at least mean + *nsd* sd are kept, and runs
+    of at least *minprobes* of them separated by no more than *maxgap* bp
+    are exported.  If *streaming*, the file is read twice instead of being
+    held in memory.  Returns the threshold used.
+    """
+    thresholds = call_peaks(infn, [Criteria(nsd, maxgap, minprobes)], [outbed], streaming)[0]
+    thresh = thresholds.values()[0]
     logging.debug('using threshold: %s' % thresh)
+    return thresh
 
 
 if __name__ == "__main__":
@@ -107,6 +233,12 @@ if __name__ == "__main__":
     op.add_option('-o',dest='outbed',help='Output bed file')
     op.add_option('--test',dest='test',action='store_true',help='run tests')
     op.add_option('--verbose',dest='verbose',action='store_true', help='print debugging info')
+    op.add_option('--streaming',dest='streaming',action='store_true',
+                  help='Read the GFF twice (stats, then detection) instead of holding it in memory')
+    op.add_option('--criteria',dest='criteria',action='append',
+                  help='Parameter set like "nsd=3,maxgap=300,minprobes=5,per_chrom" or '
+                       '"cutoff=1.5,minprobes=3".  Can be given several times; each set is '
+                       'written to OUTBED with the set\'s name in place of the extension.')
     options,args = op.parse_args()
 
     reqargs = ['infn','outbed']
@@ -130,6 +262,12 @@ if __name__ == "__main__":
     else:
         logging.basicConfig(level=logging.WARNING)
 
-    thresh = GFFthreshold(options.infn, options.outbed)
+    if options.criteria:
+        criteria = [Criteria.parse(i) for i in options.criteria]
+        root = os.path.splitext(options.outbed)[0]
+        outbeds = ['%s.%s.bed' % (root, c.name) for c in criteria]
+        call_peaks(options.infn, criteria, outbeds, streaming=options.streaming)
+    else:
+        thresh = GFFthreshold(options.infn, options.outbed, streaming=options.streaming)
 
 
@@ -4,7 +4,12 @@
 # Created June 2009
 
 import optparse, sys, logging
-from numpy import median, abs, sum, array, mean
+import itertools
+import os
+import shutil
+import tempfile
+import numpy as np
+import robust
 
 description = """This script averages the data among several GFF files of the
 same cell type and results in a single GFF file."""
@@ -29,87 +34,222 @@ op.add_option('--epsilon',
     dest='epsilon',
     type='float',
     default=1e-4)
-options,args = op.parse_args()
+op.add_option('--center-arrays',
+    help='''subtract each array's biweight M-estimator before
+combining the arrays''',
+    dest='center_arrays',
+    action='store_true')
+op.add_option('--combine',
+    help='''how to combine each probe's values across arrays: "mean",
+"biweight" (a robust per-probe average), or "median-polish" (overall plus
+probe effect from a median polish of the probe x array matrix).  Default is
+%default''',
+    dest='combine',
+    choices=['mean', 'biweight', 'median-polish'],
+    default='mean')
+op.add_option('--tmpdir',
+    help='''directory for the probe x array matrix when it is too big to
+keep in memory (default is the system temp dir)''',
+    dest='tmpdir')
+
+# Probe x array matrices bigger than this (in bytes) are memory-mapped
+MAX_IN_MEMORY = 1 << 30
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('log')
 
-if len(args) < 1: 
-    logger.warning('''need at least one input (and preferably multiple) 
-files to work on! (use -h switch to view help)''')
-    sys.exit()
-
-try:
-    options.outputfile
-except AttributeError:
-    logger.warning('No output file specified! (use -h switch to view help)')
-    sys.exit()
-
-
-# These two dictionaries will be keyed by probe ID
-logratios = {}
-otherstuff = {}
-
-def biweight(x,c=5.0,epsilon=1e-5):
-    '''Computes the Tukey biweight M-estimator.'''
-    x = array(x)
-    m = median(x)
-    s = median(abs(x-m))
-    u = (x-m) / (c*s + epsilon)
-    w = x*0
-    i = abs(u) <= 1
-    w[i] = ((1-u**2)**2)[i]
-    t = sum(w*x) / sum(w)
-    return t
-
-for inputfile in args:
-    logger.info('Reading in %s' % inputfile)
-    f = open(inputfile)
-    for line in f:
-        if line.startswith('#'):
-            continue
-        L = line.strip().split('\t')
-        key = L[-1]
-        log2ratio = float(L[5])
-        vals = logratios.setdefault(key,[])
-        vals.append(log2ratio)
-        try:
-            otherstuff[key]
-        except KeyError:
-            otherstuff[key] = L
-
-# get the mean for each item
-logger.info('Getting mean for each feature')
-for key,value in logratios.iteritems():
-    logratios[key] = mean(value)
-
-# calculate the biweight scaling if requested
-
-if options.biweight:
-    logging.info('Calculating biweight scaling')
-    global_biweight = biweight(logratios.values())
-
-else:
-    logger.info('No biweight scaling requested, skipping')
-
-# construct lines for output file.
-logger.info('creating %s' % options.outputfile)
-fout = open(options.outputfile, 'w')
-for key,value in logratios.iteritems():
-    linelist = otherstuff[key]
-    if options.biweight:
-        linelist[5] = str(value-global_biweight)
-    else:
+class ProbeIndex(object):
+    def __init__(self):
+        '''
+        Row number for each probe ID, in the order the probes are first
+        seen, and where each probe's line is: the number of the file it was
+        first seen in and the byte offset of the line in that file.  Only
+        these are kept per probe, however many files are read.
+        '''
+        self.rows = {}
+        self.files = []
+        self.offsets = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def read(self, fn):
+        '''
+        Streams through GFF file *fn*, returning arrays of the row number
+        and log ratio of each probe in it.
+        '''
+        fileno = len(self.files)
+        self.files.append(fn)
+        rows = []
+        ratios = []
+        offset = 0
+        for line in open(fn, 'rb'):
+            linelen = len(line)
+            if line.startswith('#'):
+                offset += linelen
+                continue
+            L = line.strip().split('\t')
+            key = L[-1]
+            row = self.rows.get(key)
+            if row is None:
+                row = self.rows[key] = len(self.offsets)
+                self.offsets.append((fileno, offset))
+            rows.append(row)
+            ratios.append(float(L[5]))
+            offset += linelen
+        return np.array(rows, dtype=np.int64), np.array(ratios)
+
+    def lines(self):
+        '''
+        Yields the split line of each probe, in row order.
+        '''
+        handles = [open(fn, 'rb') for fn in self.files]
+        for fileno, offset in self.offsets:
+            f = handles[fileno]
+            f.seek(offset)
+            yield f.readline().strip().split('\t')
+        for f in handles:
+            f.close()
+
+def average(fns):
+    '''
+    Averages the log ratios of each probe over the GFF files *fns*, reading
+    one file at a time.  Returns the ProbeIndex and an array of the mean log
+    ratio of each row.
+    '''
+    index = ProbeIndex()
+    sums = np.zeros(0)
+    counts = np.zeros(0, dtype=np.int64)
+    for fn in fns:
+        logger.info('Reading in %s' % fn)
+        rows, ratios = index.read(fn)
+        n = len(index)
+        sums = np.r_[sums, np.zeros(n - len(sums))] + np.bincount(rows, weights=ratios, minlength=n)
+        counts = np.r_[counts, np.zeros(n - len(counts), dtype=np.int64)] + np.bincount(rows, minlength=n)
+    return index, sums / counts
+
+def _new_matrix(shape, dtype, tmpdir=None):
+    '''
+    Empty matrix of *shape*, memory-mapped from a .npy file in *tmpdir* if
+    it's bigger than MAX_IN_MEMORY.
+    '''
+    if shape[0] * shape[1] * np.dtype(dtype).itemsize > MAX_IN_MEMORY:
+        fd, matrixfn = tempfile.mkstemp(suffix='.npy', dir=tmpdir)
+        os.close(fd)
+        logger.info('Memory-mapping %s x %s matrix to %s' % (shape + (matrixfn,)))
+        return np.lib.format.open_memmap(matrixfn, mode='w+', dtype=dtype, shape=shape)
+    return np.empty(shape, dtype=dtype)
+
+def remove_matrix(matrix):
+    '''
+    Deletes the file behind *matrix* if it's memory-mapped.
+    '''
+    if isinstance(matrix, np.memmap):
+        matrixfn = matrix.filename
+        del matrix
+        os.unlink(matrixfn)
+
+def ratio_matrix(fns, tmpdir=None):
+    '''
+    Reads the GFF files *fns* into a probe x array matrix of log ratios
+    (NaN where a file has no value for a probe, and the file's mean where it
+    has more than one).  Returns the ProbeIndex, the matrix, and a matrix of
+    the number of values each file has for each probe -- or None if no file
+    has a probe more than once.  The matrices are memory-mapped .npy files in
+    *tmpdir* if they're bigger than MAX_IN_MEMORY.  Each file's values are
+    held on disk until the number of probes is known.
+    '''
+    index = ProbeIndex()
+    workdir = tempfile.mkdtemp(dir=tmpdir)
+    repeats = False
+    try:
+        for i, fn in enumerate(fns):
+            logger.info('Reading in %s' % fn)
+            rows, ratios = index.read(fn)
+            repeats = repeats or len(np.unique(rows)) < len(rows)
+            np.save(os.path.join(workdir, '%s.rows.npy' % i), rows)
+            np.save(os.path.join(workdir, '%s.ratios.npy' % i), ratios)
+        shape = (len(index), len(fns))
+        matrix = _new_matrix(shape, float, tmpdir)
+        counts = _new_matrix(shape, np.int32, tmpdir) if repeats else None
+        for i in range(len(fns)):
+            rows = np.load(os.path.join(workdir, '%s.rows.npy' % i))
+            ratios = np.load(os.path.join(workdir, '%s.ratios.npy' % i))
+            n = np.bincount(rows, minlength=shape[0])
+            with np.errstate(invalid='ignore'):
+                matrix[:, i] = np.bincount(rows, weights=ratios, minlength=shape[0]) / n
+            if counts is not None:
+                counts[:, i] = n
+    finally:
+        shutil.rmtree(workdir)
+    return index, matrix, counts
+
+def combine(matrix, method='mean', center_arrays=False, c=5.0, epsilon=1e-4, counts=None):
+    '''
+    Combines the probe x array *matrix* into one value per probe with
+    *method* ("mean", "biweight" or "median-polish"), after subtracting each
+    array's biweight if *center_arrays*.  *matrix* is modified in place.
+    For "mean", each value is weighted by *counts* if given, so a probe that
+    is in a file more than once gets the mean of all its values, as in
+    average().
+    '''
+    if center_arrays:
+        logger.info('Centering each array')
+        robust.center_columns(matrix, c, epsilon)
+    logger.info('Combining arrays (%s)' % method)
+    if method == 'mean':
+        return robust.row_means(matrix, weights=counts)
+    if method == 'biweight':
+        return robust.row_biweights(matrix, c, epsilon)
+    if method == 'median-polish':
+        overall, roweffects, coleffects, residuals = robust.median_polish(matrix)
+        return overall + roweffects
+    raise ValueError('Unknown method "%s"' % method)
+
+def write_gff(index, values, outputfile):
+    '''
+    Writes each probe's line with its log ratio replaced by *values*.
+    '''
+    fout = open(outputfile, 'w')
+    for linelist, value in itertools.izip(index.lines(), values):
         linelist[5] = str(value)
-    line = '\t'.join(linelist) + '\n'
-    fout.write(line)
-
-fout.close()
-logger.info('DONE!')
-
-
+        fout.write('\t'.join(linelist) + '\n')
+    fout.close()
 
+if __name__ == "__main__":
+    options,args = op.parse_args()
 
+    logging.basicConfig(level=logging.INFO)
 
+    if len(args) < 1:
+        logger.warning('''need at least one input (and preferably multiple)
+files to work on! (use -h switch to view help)''')
+        sys.exit()
+
+    if options.outputfile is None:
+        logger.warning('No output file specified! (use -h switch to view help)')
+        sys.exit()
+
+    # get the mean (or robust combination) for each item
+    if options.center_arrays or options.combine != 'mean':
+        index, matrix, counts = ratio_matrix(args, options.tmpdir)
+        logratios = combine(matrix, options.combine, options.center_arrays,
+                            options.c, options.epsilon, counts)
+        remove_matrix(matrix)
+        if counts is not None:
+            remove_matrix(counts)
+        del matrix, counts
+    else:
+        index, logratios = average(args)
 
+    # calculate the biweight scaling if requested
+    if options.biweight:
+        logging.info('Calculating biweight scaling')
+        global_biweight = robust.biweight(logratios, options.c, options.epsilon)
+        logratios = logratios - global_biweight
+    else:
+        logger.info('No biweight scaling requested, skipping')
 
+    # construct lines for output file.
+    logger.info('creating %s' % options.outputfile)
+    write_gff(index, logratios, options.outputfile)
+    logger.info('DONE!')
@@ -3,33 +3,62 @@
 import optparse
 import sys
 import logging
+import genome
 
 usage = """
 
 \t%prog -i BEDFILE [--genomesize=GENOMESIZE]
+\t%prog -i BEDFILE --genome=CHROMSIZES [--exclude=BEDFILE] [--include=BEDFILE]
 
 Script to calculate the probability of encountering a feature in the input bed
 file assuming random distribution and random sampling.  Output is to stdout.
+
+With --genome, the genome size is the total size of the chromosomes minus any
+--exclude regions (or just the --include regions), and only the parts of
+features inside that space are counted, without double-counting overlaps.
 """
 op = optparse.OptionParser(usage=usage)
 op.add_option('-i',dest='bedfile',
               help='Input BED format file. Only uses first 3 fields.')
-op.add_option('--genomesize', dest='genomesize',default=120e6,
+op.add_option('--genomesize', dest='genomesize',default=120e6,type=float,
               help='Size of genome to compare against; default=%default')
+op.add_option('--genome',
+              help='chrom.sizes file (or BED file of chromosomes) for the genome to compare '
+                   'against; overrides --genomesize')
+op.add_option('--exclude',
+              help='BED file of regions (e.g., gaps) to leave out of the genome')
+op.add_option('--include',
+              help='BED file of regions (e.g., mappable regions) to restrict the genome to')
 options,args = op.parse_args()
 if options.bedfile is None:
     logging.warning('Need an input file. Use -h for help.')
     sys.exit()
+if (options.exclude or options.include) and not options.genome:
+    logging.warning('--exclude and --include need --genome. Use -h for help.')
+    sys.exit()
 
 total_coverage = 0
-for line in open(options.bedfile):
-    if 'track' in line or 'browser' in line:
-        continue
-    L = line.rstrip().split('\t')
-    start = int(L[1])
-    stop = int(L[2])
-    length = abs(start-stop)
-    total_coverage += length
+if options.genome:
+    g = genome.Genome.from_files(options.genome, options.exclude, options.include)
+    features = genome.read_regions(options.bedfile)
+    for chrom in g.chroms():
+        if chrom not in features:
+            continue
+        allowed = g.allowed(chrom)
+        # Parts of the features inside the allowed regions
+        outside = genome.subtract_intervals(features[chrom][0], features[chrom][1], *allowed)
+        starts, stops = genome.subtract_intervals(features[chrom][0], features[chrom][1], *outside)
+        total_coverage += int((stops - starts).sum())
+    options.genomesize = g.effective_size()
+else:
+    for line in open(options.bedfile):
+        if 'track' in line or 'browser' in line:
+            continue
+        L = line.rstrip().split('\t')
+        start = int(L[1])
+        stop = int(L[2])
+        length = abs(start-stop)
+        total_coverage += length
 
 prob = total_coverage / float(options.genomesize)
 print """
@@ -15,16 +15,84 @@ CREATE TABLE features (chrom text,
                        itemRGB text,
                        blockCount int,
                        blockSizes text,
-                       blockStarts text);
+                       blockStarts text,
+                       bin int);
+
+*bin* is the UCSC bin of the feature (see binning.py).  Rows are bulk loaded
+in one transaction and indexes are built afterwards (see dbload.py).
+
+If sqlite3 was built with the R*Tree module, an R*Tree index is also built
+for region queries:
+
+CREATE TABLE chroms (id integer primary key, chrom text unique);
+CREATE VIRTUAL TABLE features_rtree USING rtree_i32(id,
+                                                    chrom_min, chrom_max,
+                                                    start, stop);
+
+where *id* is the rowid in the features table.  See featuredb.py for queries.
 """
-import bedparser
+import binning
+import dbload
 import sqlite3
 import optparse
+import warnings
 
 op = optparse.OptionParser()
 op.add_option('-i',dest='bedfile',help='Input bed file')
 op.add_option('--db',dest='database',help='Output sqlite3 database')
 
+# Region queries (featuredb.py) use the R*Tree or this index, and chrom=?
+# lookups use its first column, so no single-column indexes are built.
+INDEXES = [('idx_chrom_bin_start', 'chrom, bin, start')]
+
+def bed_rows(bedfn):
+    """
+    Yields a row for the features table for each line of *bedfn*.  Does the
+    same conversions as bedparser.bedfile, without creating a bedfeature
+    object for every line.
+    """
+    bin_from_range = binning.bin_from_range
+    for line in open(bedfn):
+        L = line.rstrip().split('\t')
+        if line.startswith('track') or line.startswith('browser') or len(L) < 3:
+            continue
+        # Only the 12 standard BED fields go in the table
+        L = L[:12]
+        L.extend([None] * (12 - len(L)))
+        start = int(L[1])
+        stop = int(L[2])
+        L[1] = start
+        L[2] = stop
+        if L[4] is not None:
+            L[4] = float(L[4])
+        for i in (6, 7, 9):
+            if L[i] is not None:
+                L[i] = int(L[i])
+        L.append(bin_from_range(start, stop))
+        yield L
+
+def build_rtree(conn):
+    """
+    Builds the chroms table and the features_rtree index from the features
+    table.
+    """
+    c = conn.cursor()
+    c.execute('DROP TABLE IF EXISTS features_rtree')
+    c.execute('DROP TABLE IF EXISTS chroms')
+    c.execute('CREATE TABLE chroms (id integer primary key, chrom text unique)')
+    c.execute('''
+    CREATE VIRTUAL TABLE features_rtree USING rtree_i32(id,
+                                                        chrom_min, chrom_max,
+                                                        start, stop)
+    ''')
+    c.execute('INSERT INTO chroms (chrom) SELECT DISTINCT chrom FROM features')
+    c.execute('''
+    INSERT INTO features_rtree
+    SELECT features.rowid, chroms.id, chroms.id, features.start, features.stop
+    FROM features JOIN chroms ON features.chrom = chroms.chrom
+    ''')
+    conn.commit()
+
 def bed2db(bedfn, dbfn):
     conn = sqlite3.connect(dbfn)
     c = conn.cursor()
@@ -40,33 +108,20 @@ def bed2db(bedfn, dbfn):
                            itemRGB text,
                            blockCount int,
                            blockSizes text,
-                           blockStarts text)
+                           blockStarts text,
+                           bin int)
     ''')
-    for feature in bedparser.bedfile(bedfn):
-        items = [feature.chr, 
-                 feature.start, 
-                 feature.stop, 
-                 feature.name, 
-                 feature.value, 
-                 feature.strand, 
-                 feature.thickStart,
-                 feature.thickStop, 
-                 feature.itemRGB,
-                 feature.blockCount,
-                 feature.blockSizes, 
-                 feature.blockStarts]
-        c.execute('''
-        INSERT INTO features VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
-        ''',items)
-
-    c.execute('CREATE INDEX idx_starts ON features(start)')
-    c.execute('CREATE INDEX idx_stops ON features(stop)')
-    c.execute('CREATE INDEX idx_chroms ON features(chrom)')
-    c.execute('CREATE INDEX idx_values ON features(value)')
-    conn.commit()
+    dbload.bulk_load(conn, 'INSERT INTO features VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                     bed_rows(bedfn))
+    dbload.create_indexes(conn, 'features', INDEXES)
+    try:
+        build_rtree(conn)
+    except sqlite3.OperationalError, e:
+        warnings.warn('Could not build R*Tree index (%s); region queries '
+                      'will use the bin index instead' % e)
     return conn
 
 if __name__ == "__main__":
     options,args = op.parse_args()
-    bed2db(options.bedfn, options.dbfn)
+    bed2db(options.bedfile, options.database)
 
@@ -1,8 +1,8 @@
 #!/usr/bin/python
 
 import optparse
-import time
 import sys
+from progress import Progress
 
 """
 Script to convert SAM, BED or Bowtie-formatted files into a "pileup" or
@@ -189,12 +189,15 @@ dispatch_dict = {
                  'sam':samfile_iterator,
                 }
 
-def clusters(infn, filetype, use_strand='.',verbose=False):
+def clusters(infn, filetype, use_strand='.',verbose=False,progress=None):
     """
     Yields clusters of overlapping reads along with the chromsome and cluster boundaries.
 
     *strand* is one of '+','-' or '.'
 
+    *progress* is an optional progress.Progress instance that is ticked once
+    per input feature.
+
     Return value is of the form (chrom, cluster_start, cluster_stop, features)
     where *features* is a list of (start,stop) tuples.
     """
@@ -210,6 +213,9 @@ def clusters(infn, filetype, use_strand='.',verbose=False):
     ret_last = False
     last_chrom = None
     for chrom,start,stop,strand in iterator:
+        if progress is not None:
+            progress.tick()
+
         # If we enter this loop, there's something in the iterator and so we
         # will eventually have to return the last cluster. 
         if use_strand != '.':
@@ -257,7 +263,7 @@ def make_wig(infn, filetype, outfn=None, use_strand='.',trackinfo=None,verbose=F
     file, *infn*.  Specify format with either filetype='bed' or
     filetype='bowtie'.
     """
-    t0 = time.time()
+    progress = Progress('features', fileobj=infn, enabled=verbose)
     if outfn is None:
         fout = sys.stdout 
     else:
@@ -269,7 +275,7 @@ def make_wig(infn, filetype, outfn=None, use_strand='.',trackinfo=None,verbose=F
     fout.write('track type=wiggle_0 alwaysZero=on %s\n' % trackinfo)
 
     
-    for chrom, cluster_start, cluster_stop, features in clusters(infn, filetype, use_strand, verbose):
+    for chrom, cluster_start, cluster_stop, features in clusters(infn, filetype, use_strand, verbose, progress):
         if chrom is None:
             continue
         # Add 1 to cluster_start to shift WIG features so they look right in the browser (which is 1-based)
@@ -295,10 +301,7 @@ def make_wig(infn, filetype, outfn=None, use_strand='.',trackinfo=None,verbose=F
     # Close up shop (but not if we were using stdout!)
     if outfn is not None:
         fout.close()
-        
-    t1 = time.time()
-    if verbose:
-        sys.stderr.write('%d s elapsed\n' % (t1-t0))
+    progress.done()
 
 if __name__ == '__main__':
     options,args = op.parse_args()
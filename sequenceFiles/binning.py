@@ -0,0 +1,99 @@
+"""
+Module for the UCSC Genome Browser hierarchical binning scheme (Kent et al.
+2002, "The Human Genome Browser at UCSC").
+
+The genome is divided into bins at several levels: 128 kb at the smallest
+level, then 1 Mb, 8 Mb, 64 Mb and 512 Mb.  A feature gets the number of the
+smallest bin that it fits completely inside, which is computed directly with
+bit shifts.  To find features overlapping a range, only the bins at each level
+that overlap that range need to be searched.
+
+Coordinates are 0-based, half-open.  Features ending past 512 Mb use the
+"extended" scheme (an extra 4 Gb level, with bin numbers offset by 4681), as
+in the UCSC source.
+
+Usage::
+
+    bin = bin_from_range(1000, 2000)                # 585
+    bins = overlapping_bins(1000, 200000)           # [585, 586, 73, 9, 1, 0, ...]
+    bins = bins_from_ranges(start_array, stop_array) # NumPy array of bins
+"""
+import numpy as np
+
+# Offsets for each level, smallest bins first
+BIN_OFFSETS = [512+64+8+1, 64+8+1, 8+1, 1, 0]
+BIN_OFFSETS_EXTENDED = [4096+512+64+8+1, 512+64+8+1, 64+8+1, 8+1, 1, 0]
+BIN_FIRST_SHIFT = 17
+BIN_NEXT_SHIFT = 3
+BIN_OFFSET_OLD_TO_EXTENDED = 4681
+MAXEND_512M = 512 * 1024 * 1024
+MAXEND_2G = 2 * 1024 * 1024 * 1024
+
+
+def _scheme(stop):
+    if stop <= MAXEND_512M:
+        return BIN_OFFSETS, 0
+    return BIN_OFFSETS_EXTENDED, BIN_OFFSET_OLD_TO_EXTENDED
+
+
+def bin_from_range(start, stop):
+    """
+    Returns the bin number of the smallest bin that completely contains
+    *start* to *stop*.
+    """
+    if start < 0 or stop > MAXEND_2G or start > stop:
+        raise ValueError('Invalid range for binning: %s-%s' % (start, stop))
+    offsets, extra = _scheme(stop)
+    start_bin = start >> BIN_FIRST_SHIFT
+    stop_bin = max(stop - 1, start) >> BIN_FIRST_SHIFT
+    for offset in offsets:
+        if start_bin == stop_bin:
+            return extra + offset + start_bin
+        start_bin >>= BIN_NEXT_SHIFT
+        stop_bin >>= BIN_NEXT_SHIFT
+    raise ValueError('Invalid range for binning: %s-%s' % (start, stop))
+
+
+def overlapping_bins(start, stop):
+    """
+    Returns a list of all the bins that could hold features overlapping
+    *start* to *stop*.  Bins from the standard scheme come first, followed by
+    the extended scheme, since a feature ending past 512 Mb can overlap a
+    range that does not.
+    """
+    bins = []
+    for offsets, extra in [(BIN_OFFSETS, 0),
+                           (BIN_OFFSETS_EXTENDED, BIN_OFFSET_OLD_TO_EXTENDED)]:
+        start_bin = start >> BIN_FIRST_SHIFT
+        stop_bin = max(stop - 1, start) >> BIN_FIRST_SHIFT
+        for offset in offsets:
+            bins.extend(range(extra + offset + start_bin, extra + offset + stop_bin + 1))
+            start_bin >>= BIN_NEXT_SHIFT
+            stop_bin >>= BIN_NEXT_SHIFT
+    return bins
+
+
+def bins_from_ranges(starts, stops):
+    """
+    Vectorized bin_from_range() for arrays of *starts* and *stops*.  Returns an
+    integer array of bin numbers.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    stops = np.asarray(stops, dtype=np.int64)
+    if np.any(starts < 0) or np.any(stops > MAXEND_2G) or np.any(starts > stops):
+        raise ValueError('Invalid range for binning')
+    bins = np.empty(len(starts), dtype=np.int64)
+    done = np.zeros(len(starts), dtype=bool)
+    extended = stops > MAXEND_512M
+    for ext, offsets, extra in [(False, BIN_OFFSETS, 0),
+                                (True, BIN_OFFSETS_EXTENDED, BIN_OFFSET_OLD_TO_EXTENDED)]:
+        todo = extended == ext
+        start_bin = starts >> BIN_FIRST_SHIFT
+        stop_bin = np.maximum(stops - 1, starts) >> BIN_FIRST_SHIFT
+        for offset in offsets:
+            hit = todo & ~done & (start_bin == stop_bin)
+            bins[hit] = extra + offset + start_bin[hit]
+            done |= hit
+            start_bin >>= BIN_NEXT_SHIFT
+            stop_bin >>= BIN_NEXT_SHIFT
+    return bins
@@ -8,6 +8,7 @@ the output to a new file.
 import gzip
 import os
 import sys
+from collections import deque
 
 
 class feature(object):
@@ -105,6 +106,105 @@ def wig_features(fn,first=None,last=None,equal=False):
                     except ValueError:
                         track_data[key] = value
 
+def bed_chrom_order(fn):
+    '''Returns a dict of chrom: rank, in the order chromosomes first appear
+    in the BED file *fn*.  Only the first field of each line is looked at.'''
+    if os.path.splitext(fn)[1] == '.gz':
+        f = gzip.open(fn)
+    else:
+        f = open(fn)
+    order = {}
+    for line in f:
+        if 'track' in line:
+            continue
+        L = line.split('\t', 2)
+        if len(L) <= 1:
+            continue
+        if L[0] not in order:
+            order[L[0]] = len(order)
+    f.close()
+    return order
+
+def _checked_wigs(wigs, order):
+    '''Passes through the WIG features in *wigs*, raising ValueError if they
+    aren't grouped by chromosome, sorted by start within each chromosome, and
+    in the same chromosome order as the BED file (*order*, from
+    bed_chrom_order()).'''
+    seen = set()
+    last = None
+    lastrank = -1
+    for w in wigs:
+        if last is None or w.chrom != last.chrom:
+            if w.chrom in seen:
+                raise ValueError('WIG file is not grouped by chromosome (%s)' % w.chrom)
+            seen.add(w.chrom)
+            rank = order.get(w.chrom)
+            if rank is not None:
+                if rank < lastrank:
+                    raise ValueError('WIG chromosomes are not in the same order as the BED '
+                                     'file (%s after %s)' % (w.chrom, last.chrom))
+                lastrank = rank
+        elif w.start < last.start:
+            raise ValueError('WIG file is not sorted by start (%s after %s)' % (w, last))
+        last = w
+        yield w
+
+def intersect(bedfn, wigfn):
+    '''Generator function that yields the WIG features from *wigfn* that
+    fall completely within each feature in *bedfn*, in BED order.
+
+    Both files are streamed in a sort-merge join: chromosomes must come in
+    the same order in both files (chromosomes missing from either file are
+    fine), and features within a chromosome must be sorted by start in both
+    files; ValueError is raised otherwise.  Only the WIG features within the
+    span of the current BED feature are kept in memory.
+
+    The BED file is read twice -- first just for its chromosome names, which
+    is cheap next to parsing the WIG -- and the WIG is read to the end even
+    after the last BED feature, so that its order can be checked.
+    '''
+    order = bed_chrom_order(bedfn)
+
+    wigs = _checked_wigs(wig_features(wigfn), order)
+    pending = next(wigs, None)
+    window = deque()
+    last = None
+    for b in bed_features(bedfn):
+        if last is None or b.chrom != last.chrom:
+            if last is not None and order[b.chrom] < order[last.chrom]:
+                raise ValueError('BED file is not grouped by chromosome (%s)' % b.chrom)
+            window.clear()
+
+            # Skip WIG chromosomes not in the BED file, and the rest of the
+            # previous chromosomes.
+            rank = order[b.chrom]
+            while pending is not None and pending.chrom != b.chrom and \
+                    order.get(pending.chrom, -1) < rank:
+                pending = next(wigs, None)
+        elif b.start < last.start:
+            raise ValueError('BED file is not sorted by start (%s after %s)' % (b, last))
+        last = b
+
+        # Add WIG features that start before this BED feature stops
+        while pending is not None and pending.chrom == b.chrom and pending.start < b.stop:
+            window.append(pending)
+            pending = next(wigs, None)
+
+        # WIG features starting before this BED feature can't be inside it or
+        # any later one.
+        while window and window[0].start < b.start:
+            window.popleft()
+
+        for w in window:
+            if w.start >= b.stop:
+                break
+            if w.stop <= b.stop:
+                yield w
+
+    # Check the order of the rest of the WIG
+    for w in wigs:
+        pass
+
 def write_wig(output_fn, wigs):
     '''If output_fn is an open file, then use that.  Otherwise, open a new file for writing.'''
     if type(output_fn) is str:
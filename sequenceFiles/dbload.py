@@ -0,0 +1,87 @@
+"""
+Module for bulk loading rows into sqlite3 databases.
+
+Inserting one row per execute() call, with sqlite's default journaling and
+syncing, spends most of its time in Python call overhead and disk syncs.  Here,
+rows are streamed through executemany() in batches inside a single
+transaction, with journaling and syncing relaxed for the duration of the load
+(and put back to whatever they were afterwards).
+Indexes should be created after the load, which is much faster than keeping
+them up to date row by row.
+
+Usage::
+
+    conn = sqlite3.connect('features.db')
+    n = bulk_load(conn, 'INSERT INTO features VALUES (?,?,?)', rows)
+    create_indexes(conn, 'features', [('idx_chrom_bin_start', 'chrom, bin, start')])
+"""
+import itertools
+
+# PRAGMAs used while loading.  The rollback journal is kept in memory so a
+# failed load can still be rolled back, but a crash mid-load can corrupt the
+# database -- in which case it's rebuilt anyway.
+LOAD_PRAGMAS = [('journal_mode', 'MEMORY'),
+                ('synchronous', 'OFF'),
+                ('locking_mode', 'EXCLUSIVE'),
+                ('cache_size', -200000),
+                ('temp_store', 'MEMORY')]
+
+# PRAGMAs used while creating indexes
+INDEX_PRAGMAS = [('cache_size', -200000),
+                 ('temp_store', 'MEMORY')]
+
+
+def get_pragmas(conn, pragmas):
+    """
+    Returns the current values of the PRAGMAs named in *pragmas* (a list of
+    (key, value) tuples like LOAD_PRAGMAS), in the same form.
+    """
+    return [(key, conn.execute('PRAGMA %s' % key).fetchone()[0]) for key, value in pragmas]
+
+
+def set_pragmas(conn, pragmas):
+    for key, value in pragmas:
+        conn.execute('PRAGMA %s = %s' % (key, value))
+
+
+def bulk_load(conn, sql, rows, batchsize=50000):
+    """
+    Inserts the tuples from the iterable *rows* using the INSERT statement
+    *sql*, *batchsize* rows per executemany() call, all in one transaction.
+    Returns the number of rows inserted.
+    """
+    saved = get_pragmas(conn, LOAD_PRAGMAS)
+    set_pragmas(conn, LOAD_PRAGMAS)
+    rows = iter(rows)
+    n = 0
+    try:
+        while True:
+            batch = list(itertools.islice(rows, batchsize))
+            if len(batch) == 0:
+                break
+            conn.executemany(sql, batch)
+            n += len(batch)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        set_pragmas(conn, saved)
+    return n
+
+
+def create_indexes(conn, table, indexes):
+    """
+    Creates the indexes in *indexes*, a list of (name, columns) tuples where
+    *columns* is a comma-separated string, on *table*.  Run this after
+    bulk_load().
+    """
+    saved = get_pragmas(conn, INDEX_PRAGMAS)
+    set_pragmas(conn, INDEX_PRAGMAS)
+    try:
+        for name, columns in indexes:
+            conn.execute('CREATE INDEX IF NOT EXISTS %s ON %s(%s)' % (name, table, columns))
+        conn.execute('ANALYZE %s' % table)
+        conn.commit()
+    finally:
+        set_pragmas(conn, saved)
@@ -11,9 +11,8 @@ Prints to stdout.
 
 import optparse
 import sys
-from Bio import SeqIO
 from cStringIO import StringIO
-from matplotlib import pyplot as p
+import plotting
 
 op = optparse.OptionParser()
 op.add_option('-i', dest='infn', help='Input FASTA-format file. If unspecified, use stdin.')
@@ -23,13 +22,9 @@ op.add_option('--hist-kwargs', dest='histkwargs', help='Comma-separated keyword
 op.add_option('-L', type=int, dest='L', help='Seqs < L will be filtered out')
 op.add_option('--upper', action='store_true', dest='upper',help='Force letters to be uppercase')
 
-if not options.input:
-    raise ValueError, 'Need an input file'
-if not options.L:
-    raise ValueError, 'Need a length to filter by'
-
 def _length_filter(handle,L):
     """Iterator that yields sequences >= L."""
+    from Bio import SeqIO
     for i in SeqIO.parse(handle,'fasta'):
         if len(i) >= L:
             s = i.seq.tostring()
@@ -41,6 +36,7 @@ def _length_filter(handle,L):
 
 def _fasta_lengths(handle):
     """Returns a list of seq lengths"""
+    from Bio import SeqIO
     lengths = []
     for i in SeqIO.parse(open(fin), 'fasta'):
         lengths.append(len(i))
@@ -87,10 +83,12 @@ def fastaSizeFilter(infile, outfile, L, hist=False, histkwargs=None, upper=False
         Default False.  If True, will plot a histogram of the lengths of records in 
         in *infile*.
     """
+    from Bio import SeqIO
     seq_iterator = _length_filter(infile, L)
     SeqIO.write(seq_iterator, outfile, 'fasta')
     kwargs = _parse_kwargs(histkwargs)
     if hist:
+        p = plotting.pyplot()
         fig = p.figure()
         ax = fig.add_subplot(111)
         ax.hist(_fasta_lengths(handle),**kwargs)
@@ -100,8 +98,14 @@ def fastaSizeFilter(infile, outfile, L, hist=False, histkwargs=None, upper=False
 
 if __name__ == "__main__":
     options,args = op.parse_args()
+    if not options.L:
+        raise ValueError, 'Need a length to filter by'
     if options.infn is None:
         infile = sys.stdin
     else:
         infile = open(options.infn)
+    if options.outfn is None:
+        outfile = sys.stdout
+    else:
+        outfile = open(options.outfn, 'w')
     fastaSizeFilter(infile, outfile, options.L, options.hist, options.histkwargs, options.upper)
@@ -0,0 +1,228 @@
+"""
+Module for region queries on the sqlite3 databases created by bed2db.py.
+
+Uses the R*Tree index if the database has one, and otherwise the UCSC bin
+column with the (chrom, bin, start) index.  Either way, a query only touches
+features near the query region instead of scanning a whole chromosome.
+
+Coordinates are 0-based, half-open as in BED files.  Results are
+bedparser.bedfeature objects sorted by start.
+
+Usage::
+
+    db = FeatureDB('features.db')
+    for feature in db.overlapping('chr2L', 10000, 20000):
+        print feature.name
+    closest = db.nearest('chr2L', 15000, k=3)
+    for region, features in db.batch('regions.bed'):
+        print region, len(features)
+
+For many queries against the same file, a ConnectionPool keeps several
+read-only connections open and spreads batches of queries over threads
+(sqlite releases the GIL while it runs a query)::
+
+    pool = ConnectionPool('features.db', size=4)
+    for region, features in pool.batch('regions.bed'):
+        ...
+    rows = pool.execute('SELECT * FROM features1 WHERE chrom=? AND bin=?', params)
+"""
+import Queue
+import sqlite3
+from multiprocessing.pool import ThreadPool
+import bedparser
+import binning
+
+COLUMNS = ('chrom, start, stop, name, value, strand, thickStart, thickStop, '
+           'itemRGB, blockCount, blockSizes, blockStarts')
+
+
+def _distance(feature, pos):
+    if feature.start <= pos < feature.stop:
+        return 0
+    if pos < feature.start:
+        return feature.start - pos
+    return pos - feature.stop + 1
+
+
+class FeatureDB(object):
+    def __init__(self, dbfn, conn=None):
+        """
+        Query interface for the database *dbfn* created by bed2db.bed2db().
+        An already-open connection can be given as *conn*.
+        """
+        self.dbfn = dbfn
+        if conn is None:
+            conn = sqlite3.connect(dbfn)
+        self.conn = conn
+        tables = [i[0] for i in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        self.has_rtree = 'features_rtree' in tables
+        self._chrom_ids = {}
+        self._chrom_stops = {}
+        if self.has_rtree:
+            self._chrom_ids = dict((chrom, i) for i, chrom in conn.execute('SELECT id, chrom FROM chroms'))
+
+    def _rows(self, chrom, start, stop):
+        if self.has_rtree:
+            chrom_id = self._chrom_ids.get(chrom)
+            if chrom_id is None:
+                return []
+            return self.conn.execute('''
+            SELECT %s FROM features
+            WHERE rowid IN (SELECT id FROM features_rtree
+                            WHERE chrom_min = ? AND start < ? AND stop > ?)
+            ORDER BY start
+            ''' % COLUMNS, (chrom_id, stop, start)).fetchall()
+
+        bins = binning.overlapping_bins(max(start, 0), max(stop, start, 1))
+        return self.conn.execute('''
+        SELECT %s FROM features
+        WHERE chrom = ? AND bin IN (%s) AND start < ? AND stop > ?
+        ORDER BY start
+        ''' % (COLUMNS, ','.join(map(str, bins))), (chrom, stop, start)).fetchall()
+
+    def overlapping(self, chrom, start, stop):
+        """
+        Returns a list of features overlapping *chrom*:*start*-*stop*.
+        """
+        return [bedparser.bedfeature(*row) for row in self._rows(chrom, start, stop)]
+
+    def chrom_stop(self, chrom):
+        """
+        Largest stop coordinate of any feature on *chrom*, or None.
+        """
+        if chrom not in self._chrom_stops:
+            self._chrom_stops[chrom] = self.conn.execute(
+                'SELECT max(stop) FROM features WHERE chrom = ?', (chrom,)).fetchone()[0]
+        return self._chrom_stops[chrom]
+
+    def nearest(self, chrom, pos, k=1):
+        """
+        Returns the *k* features closest to position *pos* on *chrom*, closest
+        first.  Features containing *pos* have distance 0.  Ties are broken by
+        start coordinate.
+        """
+        maxstop = self.chrom_stop(chrom)
+        if maxstop is None:
+            return []
+        # Search an expanding window until it holds at least k features that
+        # are no farther away than the window edge.
+        width = 1000
+        while True:
+            features = self.overlapping(chrom, max(pos - width, 0), pos + width + 1)
+            near = [f for f in features if _distance(f, pos) <= width]
+            if len(near) >= k or (pos - width <= 0 and pos + width >= maxstop):
+                break
+            width *= 4
+        near.sort(key=lambda f: (_distance(f, pos), f.start))
+        return near[:k]
+
+    def batch(self, regions):
+        """
+        Yields (region, features) for each region in *regions*, which is
+        either a BED filename or an iterable of objects with chr, start and
+        stop attributes.  *features* is the list of features overlapping the
+        region.
+        """
+        if isinstance(regions, basestring):
+            regions = bedparser.bedfile(regions)
+        for region in regions:
+            yield region, self.overlapping(region.chr, region.start, region.stop)
+
+    def close(self):
+        self.conn.close()
+
+
+class ConnectionPool(object):
+    def __init__(self, dbfn, size=4, mmap_size=256*1024*1024, wal=False):
+        """
+        Thread-safe pool of *size* read-only connections to *dbfn*, each with
+        its own page cache and memory-mapped I/O of up to *mmap_size* bytes.
+        If *wal*, the database file is switched to write-ahead logging first
+        (a lasting change to the file) so readers don't block, or get blocked
+        by, a writer.  Works with any of the databases made here -- bed2db,
+        binner -- though batch() needs the bed2db schema.
+        """
+        self.dbfn = dbfn
+        self.size = size
+        if wal:
+            conn = sqlite3.connect(dbfn)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.close()
+        self._queue = Queue.Queue()
+        self._connections = []
+        self._featuredbs = {}
+        for i in range(size):
+            conn = sqlite3.connect(dbfn, check_same_thread=False)
+            conn.execute('PRAGMA query_only = ON')
+            conn.execute('PRAGMA mmap_size = %d' % mmap_size)
+            self._connections.append(conn)
+            self._queue.put(conn)
+        self._threads = None
+
+    def acquire(self):
+        """
+        Takes a connection from the pool, waiting for one if they're all in
+        use.  Give it back with release().
+        """
+        return self._queue.get()
+
+    def release(self, conn):
+        self._queue.put(conn)
+
+    def _run_chunk(self, args):
+        func, chunk = args
+        conn = self.acquire()
+        try:
+            return [func(conn, item) for item in chunk]
+        finally:
+            self.release(conn)
+
+    def map(self, func, items, chunksize=50):
+        """
+        Returns [func(conn, item) for item in items], with chunks of
+        *chunksize* items handed out to threads that each hold a connection.
+        Results are in the same order as *items*.
+        """
+        items = list(items)
+        chunks = [(func, items[i:i + chunksize]) for i in range(0, len(items), chunksize)]
+        if self._threads is None:
+            self._threads = ThreadPool(self.size)
+        results = []
+        for chunk_results in self._threads.imap(self._run_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def execute(self, sql, params):
+        """
+        Runs *sql* once for each parameter tuple in *params*, returning a list
+        of the fetched rows for each.
+        """
+        return self.map(lambda conn, p: conn.execute(sql, p).fetchall(), params)
+
+    def featuredb(self, conn):
+        """
+        FeatureDB for a pooled connection.
+        """
+        if conn not in self._featuredbs:
+            self._featuredbs[conn] = FeatureDB(self.dbfn, conn=conn)
+        return self._featuredbs[conn]
+
+    def batch(self, regions):
+        """
+        Like FeatureDB.batch(), but queries are spread over the pool.  Returns
+        a list of (region, features) tuples in the same order as *regions*.
+        """
+        if isinstance(regions, basestring):
+            regions = bedparser.bedfile(regions)
+        regions = list(regions)
+        found = self.map(lambda conn, r: self.featuredb(conn).overlapping(r.chr, r.start, r.stop),
+                         regions)
+        return zip(regions, found)
+
+    def close(self):
+        if self._threads is not None:
+            self._threads.close()
+            self._threads.join()
+            self._threads = None
+        for conn in self._connections:
+            conn.close()
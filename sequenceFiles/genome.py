@@ -0,0 +1,242 @@
+"""
+Module for genome models used to place features at random: chromosome sizes,
+plus optional regions to exclude (e.g., gaps, repeats) or to restrict
+placements to (e.g., mappable regions).
+
+Regions are stored per chromosome as sorted, disjoint start and stop arrays,
+so random placements for many features and iterations are sampled with a few
+vectorized NumPy calls.
+
+Usage::
+
+    genome = Genome.from_files('dm3.chrom.sizes', exclude='gaps.bed')
+    print genome.effective_size()
+    starts = genome.random_starts('chr2L', lengths, 1000, np.random.RandomState(0))
+"""
+import hashlib
+import numpy as np
+
+# Number of times a random position is redrawn before sampling directly from
+# the valid positions
+REJECTION_ROUNDS = 8
+
+
+def merge_intervals(starts, stops):
+    """
+    Returns (starts, stops) of the disjoint intervals made by merging the
+    overlapping intervals *starts* to *stops*.  *starts* must be sorted.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    stops = np.asarray(stops, dtype=np.int64)
+    if len(starts) == 0:
+        return starts, stops
+    # A new merged interval starts wherever an interval starts at or after
+    # the furthest stop seen so far.
+    maxstop = np.maximum.accumulate(stops)
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] >= maxstop[:-1]
+    first = np.flatnonzero(new)
+    last = np.r_[first[1:], len(starts)] - 1
+    return starts[first], maxstop[last]
+
+
+def _covered(points, starts, stops):
+    """
+    Boolean array, True for each of *points* inside one of the disjoint
+    intervals *starts* to *stops*.
+    """
+    if len(starts) == 0:
+        return np.zeros(len(points), dtype=bool)
+    idx = np.searchsorted(stops, points, side='right')
+    inside = idx < len(starts)
+    inside &= starts[np.minimum(idx, len(starts) - 1)] <= points
+    return inside
+
+
+def subtract_intervals(starts, stops, xstarts, xstops):
+    """
+    Returns the parts of the disjoint intervals *starts* to *stops* that
+    aren't in the disjoint intervals *xstarts* to *xstops*.
+    """
+    points = np.unique(np.r_[starts, stops, xstarts, xstops])
+    keep = _covered(points[:-1], starts, stops) & ~_covered(points[:-1], xstarts, xstops)
+    return merge_intervals(points[:-1][keep], points[1:][keep])
+
+
+def read_regions(fn):
+    """
+    Reads a BED file into a dict of chrom: (starts, stops) of merged
+    regions.
+    """
+    coords = {}
+    for line in open(fn):
+        if line.startswith(('track', 'browser', '#')):
+            continue
+        L = line.split('\t', 3)
+        if len(L) < 3:
+            continue
+        c = coords.setdefault(L[0], ([], []))
+        c[0].append(int(L[1]))
+        c[1].append(int(L[2]))
+    regions = {}
+    for chrom, (starts, stops) in coords.items():
+        starts = np.array(starts, dtype=np.int64)
+        stops = np.array(stops, dtype=np.int64)
+        ind = np.argsort(starts, kind='mergesort')
+        regions[chrom] = merge_intervals(starts[ind], stops[ind])
+    return regions
+
+
+def read_sizes(fn):
+    """
+    Reads chromosome sizes from a chrom.sizes file (chrom, size) or a BED
+    file of chromosomes (size is the largest stop).
+    """
+    sizes = {}
+    for line in open(fn):
+        if line.startswith(('track', 'browser', '#')) or not line.strip():
+            continue
+        L = line.split()
+        size = int(L[1]) if len(L) == 2 else int(L[2])
+        sizes[L[0]] = max(size, sizes.get(L[0], 0))
+    return sizes
+
+
+class Genome(object):
+    def __init__(self, sizes, exclude=None, include=None):
+        """
+        Genome model from *sizes*, a dict of chrom: size.  *exclude* and
+        *include* are optional dicts of chrom: (starts, stops) of merged
+        regions (see read_regions()).  Random placements avoid *exclude*, and
+        if *include* is given they are restricted to it.
+        """
+        self.sizes = dict(sizes)
+        self.regions = {}
+        for chrom, size in self.sizes.items():
+            if include is None and (exclude is None or chrom not in exclude):
+                # The whole chromosome; keep the fast path.
+                self.regions[chrom] = None
+                continue
+            empty = np.zeros(0, dtype=np.int64)
+            if include is None:
+                starts, stops = np.array([0]), np.array([size])
+            else:
+                starts, stops = include.get(chrom, (empty, empty))
+                starts = np.clip(starts, 0, size)
+                stops = np.clip(stops, 0, size)
+            if exclude is not None and chrom in exclude:
+                starts, stops = subtract_intervals(starts, stops, *exclude[chrom])
+            self.regions[chrom] = (np.asarray(starts, dtype=np.int64),
+                                   np.asarray(stops, dtype=np.int64))
+
+    @classmethod
+    def from_files(cls, sizes, exclude=None, include=None):
+        """
+        Genome model from a chrom.sizes file and optional BED files of
+        regions to exclude or include.
+        """
+        if exclude is not None:
+            exclude = read_regions(exclude)
+        if include is not None:
+            include = read_regions(include)
+        return cls(read_sizes(sizes), exclude, include)
+
+    # Dictionary-style access to chromosome sizes
+    def __getitem__(self, chrom):
+        return self.sizes[chrom]
+
+    def __contains__(self, chrom):
+        return chrom in self.sizes
+
+    def chroms(self):
+        return sorted(self.sizes.keys())
+
+    def allowed(self, chrom):
+        """
+        Returns (starts, stops) of the regions on *chrom* where features can
+        be placed.
+        """
+        if self.regions[chrom] is None:
+            return np.array([0], dtype=np.int64), np.array([self.sizes[chrom]], dtype=np.int64)
+        return self.regions[chrom]
+
+    def effective_size(self, chrom=None):
+        """
+        Number of bp available for random placements on *chrom*, or in the
+        whole genome.
+        """
+        if chrom is None:
+            return sum(self.effective_size(c) for c in self.sizes)
+        starts, stops = self.allowed(chrom)
+        return int((stops - starts).sum())
+
+    def regions_key(self):
+        """
+        Hex digest identifying the allowed regions, for caching, or None if
+        features can go anywhere on their chromosomes.
+        """
+        restricted = [c for c in self.chroms() if self.regions[c] is not None]
+        if not restricted:
+            return None
+        h = hashlib.md5()
+        for chrom in restricted:
+            h.update(chrom)
+            h.update(self.regions[chrom][0].tostring())
+            h.update(self.regions[chrom][1].tostring())
+        return h.hexdigest()
+
+    def random_starts(self, chrom, lengths, n, random_state):
+        """
+        Returns an (*n* x len(*lengths*)) array of random start positions on
+        *chrom* for features of *lengths*, each one uniform over the positions
+        where the whole feature fits inside the allowed regions.
+        """
+        if chrom not in self.sizes:
+            raise ValueError('Chromosome %s is not in the genome' % chrom)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        room = np.maximum(self.sizes[chrom] - lengths, 0) + 1
+        starts = (random_state.random_sample((n, len(lengths))) * room).astype(np.int64)
+        if self.regions[chrom] is None:
+            return starts
+
+        # Redraw the starts that put a feature outside the allowed regions
+        # a few times; that's cheap when little of the chromosome is
+        # excluded.  Any left over (features that fit in few places) are
+        # drawn directly from their valid positions, one length at a time.
+        rstarts, rstops = self.regions[chrom]
+        longest = (rstops - rstarts).max() if len(rstarts) else 0
+        if len(lengths) and lengths.max() > longest:
+            raise ValueError('A feature of length %s does not fit in any allowed '
+                             'region on %s' % (lengths.max(), chrom))
+        lengths = np.broadcast_to(lengths, starts.shape).ravel()
+        room = np.broadcast_to(room, starts.shape).ravel()
+        flat = starts.ravel()
+        todo = np.arange(len(flat))
+        for i in range(REJECTION_ROUNDS + 1):
+            s = flat[todo]
+            idx = np.minimum(np.searchsorted(rstops, s, side='right'), len(rstops) - 1)
+            ok = (rstarts[idx] <= s) & (s + lengths[todo] <= rstops[idx])
+            todo = todo[~ok]
+            if len(todo) == 0 or i == REJECTION_ROUNDS:
+                break
+            flat[todo] = (random_state.random_sample(len(todo)) * room[todo]).astype(np.int64)
+
+        for length in np.unique(lengths[todo]):
+            these = todo[lengths[todo] == length]
+            # Number of valid starts in each region, and a uniform pick among
+            # all of them
+            valid = np.maximum(rstops - rstarts - length + 1, 0)
+            cumulative = np.cumsum(valid)
+            pick = (random_state.random_sample(len(these)) * cumulative[-1]).astype(np.int64)
+            region = np.searchsorted(cumulative, pick, side='right')
+            flat[these] = rstarts[region] + pick - (cumulative[region] - valid[region])
+        return flat.reshape(starts.shape)
+
+
+def as_genome(genome):
+    """
+    Returns *genome* as a Genome, converting a dict of chrom: size.
+    """
+    if isinstance(genome, Genome):
+        return genome
+    return Genome(genome)
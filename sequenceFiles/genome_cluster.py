@@ -6,6 +6,10 @@
 Usage example::
 
 """
+import itertools
+import multiprocessing
+import numpy as np
+
 class Cluster(object):
     
     def __init__(self,feature=None, forceclustersize=None, scorefunc=None, minclustersize=None, minclusterscore=None, minfeaturecount=None, gapwidth=None, threshold=None):
@@ -157,103 +161,832 @@ def bed_iterator(fn,forcevalue=None):
         yield Feature(chrom, int(start), int(stop),v)
 
 
-def brennecke_cluster(fn):
+class FeatureArrays(object):
+    """
+    Column arrays for a sorted BED file: *chroms* is the list of chromosome
+    names in the order they were seen, *chrom* holds an index into *chroms*
+    for each feature, and *start*, *stop* and *value* are NumPy arrays.
+    """
+    def __init__(self, chroms, chrom, start, stop, value):
+        self.chroms = chroms
+        self.chrom = np.asarray(chrom, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.stop = np.asarray(stop, dtype=np.int64)
+        self.value = np.asarray(value, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.start)
+
+def _bed_chunk(lines, nfields):
+    """
+    Splits *lines* into a list of columns, the first *nfields* fields of each
+    line.  Tokenizes all lines at once if they have the same number of fields.
+    """
+    tokens = ''.join(lines).split()
+    n = len(tokens) // len(lines)
+    if n >= nfields and n * len(lines) == len(tokens) and len(lines[0].split()) == n:
+        return [tokens[i::n] for i in range(nfields)]
+    rows = [line.split() for line in lines]
+    return [[L[i] for L in rows] for i in range(nfields)]
+
+def _encode_chroms(names, chroms, chromidx):
+    """
+    Returns an array of indexes into the list *chroms* for the chrom *names*,
+    adding any new names to *chroms* (and the name-to-index dict *chromidx*)
+    in the order they were first seen.
+    """
+    if len(names) == 0:
+        return np.zeros(0, dtype=np.int32)
+    unique, firstseen, inverse = np.unique(names, return_index=True,
+                                           return_inverse=True)
+    codes = np.empty(len(unique), dtype=np.int32)
+    for i in np.argsort(firstseen):
+        name = str(unique[i])
+        if name not in chromidx:
+            chromidx[name] = len(chroms)
+            chroms.append(name)
+        codes[i] = chromidx[name]
+    return codes[inverse]
+
+def _range_lines(f, length):
+    """
+    Yields lines from open file *f* until *length* bytes have been read.
+    """
+    for line in f:
+        if length <= 0:
+            break
+        length -= len(line)
+        yield line
+
+def bed_blocks(fn):
+    """
+    Returns a list of (offset, length) byte ranges of *fn*, one for each run
+    of lines on the same chrom.  Track and browser lines go along with the
+    block they're in.
+    """
+    blocks = []
+    offset = 0
+    block_start = 0
+    prefix = None
+    current = None
+    for line in open(fn):
+        if (prefix is None or not line.startswith(prefix)) and \
+                'track' not in line and 'browser' not in line:
+            chrom = line.split(None, 1)[0]
+            if chrom != current:
+                if current is not None:
+                    blocks.append((block_start, offset - block_start))
+                    block_start = offset
+                current = chrom
+                prefix = chrom + '\t'
+        offset += len(line)
+    if offset > block_start:
+        blocks.append((block_start, offset - block_start))
+    return blocks
+
+def bed_arrays(fn, forcevalue=None, chunksize=500000, offset=0, length=None):
+    """
+    Same as bed_iterator, but returns a FeatureArrays instance holding all the
+    features in *fn*.  The file is parsed *chunksize* lines at a time.
+
+    If *length* is given, only that many bytes starting at *offset* are
+    parsed (see bed_blocks()).
+    """
+    chroms = []
+    chromidx = {}
+    parts = []
+    if forcevalue:
+        nfields = 3
+    else:
+        nfields = 5
+    fh = open(fn)
+    if length is not None:
+        fh.seek(offset)
+        f = _range_lines(fh, length)
+    else:
+        f = fh
+    while True:
+        lines = list(itertools.islice(f, chunksize))
+        if len(lines) == 0:
+            break
+        lines = [line for line in lines if 'track' not in line and 'browser' not in line]
+        if len(lines) == 0:
+            continue
+        cols = _bed_chunk(lines, nfields)
+
+        codes = _encode_chroms(cols[0], chroms, chromidx)
+        start = np.array(map(int, cols[1]), dtype=np.int64)
+        stop = np.array(map(int, cols[2]), dtype=np.int64)
+        if not forcevalue:
+            try:
+                value = np.array(map(float, cols[4]), dtype=np.float64)
+            except ValueError:
+                raise ValueError, 'Need to specify a value since there is not one in the bed file.'
+        else:
+            value = np.zeros(len(start)) + forcevalue
+        parts.append((codes, start, stop, value))
+    fh.close()
+    if len(parts) == 0:
+        return FeatureArrays(chroms, [], [], [], [])
+    return FeatureArrays(chroms, *[np.concatenate(p) for p in zip(*parts)])
+
+def _segment_sums(values, first, end, maxlen=256):
+    """
+    Sums of values[first[i]:end[i]] for each i, added up left-to-right like
+    the builtin sum() so that results match Cluster.clusterscore exactly
+    (np.add.reduceat uses pairwise summation).
+
+    Works one position at a time across all segments, so the Python loop is
+    only as long as the longest segment.  Segments longer than *maxlen* are
+    summed one at a time instead.
+    """
+    counts = end - first
+    sums = np.zeros(len(first))
+    if len(first) == 0:
+        return sums
+    for i in np.flatnonzero(counts > maxlen):
+        sums[i] = sum(values[first[i]:end[i]].tolist())
+        counts[i] = 0
+    order = np.argsort(-counts, kind='mergesort')
+    f = first[order]
+    c = counts[order]
+    neg_c = -c
+    acc = np.zeros(len(f))
+    for k in xrange(c[0]):
+        nactive = np.searchsorted(neg_c, -k, side='left')
+        acc[:nactive] += values[f[:nactive] + k]
+    is_long = c == 0
+    acc[is_long] = sums[order][is_long]
+    sums[order] = acc
+    return sums
+
+class Clusters(object):
+    """
+    Array version of a sequence of Cluster objects, as created by
+    cluster_arrays().  Cluster *i* is made of features first[i]:end[i].
+
+    As with Cluster, the very first cluster in a file has no chrom (None), and
+    its clusterscore includes its first feature while the others' do not.
+    *file_start* says whether *features* start at the beginning of the file.
+    """
+    def __init__(self, features, first, end, start, file_start=True):
+        self.features = features
+        self.file_start = file_start
+        self.first = first
+        self.end = end
+        self.start = start
+        self.stop = features.stop[end - 1]
+        self.count = end - first
+        self._score = None
+        self._total = None
+        self._unique = None
+
+    def __len__(self):
+        return len(self.first)
+
+    @property
+    def chrom(self):
+        """
+        List of chromosome names, one per cluster.
+        """
+        names = [self.features.chroms[i] for i in self.features.chrom[self.first]]
+        if len(names) > 0 and self.file_start:
+            names[0] = None
+        return names
+
+    @property
+    def length(self):
+        """
+        Same as len(Cluster): a cluster starting at 0 has a length of 0.
+        """
+        return np.where(self.start != 0, self.stop - self.start, 0)
+
+    @property
+    def score(self):
+        """
+        Same as Cluster.clusterscore: sum of the values of all but the first
+        feature of each cluster (except for the very first cluster).
+        """
+        if self._score is None:
+            self._score = _segment_sums(self.features.value, self.first + 1 - self._whole(),
+                                        self.end)
+        return self._score
+
+    @property
+    def score_count(self):
+        """
+        Number of features that went into each score.
+        """
+        return self.count - 1 + self._whole()
+
+    def _whole(self):
+        """
+        1 for clusters whose score includes the first feature, else 0.
+        """
+        whole = np.zeros(len(self), dtype=np.int64)
+        if self.file_start:
+            whole[:1] = 1
+        return whole
+
+    @property
+    def total(self):
+        """
+        Sum of the values of all features in each cluster.
+        """
+        if self._total is None:
+            self._total = _segment_sums(self.features.value, self.first, self.end)
+        return self._total
+
+    @property
+    def unique(self):
+        """
+        Same as Cluster.unique_features(): number of features in each cluster
+        with unique chrom, start, stop.
+        """
+        if self._unique is None:
+            f = self.features
+            n = len(f)
+            cluster_id = np.zeros(n, dtype=np.int64)
+            cluster_id[self.first[1:]] = 1
+            cluster_id = np.cumsum(cluster_id)
+            ind = np.lexsort((f.chrom, f.stop, f.start, cluster_id))
+            new = np.ones(n, dtype=bool)
+            new[1:] = ((cluster_id[ind][1:] != cluster_id[ind][:-1]) |
+                       (f.start[ind][1:] != f.start[ind][:-1]) |
+                       (f.stop[ind][1:] != f.stop[ind][:-1]) |
+                       (f.chrom[ind][1:] != f.chrom[ind][:-1]))
+            self._unique = np.bincount(cluster_id[ind][new], minlength=len(self))
+        return self._unique
+
+    def check_yield(self, minclustersize=None, minfeaturecount=None,
+                    forceclustersize=None, minclusterscore=None, file_end=True):
+        """
+        Same as Cluster.check_yield() for all clusters at once.  Returns a
+        boolean mask of clusters to yield, and updates self.stop for clusters
+        that are smaller than *forceclustersize*.
+
+        The last cluster in the file is never included, since the loops this
+        replaces never yielded it; set *file_end* to False if these clusters
+        don't run up to the end of the file.
+        """
+        length = self.length
+        mask = np.ones(len(self), dtype=bool)
+        if minclustersize:
+            mask &= ~(length < minclustersize)
+        if minfeaturecount:
+            mask &= ~(self.count < minfeaturecount)
+        if forceclustersize:
+            self.stop = np.where(length < forceclustersize,
+                                 self.start + forceclustersize - 1, self.stop)
+        if minclusterscore:
+            mask &= ~(self.score < minclusterscore)
+        if len(mask) > 0 and file_end:
+            mask[-1] = False
+        return mask
+
+    def tostrings(self, mask, values):
+        """
+        Yields the Cluster.tostring() line for each cluster in *mask*, using
+        *values* for the value field.
+        """
+        chroms = self.chrom
+        for i in np.flatnonzero(mask):
+            yield '%s\t%s\t%s\t%s\t%s\t%s\n' % (chroms[i], self.start[i], self.stop[i], '.', values[i], '+')
+
+def _force_break(start, stop, i, nb, forceclustersize):
+    """
+    Index of the first feature after *i* (and before *nb*) that would take a
+    cluster starting with feature *i* past *forceclustersize*.  Returns *nb*
+    if there is none.
+    """
+    cstart = start[i]
+    j = i + 1
+
+    # Cluster.extend() only sets the start if it's not already set, and a start
+    # of 0 counts as not set.
+    while cstart == 0 and j < nb:
+        if stop[j] - cstart > forceclustersize:
+            return j
+        cstart = start[j]
+        j += 1
+
+    # Look in growing windows so this is proportional to the cluster size,
+    # not the distance to the next break.
+    limit = cstart + forceclustersize
+    window = 64
+    while j < nb:
+        k = min(j + window, nb)
+        hits = np.flatnonzero(stop[j:k] > limit)
+        if len(hits) > 0:
+            return j + hits[0]
+        j = k
+        window *= 2
+    return nb
+
+def cluster_arrays(features, gapwidth=None, threshold=None, forceclustersize=None,
+                   file_start=True):
+    """
+    Array version of building clusters with Cluster.check_feature() and
+    Cluster.extend() over the sorted FeatureArrays *features*.  Returns a
+    Clusters instance.
+
+    Breaks from chrom changes, gaps of at least *gapwidth*, and values under
+    *threshold* are found with array operations.  If *forceclustersize* is
+    given, clusters are also split when they would get larger than that, which
+    needs one small search per cluster.
+
+    Set *file_start* to False if *features* don't start at the beginning of
+    the file, so the first cluster is treated like any other.
+    """
+    n = len(features)
+    start = features.start
+    stop = features.stop
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return Clusters(features, empty, empty, empty, file_start)
+
+    static = np.zeros(n, dtype=bool)
+    if gapwidth is not None:
+        static[1:] |= (start[1:] - stop[:-1]) >= gapwidth
+    if threshold is not None:
+        static |= features.value < threshold
+    static[0] = False
+
+    # The first cluster in the file has no chrom, so chrom changes don't split
+    # it.
+    first_breaks = np.flatnonzero(static)
+    static[1:] |= features.chrom[1:] != features.chrom[:-1]
+    breaks = np.flatnonzero(static)
+    if not file_start:
+        first_breaks = breaks
+
+    if len(first_breaks) > 0:
+        end0 = first_breaks[0]
+    else:
+        end0 = n
+    if forceclustersize:
+        end0 = _force_break(start, stop, 0, end0, forceclustersize)
+
+    if not forceclustersize:
+        first = np.concatenate(([0], [end0], breaks[breaks > end0]))
+        first = first[first < n].astype(np.int64)
+    else:
+        # Next break after each feature
+        k = np.searchsorted(breaks, np.arange(n), side='right')
+        next_break = np.append(breaks, n)[k]
+
+        # For sorted input, the feature that takes a cluster past
+        # forceclustersize can be found for every possible cluster start at
+        # once by searching the running maximum of the stops (reset on each
+        # chrom).  This is only trusted when the hit really is past the limit
+        # and comes after the cluster start; otherwise fall back to
+        # _force_break().
+        block = np.zeros(n, dtype=np.int64)
+        block[1:] = np.cumsum(features.chrom[1:] != features.chrom[:-1])
+        offset = block << 40
+        runmax = np.maximum.accumulate(stop + offset)
+        limit = start + forceclustersize + offset
+        hit = np.searchsorted(runmax, limit, side='right')
+        hit_stop = np.append(stop + offset, 0)[hit]
+        trusted = (hit > np.arange(n)) & ((hit == n) | (hit_stop > limit)) & (start != 0)
+
+        hit = hit.tolist()
+        next_break = next_break.tolist()
+        trusted = trusted.tolist()
+        first = [0]
+        i = end0
+        while i < n:
+            first.append(i)
+            nb = next_break[i]
+            if trusted[i]:
+                i = min(hit[i], nb)
+            else:
+                i = _force_break(start, stop, i, nb, forceclustersize)
+        first = np.array(first, dtype=np.int64)
+
+    end = np.empty_like(first)
+    end[:-1] = first[1:]
+    end[-1] = n
+
+    # Cluster starts are the first feature's start, except for the Cluster.extend()
+    # quirk where a start of 0 gets replaced by the next feature's start.
+    cstart = start[first].copy()
+    for i in np.flatnonzero(cstart == 0):
+        nonzero = np.flatnonzero(start[first[i]:end[i]])
+        if len(nonzero) > 0:
+            cstart[i] = start[first[i] + nonzero[0]]
+
+    return Clusters(features, first, end, cstart, file_start)
+
+def _legacy_values(values, counts):
+    """
+    Converts summed values to what sum() over a list would have given: floats,
+    or the int 0 for an empty list.
+    """
+    return [float(v) if c > 0 else 0 for v, c in zip(values, counts)]
+
+def selected_features(clusters, mask, values):
+    """
+    Returns a FeatureArrays of the clusters in *mask*, with *values*, exactly
+    as bed_arrays() would read them back in after writing them out with
+    Clusters.tostrings().  Used to feed one clustering stage into the next
+    without a file in between.
+    """
+    idx = np.flatnonzero(mask)
+    allchroms = clusters.chrom
+    names = [str(allchroms[i]) for i in idx]
+    chroms = []
+    codes = _encode_chroms(names, chroms, {})
+    # values go through str() on the way out and float() on the way back in
+    value = [float(str(values[i])) for i in idx]
+    return FeatureArrays(chroms, codes, clusters.start[idx], clusters.stop[idx], value)
+
+# Each clustering stage takes a FeatureArrays and returns (clusters, mask,
+# values) where *mask* selects the clusters to output and *values* are what
+# goes in the value field.  *file_start* and *file_end* say whether the
+# features are the start and end of the file (see cluster_arrays() and
+# Clusters.check_yield()); they are only False when a file is split up.
+
+def brennecke_stage1(features, file_start=True, file_end=True):
     kwargs = {'gapwidth':  1e15,
               'threshold': 0,
               'minclusterscore':5,
               'forceclustersize': 5000}
-
-    fn1 = fn+'.bren.clusters'
-    fout = open(fn1,'w')
-    fout.write('track name="5-kb windows"\n')
-    cluster = Cluster(**kwargs)
-    for feature in bed_iterator(fn):
-        if cluster.check_feature(feature):
-            cluster.extend(feature)
-        else:
-            if cluster.check_yield():
-                if cluster.chrom:
-                    cluster.value = cluster.clusterscore
-                    fout.write(cluster.tostring())
-            cluster = Cluster(feature=feature, **kwargs)
-    fout.close() 
- 
+    clusters = cluster_arrays(features, kwargs['gapwidth'], kwargs['threshold'],
+                              kwargs['forceclustersize'], file_start)
+    mask = clusters.check_yield(minclusterscore=kwargs['minclusterscore'],
+                                forceclustersize=kwargs['forceclustersize'],
+                                file_end=file_end)
+    # first cluster has no chrom
+    if file_start:
+        mask[:1] = False
+    values = _legacy_values(clusters.score, clusters.score_count)
+    return clusters, mask, values
+
+def brennecke_stage2(features, file_start=True, file_end=True):
     kwargs = {'gapwidth':  20000,
               'threshold': 0,
               'minfeaturecount': None,
               'minclustersize': None,
               'forceclustersize': None}
-    
-    fn2 = fn1+'.clustered'
-    fout = open(fn2,'w')
-    fout.write('track name="clustered"\n')
-    cluster = Cluster(**kwargs)
-    for feature in bed_iterator(fn1):
-        if cluster.check_feature(feature):
-            cluster.extend(feature)
-        else:
-            if cluster.check_yield():
-                if cluster.chrom:
-                    fout.write(cluster.tostring())
-            cluster = Cluster(feature=feature, **kwargs)
-    fout.close()
-   
-
-def hannon_cluster(fn):
+    clusters = cluster_arrays(features, kwargs['gapwidth'], kwargs['threshold'],
+                              file_start=file_start)
+    mask = clusters.check_yield(file_end=file_end)
+    if file_start:
+        mask[:1] = False
+    return clusters, mask, np.zeros(len(clusters), dtype=int)
+
+def hannon_stage1(features, file_start=True, file_end=True):
     unique_features = 3
-
     kwargs = {'gapwidth':  1e15,
               'threshold': 1,
               'minfeaturecount': 3,
               'minclustersize': 1,
               'forceclustersize': 200}
-    fn1 = fn+'.clusters'
-    fout = open(fn1,'w')
-    cluster = Cluster(**kwargs)
-    for feature in bed_iterator(fn,2):
-        if cluster.check_feature(feature):
-            cluster.extend(feature)
-        else:
-            if cluster.check_yield():
-                if cluster.unique_features() >= unique_features:
-                    cluster.value = cluster.unique_features()
-                    fout.write(cluster.tostring())
-            cluster = Cluster(feature=feature, **kwargs)
-    fout.close() 
-
+    clusters = cluster_arrays(features, kwargs['gapwidth'], kwargs['threshold'],
+                              kwargs['forceclustersize'], file_start)
+    mask = clusters.check_yield(minclustersize=kwargs['minclustersize'],
+                                minfeaturecount=kwargs['minfeaturecount'],
+                                forceclustersize=kwargs['forceclustersize'],
+                                file_end=file_end)
+    mask &= clusters.unique >= unique_features
+    return clusters, mask, clusters.unique
+
+def hannon_stage2(features, file_start=True, file_end=True):
     kwargs = {'gapwidth':  200,
               'threshold': 1,
               'minfeaturecount': None,
               'minclustersize': None,
               'forceclustersize': None}
-    
-    fn2 = fn1+'.clustered'
-    fout = open(fn2,'w')
-    cluster = Cluster(**kwargs)
-    for feature in bed_iterator(fn1):
-        if cluster.check_feature(feature):
-            cluster.extend(feature)
+    clusters = cluster_arrays(features, kwargs['gapwidth'], kwargs['threshold'],
+                              file_start=file_start)
+    mask = clusters.check_yield(file_end=file_end)
+    mask &= clusters.total > 40
+    return clusters, mask, np.zeros(len(clusters), dtype=int)
+
+# Pipelines are lists of (stage, filename suffix, track line) tuples.  Each
+# stage's suffix is added on to the previous stage's filename.
+BRENNECKE = [(brennecke_stage1, '.bren.clusters', 'track name="5-kb windows"\n'),
+             (brennecke_stage2, '.clustered', 'track name="clustered"\n')]
+
+HANNON = [(hannon_stage1, '.clusters', None),
+          (hannon_stage2, '.clustered', None)]
+
+def run_pipeline(features, stages, prefix=None, intermediate=False):
+    """
+    Runs the clustering *stages* on the FeatureArrays *features*, passing
+    each stage's output straight to the next one in memory.
+
+    If *prefix* is given, the last stage's output is written to *prefix* plus
+    all the stage suffixes; if *intermediate* is True, the output of every
+    stage is written as well.
+
+    Returns the (clusters, mask, values) from the last stage.
+    """
+    outfn = prefix
+    for i, (stage, suffix, trackline) in enumerate(stages):
+        clusters, mask, values = stage(features)
+        last = i == len(stages) - 1
+        if prefix is not None:
+            outfn += suffix
+            if last or intermediate:
+                fout = open(outfn, 'w')
+                if trackline:
+                    fout.write(trackline)
+                fout.writelines(clusters.tostrings(mask, values))
+                fout.close()
+        if not last:
+            features = selected_features(clusters, mask, values)
+    return clusters, mask, values
+
+def concat_features(parts):
+    """
+    Concatenates a list of FeatureArrays into one.
+    """
+    chroms = []
+    chromidx = {}
+    codes = []
+    for f in parts:
+        names = [f.chroms[i] for i in f.chrom]
+        codes.append(_encode_chroms(names, chroms, chromidx))
+    if len(parts) == 0:
+        return FeatureArrays(chroms, [], [], [], [])
+    return FeatureArrays(chroms, np.concatenate(codes),
+                         np.concatenate([f.start for f in parts]),
+                         np.concatenate([f.stop for f in parts]),
+                         np.concatenate([f.value for f in parts]))
+
+def _partition_worker(args):
+    """
+    Parses one byte range of a BED file and runs one clustering stage on it.
+    Returns the selected clusters as FeatureArrays, their lines if
+    *keep_lines*, and whether the file's first cluster ran into the end of the
+    range (in which case the split isn't safe).
+    """
+    fn, offset, length, forcevalue, stage, file_start, file_end, keep_lines = args
+    features = bed_arrays(fn, forcevalue, offset=offset, length=length)
+    clusters, mask, values = stage(features, file_start, file_end)
+    spans = file_start and not file_end and len(clusters) > 0 and \
+            clusters.end[0] == len(features)
+    lines = None
+    if keep_lines:
+        lines = ''.join(clusters.tostrings(mask, values))
+    return selected_features(clusters, mask, values), lines, spans
+
+def run_pipeline_parallel(fn, stages, forcevalue=None, prefix=None,
+                          intermediate=False, processes=None):
+    """
+    Same as running run_pipeline() on bed_arrays(*fn*, *forcevalue*), but the
+    file is split up by chrom and the first stage -- which has the most
+    features -- is run on each piece in a pool of *processes* workers
+    (default is one per CPU).  Later stages work on the (much smaller)
+    combined output in this process.
+
+    Clusters never span chroms, so the output is the same as the serial
+    version.  The exception is the chrom-less first cluster in the file; if
+    it doesn't end within the first chrom, this falls back to the serial
+    version.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    blocks = bed_blocks(fn)
+
+    # Group adjacent small chroms together so there are a few jobs per worker
+    total = sum(length for offset, length in blocks)
+    target = max(total // (4 * processes), 1)
+    groups = []
+    for offset, length in blocks:
+        if len(groups) > 0 and groups[-1][1] < target:
+            groups[-1][1] += length
+        else:
+            groups.append([offset, length])
+
+    if processes == 1 or len(groups) < 2:
+        return run_pipeline(bed_arrays(fn, forcevalue), stages, prefix, intermediate)
+
+    stage, suffix, trackline = stages[0]
+    keep_lines = prefix is not None and (intermediate or len(stages) == 1)
+    jobs = []
+    for i, (offset, length) in enumerate(groups):
+        jobs.append((fn, offset, length, forcevalue, stage, i == 0,
+                     i == len(groups) - 1, keep_lines))
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_partition_worker, jobs)
+    finally:
+        pool.terminate()
+
+    if results[0][2]:
+        return run_pipeline(bed_arrays(fn, forcevalue), stages, prefix, intermediate)
+
+    if keep_lines:
+        fout = open(prefix + suffix, 'w')
+        if trackline:
+            fout.write(trackline)
+        for selected, lines, spans in results:
+            fout.write(lines)
+        fout.close()
+
+    features = concat_features([selected for selected, lines, spans in results])
+    if len(stages) == 1:
+        return features
+    if prefix is not None:
+        prefix += suffix
+    return run_pipeline(features, stages[1:], prefix, intermediate)
+
+def brennecke_cluster(fn, intermediate=False, processes=1):
+    run_pipeline_parallel(fn, BRENNECKE, prefix=fn, intermediate=intermediate,
+                          processes=processes)
+
+def hannon_cluster(fn, intermediate=False, processes=1):
+    run_pipeline_parallel(fn, HANNON, forcevalue=2, prefix=fn,
+                          intermediate=intermediate, processes=processes)
+
+# Parameters that change how features are split into clusters, and ones that
+# only change which clusters are kept.
+CLUSTER_PARAMS = ['gapwidth', 'threshold', 'forceclustersize']
+FILTER_PARAMS = ['minfeaturecount', 'minclusterscore']
+SWEEP_PARAMS = CLUSTER_PARAMS + FILTER_PARAMS
+
+SWEEP_FIELDS = SWEEP_PARAMS + ['clusters', 'features', 'mean_length',
+                               'median_length', 'mean_score', 'max_score']
+
+# Set by sweep() before the worker processes are forked, so each worker sees
+# the parsed features without having to pickle them.
+_sweep_features = None
+
+def sweep_one(features, params, filters=None, bedfns=None):
+    """
+    Clusters *features* with the CLUSTER_PARAMS in dict *params* (missing keys
+    are None), then for each dict of FILTER_PARAMS in *filters* returns a dict
+    of summary stats for the clusters that would be yielded.  Clustering is
+    only done once no matter how many filters there are.
+
+    If *bedfns* is given, it's a list of filenames, one per filter, to write
+    the kept clusters to (with their scores as values).
+    """
+    if filters is None:
+        filters = [params]
+    if bedfns is None:
+        bedfns = [None] * len(filters)
+    cluster_params = dict((k, params.get(k)) for k in CLUSTER_PARAMS)
+    clusters = cluster_arrays(features, cluster_params['gapwidth'],
+                              cluster_params['threshold'],
+                              cluster_params['forceclustersize'])
+    results = []
+    for filt, bedfn in zip(filters, bedfns):
+        mask = clusters.check_yield(minfeaturecount=filt.get('minfeaturecount'),
+                                    forceclustersize=cluster_params['forceclustersize'],
+                                    minclusterscore=filt.get('minclusterscore'))
+        # first cluster has no chrom
+        mask[:1] = False
+
+        result = dict(cluster_params)
+        result.update((k, filt.get(k)) for k in FILTER_PARAMS)
+        length = clusters.length[mask]
+        result['clusters'] = int(mask.sum())
+        result['features'] = int(clusters.count[mask].sum())
+        if len(length) > 0:
+            score = clusters.score[mask]
+            result['mean_length'] = float(length.mean())
+            result['median_length'] = float(np.median(length))
+            result['mean_score'] = float(score.mean())
+            result['max_score'] = float(score.max())
         else:
-            if cluster.check_yield():
-                sumvalues = sum([f.value for f in cluster.features])
-                if sumvalues > 40:
-                    density = float(sumvalues) / len(cluster)
-                    cluster.clusterscores = [density]
-                    fout.write(cluster.tostring())
-            cluster = Cluster(feature=feature, **kwargs)
-    fout.close()
+            for k in ['mean_length', 'median_length', 'mean_score', 'max_score']:
+                result[k] = None
+
+        if bedfn is not None:
+            fout = open(bedfn, 'w')
+            fout.writelines(clusters.tostrings(mask, clusters.score.tolist()))
+            fout.close()
+        results.append(result)
+    return results
+
+def _sweep_worker(args):
+    params, filters, bedfns = args
+    return sweep_one(_sweep_features, params, filters, bedfns)
+
+def sweep(features, grid, processes=None, bedprefix=None):
+    """
+    Runs sweep_one() on *features* for every combination of parameters in
+    *grid*, a dict of parameter name -> list of values.  Each combination of
+    CLUSTER_PARAMS is one job, and jobs are spread across *processes* worker
+    processes (default is one per CPU; 1 runs everything in this process).
+
+    If *bedprefix* is given, each combination's clusters are written to
+    *bedprefix* plus the parameter values, e.g.
+    "prefix.gapwidth-200.forceclustersize-5000.bed".
+
+    Yields one result dict per combination, grouped by CLUSTER_PARAMS.
+    """
+    global _sweep_features
+    cluster_names = [k for k in CLUSTER_PARAMS if k in grid]
+    filter_names = [k for k in FILTER_PARAMS if k in grid]
+    filters = [dict(zip(filter_names, values))
+               for values in itertools.product(*[grid[k] for k in filter_names])]
+    jobs = []
+    for values in itertools.product(*[grid[k] for k in cluster_names]):
+        params = dict(zip(cluster_names, values))
+        bedfns = None
+        if bedprefix is not None:
+            bedfns = []
+            for filt in filters:
+                combo = [(k, params[k]) for k in cluster_names] + [(k, filt[k]) for k in filter_names]
+                bedfns.append(bedprefix + ''.join('.%s-%s' % kv for kv in combo) + '.bed')
+        jobs.append((params, filters, bedfns))
+
+    _sweep_features = features
+    if processes == 1 or len(jobs) == 1:
+        results = itertools.imap(_sweep_worker, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_sweep_worker, jobs)
+    try:
+        for job_results in results:
+            for result in job_results:
+                yield result
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _sweep_features = None
+
+def _parse_sweep_values(s):
+    """
+    Parses a comma-separated list of numbers; "none" means None.
+    """
+    values = []
+    for item in s.split(','):
+        if item.lower() == 'none':
+            values.append(None)
+            continue
+        try:
+            values.append(int(item))
+        except ValueError:
+            values.append(float(item))
+    return values
 
 if __name__ == "__main__":
     import sys
-    fn = sys.argv[1]
+    import optparse
+    op = optparse.OptionParser(usage='%prog [options] BEDFILE {hannon,brenn}\n'
+                                     '       %prog --sweep [sweep options] BEDFILE')
+    op.add_option('--intermediate', action='store_true',
+                  help='Also write the output of the first clustering stage '
+                       '(BEDFILE.clusters or BEDFILE.bren.clusters)')
+    op.add_option('--processes', type=int,
+                  help='Number of worker processes.  Chroms are clustered in '
+                       'parallel, or sweep combinations in --sweep mode '
+                       '(default is one per CPU)')
+    sweep_group = optparse.OptionGroup(op, 'Sweep options',
+        'Parse BEDFILE once and cluster it with every combination of the '
+        'comma-separated values given for each parameter (use "none" to '
+        'disable a parameter).  Writes a tab-delimited table with one line '
+        'per combination.')
+    sweep_group.add_option('--sweep', action='store_true', help='Run in sweep mode')
+    sweep_group.add_option('--gapwidth', default='1e15', help='Default is %default')
+    sweep_group.add_option('--threshold', default='0', help='Default is %default')
+    sweep_group.add_option('--forceclustersize', default='none', help='Default is %default')
+    sweep_group.add_option('--minfeaturecount', default='none', help='Default is %default')
+    sweep_group.add_option('--minclusterscore', default='none', help='Default is %default')
+    sweep_group.add_option('--forcevalue', type=float,
+                           help='Use this value for every feature instead of the '
+                                'BED score column')
+    sweep_group.add_option('-o', dest='output',
+                           help='Output table (default is stdout)')
+    sweep_group.add_option('--bedprefix',
+                           help='Also write clusters for each combination to '
+                                'BED files starting with this prefix')
+    op.add_option_group(sweep_group)
+    options, args = op.parse_args()
+    if len(args) < 1:
+        op.print_help()
+        sys.exit(1)
+    fn = args[0]
+
+    if options.sweep:
+        grid = dict((k, _parse_sweep_values(getattr(options, k))) for k in SWEEP_PARAMS)
+        features = bed_arrays(fn, options.forcevalue)
+        if options.output:
+            fout = open(options.output, 'w')
+        else:
+            fout = sys.stdout
+        fout.write('\t'.join(SWEEP_FIELDS) + '\n')
+        for result in sweep(features, grid, options.processes, options.bedprefix):
+            fout.write('\t'.join(str(result[k]) for k in SWEEP_FIELDS) + '\n')
+            fout.flush()
+        if options.output:
+            fout.close()
+        sys.exit(0)
     
     try:
-        other = sys.argv[2]
+        other = args[1]
     except IndexError:
         other = None
 
     if other == 'hannon':
-        hannon_cluster(fn)
+        hannon_cluster(fn, options.intermediate, options.processes)
 
     if other == 'brenn':
-        brennecke_cluster(fn)
+        brennecke_cluster(fn, options.intermediate, options.processes)
@@ -0,0 +1,183 @@
+"""
+Module for pairing up mates from a paired-end SAM file, for name-sorted or
+coordinate-sorted input, using a bounded amount of memory.
+
+Works on raw SAM lines, so it can be used with or without HTSeq.  Each
+alignment gets a key that is the same for both mates (read name plus the two
+mate positions and the insert size), and alignments wait in a buffer until
+their mate with the same key shows up.
+
+For name-sorted input mates are adjacent, so the buffer never holds more than
+a handful of lines.  For coordinate-sorted input, mates that are far apart (or
+on different chromosomes) can sit in the buffer for a long time.  Once the
+buffer holds more than *max_buffer* lines, the oldest lines are sorted by key
+and spilled to a temporary file.  After the input is exhausted, the spill files
+are merged by key, in passes of at most *max_spills* files so only that many
+are ever open, and the remaining pairs are yielded.
+
+Usage::
+
+    for first, second in pair_sam_lines(open('aln.sam')):
+        ...
+
+*first* and *second* are the lines for the first and second mate in the
+pair; either one may be None if the mate was not found.
+"""
+import heapq
+import os
+import tempfile
+import warnings
+from collections import OrderedDict
+
+# Most spill files open at once while merging
+MAX_SPILLS = 64
+
+def sam_key(line):
+    """
+    Returns (key, which) for a SAM line, where *key* is shared by both mates of
+    a pair and *which* is 'first', 'second', or None for unpaired reads.
+    """
+    L = line.split('\t', 9)
+    flag = int(L[1])
+    if not flag & 0x1:
+        return None, None
+    if flag & 0x40:
+        which = 'first'
+    elif flag & 0x80:
+        which = 'second'
+    else:
+        raise ValueError("Paired-end read found with unknown mate status:\n%s" % line)
+    rname, pos = L[2], L[3]
+    rnext, pnext = L[6], L[7]
+    if rnext == '=':
+        rnext = rname
+    ends = sorted([rname+':'+pos, rnext+':'+pnext])
+    tlen = L[8].lstrip('-')
+    return '\t'.join([L[0], ends[0], ends[1], tlen]), which
+
+
+class _SpillFile(object):
+    """
+    A sorted run of (key, which, line) records written to a temp file.
+    *records* are sorted first unless they're already *presorted*.
+    """
+    def __init__(self, records, tmpdir=None, presorted=False):
+        if not presorted:
+            records = sorted(records)
+        fd, self.fn = tempfile.mkstemp(suffix='.matepairs', dir=tmpdir)
+        fout = os.fdopen(fd, 'w')
+        self.count = 0
+        for key, which, line in records:
+            fout.write('%s\x00%s\x00%s' % (key, which, line))
+            self.count += 1
+        fout.close()
+
+    def __iter__(self):
+        f = open(self.fn)
+        for record in f:
+            key, which, line = record.split('\x00')
+            yield key, which, line
+        f.close()
+        os.unlink(self.fn)
+
+
+def _paired(first_or_second, line, mate):
+    if first_or_second == 'first':
+        return line, mate
+    return mate, line
+
+
+def _reduce_spills(spills, max_spills, tmpdir=None):
+    """
+    Merges the smallest of the spill files in *spills*, *max_spills* at a
+    time, until fewer than *max_spills* are left.  Returns the list of
+    remaining spill files.
+    """
+    max_spills = max(max_spills, 2)
+    heap = [(s.count, i, s) for i, s in enumerate(spills)]
+    heapq.heapify(heap)
+    n = len(heap)
+    while len(heap) >= max_spills:
+        group = [heapq.heappop(heap)[2] for i in xrange(max_spills)]
+        merged = _SpillFile(heapq.merge(*group), tmpdir, presorted=True)
+        heapq.heappush(heap, (merged.count, n, merged))
+        n += 1
+    return [s for count, i, s in heap]
+
+
+def pair_sam_lines(lines, max_buffer=1000000, tmpdir=None, max_spills=MAX_SPILLS):
+    """
+    Yields (first, second) tuples of SAM lines from the iterable *lines*.
+    Header lines are skipped.  Unpaired reads are yielded as (line, None).
+
+    At most *max_buffer* lines are held in memory waiting for their mates;
+    beyond that, lines are spilled to temp files in *tmpdir*.  No more than
+    *max_spills* (at least 2) spill files are open at once while merging.
+    """
+    buffered = OrderedDict()
+    # Lines that can't be paired with the line already buffered under their
+    # key; they go out with the next spill.
+    unmatched = []
+    spills = []
+    for line in lines:
+        if line.startswith('@'):
+            continue
+        if not line.endswith('\n'):
+            line += '\n'
+        key, which = sam_key(line)
+        if key is None:
+            yield line, None
+            continue
+
+        waiting = buffered.pop(key, None)
+        if waiting is not None:
+            if waiting[0] != which:
+                yield _paired(which, line, waiting[1])
+                continue
+            # Same key and same mate -- can't pair these two, so keep the
+            # older one aside to be spilled.
+            unmatched.append((key,) + waiting)
+
+        buffered[key] = (which, line)
+
+        if len(buffered) + len(unmatched) > max_buffer:
+            # Spill the oldest quarter of the buffer
+            n = max(1, max_buffer // 4)
+            records = unmatched
+            unmatched = []
+            for i in xrange(min(n, len(buffered))):
+                k, (w, l) = buffered.popitem(last=False)
+                records.append((k, w, l))
+            spills.append(_SpillFile(records, tmpdir))
+
+    if len(spills) == 0 and len(unmatched) == 0:
+        leftovers = buffered.items()
+        if len(leftovers) > 0:
+            warnings.warn("Mate records missing for %d records" % len(leftovers))
+        for key, (which, line) in leftovers:
+            yield _paired(which, line, None)
+        return
+
+    # Merge whatever is left in the buffer with the spill files, and pair up
+    # adjacent records with the same key.
+    spills = _reduce_spills(spills, max_spills, tmpdir)
+    remaining = sorted(unmatched + [(k, w, l) for k, (w, l) in buffered.items()])
+    buffered.clear()
+    del unmatched
+    merged = heapq.merge(remaining, *spills)
+    missing = 0
+    last = None
+    for key, which, line in merged:
+        if last is not None:
+            if last[0] == key and last[1] != which:
+                yield _paired(which, line, last[2])
+                last = None
+                continue
+            missing += 1
+            yield _paired(last[1], last[2], None)
+        last = (key, which, line)
+    if last is not None:
+        missing += 1
+        yield _paired(last[1], last[2], None)
+    if missing > 0:
+        warnings.warn("Mate records missing for %d records" % missing)
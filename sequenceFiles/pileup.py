@@ -0,0 +1,112 @@
+"""
+Module for accumulating read coverage ("pileup") in memory and writing it out
+as a WIG file, without needing sorted input.
+
+Rather than allocating an array the size of each chromosome, only the
+breakpoints where coverage changes are kept.  Intervals are buffered as plain
+start/stop lists and periodically collapsed into a sorted array of breakpoint
+positions plus the change in coverage at each one, so memory is bounded by the
+number of distinct breakpoints rather than by the number of reads.
+
+Usage::
+
+    p = Pileup()
+    p.add('chr2L', 100, 136)
+    p.add('chr2L', 120, 156)
+    p.write_wig(open('out.wig','w'), trackinfo='name="my reads"')
+
+The output has the same layout as bed2wig.py: one fixedStep block per run of
+contiguous non-zero coverage.
+"""
+import numpy as np
+
+
+class Pileup(object):
+    def __init__(self, buffersize=500000):
+        """
+        Coverage accumulator.  *buffersize* is the number of intervals to hold
+        per chromosome before collapsing them into breakpoints.
+        """
+        self.buffersize = buffersize
+        self._starts = {}
+        self._stops = {}
+        self._positions = {}
+        self._deltas = {}
+
+    def add(self, chrom, start, stop):
+        """
+        Add one interval (0-based, half-open) to the coverage on *chrom*.
+        """
+        try:
+            starts = self._starts[chrom]
+        except KeyError:
+            starts = self._starts[chrom] = []
+            self._stops[chrom] = []
+            self._positions[chrom] = np.zeros(0, dtype=np.int64)
+            self._deltas[chrom] = np.zeros(0, dtype=np.int64)
+        starts.append(start)
+        self._stops[chrom].append(stop)
+        if len(starts) >= self.buffersize:
+            self._collapse(chrom)
+
+    def _collapse(self, chrom):
+        """
+        Merge buffered intervals for *chrom* into the breakpoint arrays.
+        """
+        starts = self._starts[chrom]
+        if len(starts) == 0:
+            return
+        stops = self._stops[chrom]
+        positions = np.concatenate((self._positions[chrom],
+                                    np.array(starts, dtype=np.int64),
+                                    np.array(stops, dtype=np.int64)))
+        deltas = np.concatenate((self._deltas[chrom],
+                                 np.ones(len(starts), dtype=np.int64),
+                                 -np.ones(len(stops), dtype=np.int64)))
+        positions, inverse = np.unique(positions, return_inverse=True)
+        deltas = np.bincount(inverse, weights=deltas).astype(np.int64)
+        keep = deltas != 0
+        self._positions[chrom] = positions[keep]
+        self._deltas[chrom] = deltas[keep]
+        self._starts[chrom] = []
+        self._stops[chrom] = []
+
+    def chroms(self):
+        return sorted(self._starts.keys())
+
+    def runs(self, chrom):
+        """
+        Yields (start, values) for each run of contiguous non-zero coverage on
+        *chrom*, where *values* is an array with one coverage value per bp.
+        """
+        self._collapse(chrom)
+        positions = self._positions[chrom]
+        if len(positions) == 0:
+            return
+        depth = np.cumsum(self._deltas[chrom])
+
+        # Segment k spans positions[k]:positions[k+1] at depth[k]; the last
+        # depth is always zero since every start has a matching stop.
+        lengths = np.diff(positions)
+        depth = depth[:-1]
+        covered = depth != 0
+
+        # Boundaries between covered and uncovered segments.
+        edges = np.diff(np.concatenate(([0], covered.astype(np.int8), [0])))
+        run_starts = np.nonzero(edges == 1)[0]
+        run_stops = np.nonzero(edges == -1)[0]
+        for i, j in zip(run_starts, run_stops):
+            yield positions[i], np.repeat(depth[i:j], lengths[i:j])
+
+    def write_wig(self, fout, trackinfo='', scale=1.0):
+        """
+        Writes coverage for all chromosomes, in sorted order, to the open file
+        *fout* as WIG.  Values are multiplied by *scale*.
+        """
+        fout.write('track type=wiggle_0 alwaysZero=on %s\n' % trackinfo)
+        for chrom in self.chroms():
+            for start, values in self.runs(chrom):
+                # Add 1 to start since WIG is 1-based
+                fout.write('fixedStep chrom=%s start=%s step=1\n' % (chrom, start+1))
+                fout.write('\n'.join(map(str, values*scale)))
+                fout.write('\n')
@@ -0,0 +1,39 @@
+"""
+Module for importing matplotlib only when a script actually plots.
+
+Importing pylab at the top of a script costs seconds of startup even for
+``--help`` or runs that never draw anything, so scripts call pyplot() from the
+code that plots instead.  Batch runs (and machines without a display) get the
+non-interactive Agg backend, which can still save figures.
+
+Usage::
+
+    import plotting
+    plt = plotting.pyplot(headless=True)
+    fig = plt.figure()
+    ...
+    fig.savefig('out.pdf')
+"""
+import os
+import sys
+
+
+def has_display():
+    """
+    True if an interactive backend could open a window.
+    """
+    return sys.platform in ('darwin', 'win32') or bool(os.environ.get('DISPLAY'))
+
+
+def pyplot(headless=False):
+    """
+    Imports and returns matplotlib.pyplot.  If *headless*, or if there's no
+    display, the Agg backend is selected first (unless a backend was already
+    chosen with the MPLBACKEND environment variable).
+    """
+    import matplotlib
+    if (headless or not has_display()) and 'MPLBACKEND' not in os.environ \
+            and 'matplotlib.pyplot' not in sys.modules:
+        matplotlib.use('Agg')
+    from matplotlib import pyplot
+    return pyplot
@@ -0,0 +1,172 @@
+"""
+Module for cheap progress reporting and run metrics in long-running scripts.
+
+Progress reports are rate-limited by wall time rather than by item count, and
+the clock is only checked every *check_every* items, so calling tick() once per
+read or feature costs about as much as incrementing a counter.  If a file
+object is given, bytes/s, percent done and an ETA are computed from the file
+position.
+
+Usage::
+
+    stages = StageTimer()
+    stages.start('load')
+    f = open(fn)
+    progress = Progress('reads', fileobj=f, enabled=options.verbose)
+    for line in f:
+        progress.tick()
+        ...
+    progress.done()
+    stages.stop()
+    stages.write_json('metrics.json', reads=progress.summary())
+"""
+import os
+import sys
+import time
+import json
+
+
+def _format_seconds(s):
+    s = int(s)
+    if s >= 3600:
+        return '%dh%02dm' % (s // 3600, (s % 3600) // 60)
+    if s >= 60:
+        return '%dm%02ds' % (s // 60, s % 60)
+    return '%ds' % s
+
+
+class Progress(object):
+    def __init__(self, label='items', fileobj=None, interval=2.0,
+                 check_every=1000, stream=None, enabled=True):
+        """
+        Progress reporter for one loop.  *label* names the things being
+        counted.  If *fileobj* is an open file being read, its size and
+        position are used for bytes/s and ETA.  A line is written to *stream*
+        (default stderr) at most once every *interval* seconds, and only if
+        *enabled*.
+        """
+        self.label = label
+        self.fileobj = fileobj
+        self.interval = interval
+        self.check_every = check_every
+        self.stream = stream or sys.stderr
+        self.enabled = enabled
+        self.count = 0
+        self.t0 = time.time()
+        self.elapsed = 0
+        self.nbytes = None
+        self._last = self.t0
+        self.size = None
+        if fileobj is not None:
+            try:
+                self.size = os.fstat(fileobj.fileno()).st_size
+            except (AttributeError, OSError, ValueError):
+                self.size = None
+        if enabled:
+            self._next_check = check_every
+        else:
+            self._next_check = float('inf')
+
+    def tick(self, n=1):
+        """
+        Count *n* more items, reporting if it's been long enough.
+        """
+        self.count += n
+        if self.count >= self._next_check:
+            self._check()
+
+    def _check(self):
+        self._next_check = self.count + self.check_every
+        now = time.time()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.report()
+
+    def position(self):
+        """
+        Current byte position in the file, or None.
+        """
+        if self.fileobj is None:
+            return None
+        try:
+            return self.fileobj.tell()
+        except (IOError, OSError, ValueError):
+            return None
+
+    def report(self, end=''):
+        elapsed = max(time.time() - self.t0, 1e-6)
+        msg = '\r%d %s, %d %s/s' % (self.count, self.label,
+                                    self.count / elapsed, self.label)
+        pos = self.position()
+        if pos is not None:
+            msg += ', %.1f MB/s' % (pos / elapsed / 1e6)
+            if self.size:
+                frac = float(pos) / self.size
+                msg += ', %d%%' % (100 * frac)
+                if 0 < frac < 1:
+                    msg += ', ETA %s' % _format_seconds(elapsed * (1 - frac) / frac)
+        msg += ', %s elapsed' % _format_seconds(elapsed)
+        self.stream.write(msg + end)
+        self.stream.flush()
+
+    def done(self):
+        """
+        Stop timing, and write a final report if enabled.  Call this before
+        closing the file, so the bytes read are recorded for summary().
+        """
+        self.elapsed = time.time() - self.t0
+        self.nbytes = self.position()
+        if self.enabled:
+            self.report(end='\n')
+
+    def summary(self):
+        """
+        Dictionary of count, elapsed seconds and rates, for JSON output.
+        """
+        elapsed = self.elapsed or (time.time() - self.t0)
+        d = {'count': self.count,
+             'seconds': elapsed,
+             'per_second': self.count / max(elapsed, 1e-6)}
+        pos = self.nbytes if self.nbytes is not None else self.position()
+        if pos is not None:
+            d['bytes'] = pos
+            d['bytes_per_second'] = pos / max(elapsed, 1e-6)
+        return d
+
+
+class StageTimer(object):
+    def __init__(self):
+        """
+        Wall-time timer for the named stages of a script (e.g., loading,
+        counting, writing output).  Starting a stage stops the previous one.
+        """
+        self.t0 = time.time()
+        self.stages = []
+        self._current = None
+
+    def start(self, name):
+        self.stop()
+        self._current = (name, time.time())
+
+    def stop(self):
+        if self._current is not None:
+            name, t = self._current
+            self.stages.append((name, time.time() - t))
+            self._current = None
+
+    def summary(self, **extra):
+        """
+        Dictionary of stage timings plus any *extra* key/value pairs.
+        """
+        self.stop()
+        d = {'stages': dict(self.stages),
+             'stage_order': [name for name, t in self.stages],
+             'total_seconds': time.time() - self.t0}
+        d.update(extra)
+        return d
+
+    def write_json(self, fn, **extra):
+        fout = open(fn, 'w')
+        json.dump(self.summary(**extra), fout, indent=2, sort_keys=True)
+        fout.write('\n')
+        fout.close()
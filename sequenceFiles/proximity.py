@@ -0,0 +1,125 @@
+"""
+Module for in-process window overlaps and closest features between two BED
+files, as used by theComparator.py in place of windowBed and closestBed.
+
+Both files are loaded once as randomization.Intervals (sorted per-chromosome
+start and stop arrays), and every query is a few searchsorted calls per
+chromosome, so the same loaded files serve the comparisons in both
+directions.
+
+Usage::
+
+    a = randomization.Intervals('a.bed', keep_lines=True)
+    b = randomization.Intervals('b.bed', keep_lines=True)
+    hits = window(a, b, w=1000)                   # like windowBed -w 1000 -u
+    write_features(a, hits, 'near.bed', 'a near b')
+    write_features(a, ~hits, 'far.bed', 'a not near b')    # like -v
+    dists = closest_center_distances(a, b)        # like closestBed -t first
+"""
+import numpy as np
+import randomization
+
+
+def window(a, b, w=0):
+    """
+    Boolean array in file order, True for each feature in Intervals *a* that
+    overlaps a feature in Intervals *b* after extending it by *w* bp on each
+    side (windowBed -u; use ~window(a, b, w) for -v).
+    """
+    hits = np.zeros(len(a), dtype=bool)
+    for chrom in a.chroms():
+        starts = np.maximum(a.starts[chrom] - w, 0)
+        stops = a.stops[chrom] + w
+        hits[a.index[chrom]] = randomization.overlapping(starts, stops, b, chrom)
+    return hits
+
+
+def closest(a, b, chrom):
+    """
+    For each feature in Intervals *a* on *chrom* (in a's sorted order),
+    returns the position of the closest feature in Intervals *b* in b's
+    sorted arrays, and the gap between them (0 if they overlap).  When
+    several b features are equally close (e.g., more than one overlaps), the
+    first one in b's file order is used, as with closestBed -t first.  *b*
+    must have features on *chrom*.
+    """
+    astarts, astops = a.starts[chrom], a.stops[chrom]
+    bstarts, bstops = b.starts[chrom], b.stops[chrom]
+
+    # Upstream (or overlapping) candidate: of the b features starting before
+    # each a feature stops, the one that reaches furthest.
+    maxstop = np.maximum.accumulate(bstops)
+    reach = np.r_[0, np.flatnonzero(np.diff(maxstop)) + 1]
+    furthest = reach[np.searchsorted(reach, np.arange(len(bstops)), side='right') - 1]
+    left = np.searchsorted(bstarts, astops, side='left') - 1
+    has_left = left >= 0
+    left = np.maximum(left, 0)
+    left_gap = np.where(has_left, np.maximum(astarts - maxstop[left], 0), np.iinfo(np.int64).max)
+    left = furthest[left]
+
+    # Downstream candidate: the first b feature starting at or after the stop
+    right = np.minimum(np.searchsorted(bstarts, astops, side='left'), len(bstarts) - 1)
+    right_gap = np.where(bstarts[right] >= astops, bstarts[right] - astops, np.iinfo(np.int64).max)
+
+    use_right = right_gap < left_gap
+    idx = np.where(use_right, right, left)
+    gap = np.where(use_right, right_gap, left_gap)
+
+    # A b feature is at the smallest gap g exactly when it starts no later
+    # than g past the a feature's stop and stops no earlier than g before its
+    # start.  Count those, and where there's more than one, look through them
+    # for the first in file order.  Only b features starting within the
+    # longest b feature of that range can qualify.
+    lo_stop = astarts - gap
+    hi_start = astops + gap
+    ties = np.searchsorted(bstarts, hi_start, side='right') - \
+        np.searchsorted(np.sort(bstops), lo_stop, side='left')
+    tied = np.flatnonzero(ties > 1)
+    if len(tied):
+        maxlen = (bstops - bstarts).max()
+        first = np.searchsorted(bstarts, lo_stop[tied] - maxlen, side='left')
+        last = np.searchsorted(bstarts, hi_start[tied], side='right')
+        counts = last - first
+        group = np.repeat(np.arange(len(tied)), counts)
+        offsets = np.repeat(first - (np.cumsum(counts) - counts), counts)
+        candidates = np.arange(counts.sum()) + offsets
+        keep = bstops[candidates] >= lo_stop[tied][group]
+        candidates, group = candidates[keep], group[keep]
+        order = b.index[chrom][candidates]
+        heads = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        best = order == np.minimum.reduceat(order, heads)[group]
+        idx[tied[group[best]]] = candidates[best]
+    return idx, gap
+
+
+def closest_center_distances(a, b):
+    """
+    Distance from the center of each feature in Intervals *a* to the center
+    of its closest feature in Intervals *b*, in file order.  Features on
+    chromosomes that *b* doesn't have are left out.
+    """
+    distances = np.zeros(len(a), dtype=np.int64)
+    found = np.zeros(len(a), dtype=bool)
+    for chrom in a.chroms():
+        if chrom not in b.starts:
+            continue
+        idx, gap = closest(a, b, chrom)
+        centera = a.starts[chrom] + (a.stops[chrom] - a.starts[chrom]) // 2
+        centerb = b.starts[chrom] + (b.stops[chrom] - b.starts[chrom]) // 2
+        distances[a.index[chrom]] = centera - centerb[idx]
+        found[a.index[chrom]] = True
+    return distances[found]
+
+
+def write_features(a, mask, fn, trackname):
+    """
+    Writes the lines of the features in Intervals *a* (loaded with
+    keep_lines=True) where *mask* is True to *fn*, in file order, after a
+    track line named *trackname*.  Returns the number of features written.
+    """
+    fout = open(fn, 'w')
+    fout.write('track name="%s"\n' % trackname)
+    selected = np.flatnonzero(mask)
+    fout.writelines(a.lines[i] for i in selected)
+    fout.close()
+    return len(selected)
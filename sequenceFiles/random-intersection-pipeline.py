@@ -9,12 +9,15 @@ Usage::
 Output will be a text file, randomization-results.txt, and a PDF heatmap,
 heatmap.pdf, compressed into a zip file with the date and a name you provide.
 
-**If you want to re-run, then delete the randomized-results directory.**
+Results for each pair of files are kept in randomized-results/results.txt,
+keyed by the contents of both files and the settings.  Re-running after
+adding, removing or changing files only redoes the comparisons that changed.
 """
 
-# The meat of the randomization code is in the pybedtools package.  Currently,
-# this uses a randomization that's optimized for dm3 genome.  Will take
-# minor refactoring to use for others.
+# The meat of the randomization code is in randomization.py, which shuffles
+# and intersects in-process with NumPy.  Features are shuffled within their
+# own chromosomes of the genome model in genome.py -- dm3 unless --genome is
+# given -- staying out of --exclude regions and inside --include regions.
 #
 # The visualization code is in the IntersectionCluster object, separated out
 # into selection, pre-sorting, clustering, labeling, and plotting.
@@ -24,19 +27,47 @@ import os
 import sys
 import optparse
 import datetime
+import hashlib
+import itertools
+import multiprocessing
 
-# 3rd-party
+# 3rd-party (matplotlib, scipy and Bio are imported when the heatmap is made)
 from ruffus import *
-from Bio.Cluster import kcluster
-from scipy import stats
-from pylab import *
+from numpy import *
 
 # my libs
-import pybedtools
+import randomization
+import genome
+import plotting
 
 op = optparse.OptionParser(usage=usage)
 op.add_option('--iterations',type=int, help='number of random iterations to perform')
 op.add_option('--name',help='name of this run -- this is added to the final zip filename')
+op.add_option('--seed',type=int,default=0,
+              help='random seed.  Each file is shuffled once, with a seed made from this '
+                   'and its contents, and the shuffles are reused for every comparison.')
+op.add_option('--adaptive',action='store_true',
+              help='Run iterations in batches, and stop a comparison early once it is clear '
+                   'whether it is significant.  --iterations is then the maximum.')
+op.add_option('--shuffles-in-memory',action='store_true',
+              help='Keep each worker\'s shuffles in memory rather than in '
+                   'randomized-results/shuffles.  The saved shuffles take 4 bytes per '
+                   'feature per iteration for each file (40 GB for 10000 iterations of '
+                   'a 1M-feature file), but are shared between workers and reused by '
+                   'later runs.')
+op.add_option('--jobs',type=int,default=multiprocessing.cpu_count(),
+              help='Number of worker processes for the randomizations [default: %default]')
+op.add_option('--skip-self',action='store_true',
+              help='Skip comparing each file with itself (the heatmap diagonal is cleared '
+                   'anyway).')
+op.add_option('--genome',
+              help='chrom.sizes file (or BED file of chromosomes) for the genome to shuffle '
+                   'within [default: dm3]')
+op.add_option('--exclude',
+              help='BED file of regions (e.g., gaps) that shuffled features must not overlap')
+op.add_option('--include',
+              help='BED file of regions (e.g., mappable regions) that shuffled features must '
+                   'fall within')
 options,args = op.parse_args()
 
 if not options.iterations:
@@ -45,6 +76,13 @@ if not options.iterations:
     sys.exit(1)
 
 ITERATIONS = options.iterations
+if options.genome:
+    sizes = genome.read_sizes(options.genome)
+else:
+    sizes = randomization.DM3
+GENOME = genome.Genome(sizes,
+                       options.exclude and genome.read_regions(options.exclude),
+                       options.include and genome.read_regions(options.include))
 HEADER = ['file_a',
           'file_b',
           'count_a',
@@ -54,9 +92,15 @@ HEADER = ['file_a',
           'med',
           'upper_95th',
           'percentile',
-          'normalized']
+          'normalized',
+          'iterations']
 HEADER = '\t'.join(HEADER)+'\n'
 
+# Percentiles beyond which a comparison is significant.  Used for the heatmap
+# and for stopping early with --adaptive.
+SIG_LOWER = 0.1
+SIG_UPPER = 99.9
+
 # Get filenames from stdin
 fns = []
 for i in sys.stdin:
@@ -73,6 +117,7 @@ class IntersectionCluster(object):
         """
         *fn* is a tab-delimited file containing the input data.
         """
+        from matplotlib.mlab import csv2rec
         self.fn = fn
         self._counts = []
         self.data = csv2rec(fn, delimiter='\t')
@@ -84,10 +129,7 @@ class IntersectionCluster(object):
         """
         Convenience function to look for *a* in self.data.file_a and *b* in self.data.file_b.
         """
-        ind = []
-        for i,rec in enumerate(self.data):
-            if (a in rec.file_a) and (b in rec.file_b):
-                ind.append(i)
+        ind = (char.find(self.data.file_a, a) >= 0) & (char.find(self.data.file_b, b) >= 0)
         return self.data[ind]
 
     def _filter(self,filterfunc=None):
@@ -99,24 +141,18 @@ class IntersectionCluster(object):
         boolean indicating whether the rec should be kept or not.
         """
         if filterfunc is None:
-            def filterfunc(rec):
-                return True
+            self.mask = arange(len(self.data))
+            return
 
-        ind = []
-        for i,rec in enumerate(self.data):
-            if filterfunc(rec):
-                ind.append(i)
-       
-        self.mask = array(ind)
+        self.mask = array([i for i,rec in enumerate(self.data) if filterfunc(rec)], dtype=int)
         self.data = self.data[self.mask]
  
     def _unique_samples(self):
         """
         Converts all samples to basenames; gets the unique samples.
         """
-        for i in self.data:
-            i.file_a = os.path.splitext(os.path.basename(i.file_a))[0]
-            i.file_b = os.path.splitext(os.path.basename(i.file_b))[0]
+        for field in ['file_a', 'file_b']:
+            self.data[field] = [os.path.splitext(os.path.basename(i))[0] for i in self.data[field]]
         self.samples = unique(self.data.file_a)
 
     def fill_in_matrix(self,datafunc=None,sigfunc=None):
@@ -140,53 +176,49 @@ class IntersectionCluster(object):
                 return False
 
         """
-        featurecounts = []
-        if sigfunc is None:
-            def sigfunc(rec):
-                if rec.percentile < 0.1:
-                    return True
-                if rec.percentile > 99.9:
-                    return True
-                return False
-        
         # Do the filtering etc
         self._unique_samples()
 
-        self.z      = zeros( (len(self.samples), len(self.samples)) )
-        self.sigmat = zeros( (len(self.samples), len(self.samples)) )
-
-        # iterate through each pairwise intersection
-        for ii, i in enumerate(self.samples):
-            ind1 = self.data.file_a == i
-            featurecounts.append(unique(self.data[ind1].count_a)[0])
-            for jj, j in enumerate(self.samples):
-                ind2 = self.data.file_b == j
-                
-                # rec1 is the record in self.data that has the data for the 
-                # intersection for i vs j
-                ind = ind1 & ind2                    
-                rec1 = self.data[ind]
-
-                # double check that this pairwise intersection is unique; if
-                # it's not that indicates some problem with the original text
-                # data file.
-                assert len(rec1) == 1
-                
-
-
-                # the actual data we want to put in the array.
-                if datafunc is None:
-                    val = log2((rec1.actual+1)/(rec1.med+1))
-                else:
-                    val = datafunc(rec1)
-
-                # Enter those values in z.
-                row = ii 
-                col = jj
-                self.z[row,col] = val
-
-                # Fill in the significance matrix
-                self.sigmat[row,col] = sigfunc(rec1)
+        n = len(self.samples)
+        self.z      = zeros( (n, n) )
+        self.sigmat = zeros( (n, n) )
+
+        # Row and column of each record; records whose file_b isn't one of
+        # the samples aren't used.
+        rows = searchsorted(self.samples, self.data.file_a)
+        cols = searchsorted(self.samples, self.data.file_b)
+        cols[cols == n] = 0
+        keep = self.samples[cols] == self.data.file_b
+        rows, cols = rows[keep], cols[keep]
+        data = self.data[keep]
+
+        # double check that each pairwise intersection is there exactly once
+        # (self-comparisons may be missing, if they were skipped); if it's
+        # not that indicates some problem with the original text data file.
+        cellcounts = bincount(rows * n + cols, minlength=n * n).reshape(n, n)
+        diag = arange(n)
+        cellcounts[diag, diag] += cellcounts[diag, diag] == 0
+        assert (cellcounts == 1).all()
+
+        # the actual data we want to put in the array.
+        if datafunc is None:
+            vals = log2((data.actual+1.)/(data.med+1))
+        else:
+            vals = [datafunc(data[i:i+1]) for i in range(len(data))]
+        self.z[rows, cols] = ravel(vals)
+
+        # Fill in the significance matrix
+        if sigfunc is None:
+            sig = (data.percentile < SIG_LOWER) | (data.percentile > SIG_UPPER)
+        else:
+            sig = [bool(sigfunc(data[i:i+1])) for i in range(len(data))]
+        self.sigmat[rows, cols] = sig
+
+        # feature count of each sample, from the smallest count_a among its
+        # records
+        order = lexsort((data.count_a, rows))
+        first = unique(rows[order], return_index=True)[1]
+        featurecounts = list(data.count_a[order][first])
 
         # mask out infs and NaNs.
         self.z = ma.masked_invalid(self.z)
@@ -203,17 +235,14 @@ class IntersectionCluster(object):
 
         # clear z along the diagonal
         if clear_nonsig:
-            rows,cols = self.z.shape
-            for r in range(rows):
-                for c in range(cols):
-                    if r == c:
-                        self.z[r,c] = 0
+            diag = arange(min(self.z.shape))
+            self.z[diag,diag] = 0
             self.z[self.sigmat==0] = 0
 
         if do_pca:
             print 'Performing SVD on %s x %s matrix...' % (shape(self.z))
             sys.stdout.flush()
-            u,s,v = svd(self.z.data)
+            u,s,v = linalg.svd(self.z.data)
             if direction=='row':
                 u = u[:,0]
             if direction == 'col':
@@ -231,6 +260,7 @@ class IntersectionCluster(object):
             raise ValueError, 'direction must be one of "row" or "col"; %s was provided' % direction
 
 
+        from Bio.Cluster import kcluster
         print 'Clustering...'
         sys.stdout.flush()
         clusterid,error,nfound = kcluster(self.z,transpose=transpose,nclusters=nclusters,npass=npass,initialid=initialid)
@@ -245,11 +275,15 @@ class IntersectionCluster(object):
         return sortind
 
     def plot(self, sortind, figheight=5, clear_diagonal=True, clear_nonsig=False, cmap=None, ax_rect=(.2,.2,.7,.7)):
+        from scipy import stats
+        import matplotlib.colors
+        from matplotlib.axes import Axes
+        plt = plotting.pyplot(headless=True)
 
         colorbarfrac = 0.15
         figwidth = figheight+colorbarfrac*figheight
         figsize = (figwidth,figheight)
-        fig = figure(figsize=figsize)
+        fig = plt.figure(figsize=figsize)
 
         ax_rect = list(ax_rect)
         ax_rect[2] = ax_rect[2] - ax_rect[2]*colorbarfrac
@@ -303,11 +337,8 @@ class IntersectionCluster(object):
         
         # clear z along the diagonal
         if clear_diagonal:
-            rows,cols = z.shape
-            for r in range(rows):
-                for c in range(cols):
-                    if r == c:
-                        z[r,c] = NaN
+            diag = arange(min(z.shape))
+            z[diag,diag] = NaN
         if clear_nonsig:
             z[self.sigmat==0] = NaN
         
@@ -324,7 +355,7 @@ class IntersectionCluster(object):
 
         ax.xaxis.set_ticks_position('none')
         ax.yaxis.set_ticks_position('none')
-        axis('tight')
+        ax.axis('tight')
         
         cbar_padding = 0.25*colorbarfrac
         cbar_left = 1 - colorbarfrac+cbar_padding
@@ -360,26 +391,83 @@ randomized_results_dir = 'randomized-results'
 if not os.path.exists(randomized_results_dir):
     os.makedirs(randomized_results_dir)
 
-# TASK:   Do all pairwise intersections, randomizing ITERATIONS times.
-# Input:  The bed files to use
-# Output: A one-line randomization output file for each pairwise comparison
+# Results are keyed by the names and contents of both files and the settings,
+# so they are only reused while neither file has changed (and the report line,
+# which has the file names in it, is still right).  Results are appended to
+# one store file as "key<TAB>report line" as they finish; results for pairs
+# that are no longer compared are dropped from it at the start of each run.
+hashes = dict((fn, randomization.file_md5(fn)) for fn in fns)
+SETTINGS = repr((ITERATIONS, options.seed, bool(options.adaptive)))
+if options.genome or options.exclude or options.include:
+    SETTINGS += repr((sorted(GENOME.sizes.items()), GENOME.regions_key()))
+RESULTS_STORE = os.path.join(randomized_results_dir, 'results.txt')
+REPORT = 'randomization-report.txt'
+
+def pair_key(fn1,fn2):
+    return hashlib.md5('\0'.join([fn1, fn2, hashes[fn1], hashes[fn2], SETTINGS])).hexdigest()
+
 def intersect_files():
     for fn1 in fns:
         for fn2 in fns:
-
-            inputs = (fn1,fn2)
-            output = '%s-%s' % (os.path.basename(fn1),os.path.basename(fn2))
-            output = os.path.join(randomized_results_dir,output)
-            yield (inputs,output)
-@files(intersect_files)
-@posttask(pybedtools.cleanup)
-def random_intersections(inputs,output):
+            if options.skip_self and fn1 == fn2:
+                continue
+            yield (fn1,fn2)
+
+def load_results():
+    results = {}
+    if os.path.exists(RESULTS_STORE):
+        for line in open(RESULTS_STORE):
+            key, line = line.split('\t', 1)
+            results[key] = line
+    return results
+
+def compact_results(stored, keys):
+    """
+    Rewrites the results store with only the results for *keys*, so it
+    doesn't grow without bound as files and settings change.
+    """
+    tmp = RESULTS_STORE + '.tmp'
+    fout = open(tmp,'w')
+    for key in keys:
+        if key in stored:
+            fout.write('%s\t%s' % (key, stored[key]))
+    fout.close()
+    os.rename(tmp, RESULTS_STORE)
+
+# Each BED file is only parsed once per worker process, and only shuffled once
+# (the shuffles are memory-mapped from randomized-results/shuffles and shared
+# between processes, unless --shuffles-in-memory).  Shuffles are made 100
+# iterations at a time as they're first needed, so with --adaptive a file whose
+# comparisons all stop early never gets the rest.  The seed for the shuffles is
+# --seed.  Shuffles of files that are no longer compared, or made with other
+# settings, are removed at the start of each run.
+if options.shuffles_in_memory:
+    shuffle_dir = None
+else:
+    shuffle_dir = os.path.join(randomized_results_dir, 'shuffles')
+shuffle_cache = randomization.ShuffleCache(ITERATIONS, GENOME, seed=options.seed,
+                                           cachedir=shuffle_dir)
+_intervals = {}
+def load_intervals(fn):
+    if fn not in _intervals:
+        _intervals[fn] = randomization.Intervals(fn)
+    return _intervals[fn]
+
+def random_intersection(inputs):
+    """
+    Randomized intersection of one pair of files; returns the key and the
+    report line.
+    """
     fn1,fn2 = inputs
     print fn1,fn2
     sys.stdout.flush()
-    a = pybedtools.bedtool(fn1)
-    b = pybedtools.bedtool(fn2)
-    results = a.randomstats(b,ITERATIONS,intersectkwargs={'u':True})
+    a = load_intervals(fn1)
+    b = load_intervals(fn2)
+    if options.adaptive:
+        results = randomization.adaptive_randomstats(a,b,ITERATIONS,cache=shuffle_cache,
+                                                     lower=SIG_LOWER,upper=SIG_UPPER)
+    else:
+        results = randomization.randomstats(a,b,ITERATIONS,cache=shuffle_cache)
     key_order = [
         fn1,
         fn2,
@@ -389,42 +477,69 @@ def random_intersections(inputs,output):
         'upper_95th',
         'percentile',
         'normalized',
+        'iterations',
         ]
     line = [fn1,fn2]
     line += [results[i] for i in key_order]
     line = map(str,line)
     line = '\t'.join(line)+'\n'
-    fout = open(output,'w')
-    fout.write(line)
-    fout.close()
+    return pair_key(fn1,fn2), line
 
-# TASK:   Combine all the randomized output files into one.
-# Input:  All the randomization output files
+# TASK:   Do all pairwise intersections, randomizing ITERATIONS times, and
+#         combine them into one report.
+# Input:  The bed files to use
 # Output: A randomization report, one line for each pairwise comparison.  Also
 #         has header.
-def combine_randomized_files():
-    inputs = []
-    for _, output in intersect_files():
-        inputs.append(output)
-    output = 'randomization-report.txt'
-    yield (inputs,output)
-@files(combine_randomized_files)
-@follows(random_intersections)
-def combined_randomized(inputs,output):
-    fout = open(output,'w')
+def run_randomizations(jobs):
+    stored = load_results()
+    pairs = list(intersect_files())
+    keys = [pair_key(*pair) for pair in pairs]
+    if len(stored) > len(set(keys) & set(stored)):
+        compact_results(stored, keys)
+    shuffle_cache.prune(fns)
+    todo = [pair for pair, key in zip(pairs, keys) if key not in stored]
+    done = [stored[key] for key in keys if key in stored]
+
+    # Leave the report (and so the heatmap) alone if nothing changed
+    if len(todo) == 0 and os.path.exists(REPORT) and \
+            open(REPORT).read() == HEADER + ''.join(done):
+        return
+
+    fout = open(REPORT,'w')
     fout.write(HEADER)
-    for f in inputs:
-        fout.write(open(f).read())
+    fout.writelines(done)
+    fout.flush()
+    if len(todo) == 0:
+        fout.close()
+        return
+
+    # Idle workers pull the next pair as soon as they finish one, and results
+    # are written out in the order they finish.
+    store = open(RESULTS_STORE,'a')
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(random_intersection, todo)
+    else:
+        pool = None
+        results = itertools.imap(random_intersection, todo)
+    for key, line in results:
+        store.write('%s\t%s' % (key, line))
+        store.flush()
+        fout.write(line)
+        fout.flush()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    store.close()
     fout.close()
 
 # TASK:   Plot a heatmap of the normalized scores.
 # Input:  The randomization report
 # Output: A heatmap PDF 
-@follows(combined_randomized)
 @files('randomization-report.txt','heatmap.pdf')
 def make_heatmap(input,output):
     I = IntersectionCluster(input)
-    rcParams['font.size'] = 8
+    plotting.pyplot(headless=True).rcParams['font.size'] = 8
     I.fill_in_matrix()
     sortind = I.cluster()
     fig = I.plot(sortind)
@@ -445,4 +560,5 @@ def package(inputs,output):
     cmds.extend(inputs)
     os.system(' '.join(cmds))
 
-pipeline_run([package],multiprocess=8)
+run_randomizations(options.jobs)
+pipeline_run([package])
@@ -0,0 +1,446 @@
+"""
+Module for in-process randomized intersections of BED files, as used by
+random-intersection-pipeline.py.
+
+Each BED file is loaded once into sorted per-chromosome coordinate arrays
+(Intervals).  To randomize, every feature in file A is moved to a random
+position on its own chromosome, keeping its length, for a whole batch of
+iterations at once.  Positions can be kept out of excluded regions (or inside
+mappable ones) with a genome.Genome; the default is the whole of each dm3
+chromosome.  Overlaps with file B are counted by merging B's features
+into disjoint intervals and using searchsorted, so a batch of iterations is a
+handful of NumPy calls rather than a shuffleBed/intersectBed subprocess pair
+per iteration.
+
+As with ``intersectBed -u``, the statistic is the number of features in A that
+overlap at least one feature in B (by at least 1 bp, half-open coordinates).
+
+Usage::
+
+    a = Intervals('a.bed')
+    b = Intervals('b.bed')
+    results = randomstats(a, b, iterations=1000, seed=0)
+    print results['actual'], results['median randomized'], results['percentile']
+
+When comparing many files against each other, a ShuffleCache shuffles each
+file once and reuses those shuffles against every partner::
+
+    cache = ShuffleCache(1000, cachedir='shuffles')
+    results = randomstats(a, b, 1000, cache=cache)
+
+For other genomes::
+
+    hg19 = genome.Genome.from_files('hg19.chrom.sizes', exclude='gaps.bed')
+    results = randomstats(a, b, 1000, genome=hg19)
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+from genome import as_genome, merge_intervals
+
+# Chromosome sizes for dm3, which is what the randomizations were originally
+# run against.
+DM3 = {'chr2L': 23011544,
+       'chr2LHet': 368872,
+       'chr2R': 21146708,
+       'chr2RHet': 3288761,
+       'chr3L': 24543557,
+       'chr3LHet': 2555491,
+       'chr3R': 27905053,
+       'chr3RHet': 2517507,
+       'chr4': 1351857,
+       'chrM': 19517,
+       'chrU': 10049037,
+       'chrUextra': 29004656,
+       'chrX': 22422827,
+       'chrXHet': 204112,
+       'chrYHet': 347038}
+
+# Upper limit on the number of random placements held in memory at once
+MAX_BATCH_ELEMENTS = 2000000
+
+
+class Intervals(object):
+    def __init__(self, fn, keep_lines=False):
+        """
+        Coordinates of the features in BED file *fn*, as sorted start and stop
+        arrays for each chromosome.  self.index has each feature's number in
+        file order.  If *keep_lines*, the feature lines are kept, in file
+        order, in self.lines.
+        """
+        self.fn = fn
+        chroms = {}
+        lines = []
+        n = 0
+        for line in open(fn):
+            if line.startswith(('track', 'browser', '#')):
+                continue
+            L = line.split('\t', 3)
+            if len(L) < 3:
+                continue
+            coords = chroms.setdefault(L[0], ([], [], []))
+            coords[0].append(int(L[1]))
+            coords[1].append(int(L[2]))
+            coords[2].append(n)
+            n += 1
+            if keep_lines:
+                lines.append(line)
+        self.lines = lines if keep_lines else None
+        self.starts = {}
+        self.stops = {}
+        self.index = {}
+        for chrom, (starts, stops, index) in chroms.items():
+            starts = np.array(starts, dtype=np.int64)
+            stops = np.array(stops, dtype=np.int64)
+            ind = np.argsort(starts, kind='mergesort')
+            self.starts[chrom] = starts[ind]
+            self.stops[chrom] = stops[ind]
+            self.index[chrom] = np.array(index, dtype=np.int64)[ind]
+        self.count = n
+        self._merged = {}
+
+    def __len__(self):
+        return self.count
+
+    def chroms(self):
+        return sorted(self.starts.keys())
+
+    def merged(self, chrom):
+        """
+        Returns (starts, stops) of the disjoint intervals made by merging
+        overlapping features on *chrom*.
+        """
+        if chrom not in self._merged:
+            starts = self.starts.get(chrom, np.zeros(0, dtype=np.int64))
+            stops = self.stops.get(chrom, np.zeros(0, dtype=np.int64))
+            self._merged[chrom] = merge_intervals(starts, stops)
+        return self._merged[chrom]
+
+
+def overlapping(starts, stops, other, chrom):
+    """
+    Boolean array, True for each of the features *starts* to *stops* on
+    *chrom* that overlaps any feature in Intervals *other*.  *starts* and
+    *stops* may be 2-D (iterations x features).
+    """
+    mstarts, mstops = other.merged(chrom)
+    starts = np.asarray(starts)
+    if len(mstarts) == 0:
+        return np.zeros(starts.shape, dtype=bool)
+    # First merged interval ending after each start
+    idx = np.searchsorted(mstops, starts, side='right')
+    hit = idx < len(mstarts)
+    hit &= mstarts[np.minimum(idx, len(mstarts) - 1)] < stops
+    return hit
+
+
+def count_overlapping(starts, stops, other, chrom):
+    """
+    Counts how many of the features *starts* to *stops* on *chrom* overlap
+    any feature in Intervals *other*.  *starts* and *stops* may be 2-D
+    (iterations x features), in which case a count per row is returned.
+    """
+    return overlapping(starts, stops, other, chrom).sum(axis=-1)
+
+
+def actual_count(a, b):
+    """
+    Number of features in *a* that overlap any feature in *b*.
+    """
+    return sum(int(count_overlapping(a.starts[chrom], a.stops[chrom], b, chrom))
+               for chrom in a.chroms())
+
+
+def file_md5(fn):
+    """
+    Hex MD5 digest of the contents of file *fn*.
+    """
+    h = hashlib.md5()
+    f = open(fn, 'rb')
+    for block in iter(lambda: f.read(1 << 20), ''):
+        h.update(block)
+    f.close()
+    return h.hexdigest()
+
+
+def _check_chroms(genome, a):
+    for chrom in a.chroms():
+        if chrom not in genome:
+            raise ValueError('Chromosome %s from %s is not in the genome' % (chrom, a.fn))
+
+
+def _batchsize(a):
+    return max(1, MAX_BATCH_ELEMENTS // max(len(a), 1))
+
+
+def shuffled_counts(a, b, iterations, genome=DM3, random_state=None, cache=None, offset=0):
+    """
+    Returns an array of *iterations* overlap counts, each one for *a*
+    shuffled within chromosomes of *genome* (a genome.Genome, or dict of
+    chrom: size) against *b*.  *random_state* is a numpy RandomState.  If a
+    ShuffleCache is given as *cache*, its shuffles of *a* are used instead of
+    new ones, starting with shuffle number *offset*.
+    """
+    if cache is None:
+        genome = as_genome(genome)
+        _check_chroms(genome, a)
+        if random_state is None:
+            random_state = np.random.RandomState()
+    counts = np.zeros(iterations, dtype=np.int64)
+    batch = _batchsize(a)
+    for first in range(0, iterations, batch):
+        n = min(batch, iterations - first)
+        if cache is not None:
+            shuffles = cache.get(a, offset + first, n)
+        for chrom in a.chroms():
+            lengths = a.stops[chrom] - a.starts[chrom]
+            if cache is not None:
+                starts = shuffles[chrom]
+            else:
+                starts = genome.random_starts(chrom, lengths, n, random_state)
+            counts[first:first + n] += count_overlapping(starts, starts + lengths, b, chrom)
+    return counts
+
+
+class ShuffleCache(object):
+    def __init__(self, iterations, genome=DM3, seed=0, cachedir=None, block=100):
+        """
+        Shuffled copies of BED files, made once and reused for every
+        comparison against them.  Each file is shuffled up to *iterations*
+        times within chromosomes of *genome* (a genome.Genome, or dict of
+        chrom: size), *block* iterations at a time as they're first asked
+        for, so a comparison that stops early never makes the rest.  Each
+        block has a random seed made from *seed*, the file's contents and the
+        block's number, so the same file always gets the same shuffles however
+        they're asked for.
+
+        Shuffled start positions are stored as int32 arrays, one per block
+        and chromosome: 4 bytes per feature per iteration.  If *cachedir* is
+        given they're saved there as .npy files and memory-mapped, so separate
+        processes (and later runs) share them; otherwise they're kept in
+        memory.
+        """
+        self.iterations = iterations
+        self.genome = as_genome(genome)
+        self.seed = seed
+        self.cachedir = cachedir
+        self.block = block
+        self._keys = {}
+        self._blocks = {}
+
+    def key(self, a):
+        """
+        Hex digest identifying the shuffles of Intervals *a* (or of the BED
+        file named *a*).
+        """
+        fn = getattr(a, 'fn', a)
+        settings = (self.iterations, self.seed, self.block, sorted(self.genome.sizes.items()))
+        if self.genome.regions_key() is not None:
+            settings += (self.genome.regions_key(),)
+        settings = repr(settings)
+        return hashlib.md5(file_md5(fn) + settings).hexdigest()
+
+    def path(self, a):
+        """
+        Directory in *cachedir* for the shuffles of Intervals *a* (or of the
+        BED file named *a*).
+        """
+        fn = getattr(a, 'fn', a)
+        return os.path.join(self.cachedir, '%s.%s' % (os.path.basename(fn), self.key(fn)[:16]))
+
+    def prune(self, fns):
+        """
+        Removes everything in *cachedir* except the shuffles of the BED files
+        *fns* with the current settings, so it doesn't grow without bound as
+        files and settings change.
+        """
+        if self.cachedir is None or not os.path.exists(self.cachedir):
+            return
+        keep = set(os.path.basename(self.path(fn)) for fn in fns)
+        for name in os.listdir(self.cachedir):
+            if name in keep:
+                continue
+            path = os.path.join(self.cachedir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def get(self, a, first=0, n=None):
+        """
+        Returns a dict of chrom: (*n* x features) array of shuffled start
+        positions for Intervals *a*, in the same feature order as a.starts,
+        from shuffle number *first* on (by default, all of them).
+        """
+        if n is None:
+            n = self.iterations - first
+        if first + n > self.iterations:
+            raise ValueError('Only %s shuffles are cached; %s requested'
+                             % (self.iterations, first + n))
+        pieces = dict((chrom, []) for chrom in a.chroms())
+        for number in range(first // self.block, (first + n - 1) // self.block + 1):
+            shuffles = self._get_block(a, number)
+            offset = number * self.block
+            lo = max(first, offset) - offset
+            hi = min(first + n, offset + self.block) - offset
+            for chrom in pieces:
+                pieces[chrom].append(shuffles[chrom][lo:hi])
+        return dict((chrom, np.concatenate(arrs) if len(arrs) != 1 else arrs[0])
+                    for chrom, arrs in pieces.items())
+
+    def _get_block(self, a, number):
+        if (a.fn, number) in self._blocks:
+            return self._blocks[(a.fn, number)]
+        if a.fn not in self._keys:
+            _check_chroms(self.genome, a)
+            self._keys[a.fn] = self.key(a)
+        key = self._keys[a.fn]
+        if self.cachedir is None:
+            shuffles = self._make(a, key, number)
+        else:
+            path = os.path.join(self.path(a), str(number))
+            if not os.path.exists(path):
+                if not os.path.exists(os.path.dirname(path)):
+                    try:
+                        os.makedirs(os.path.dirname(path))
+                    except OSError:
+                        pass
+                # Build in a temp dir and rename, so concurrent processes never
+                # see a partial block.
+                tmpdir = tempfile.mkdtemp(dir=os.path.dirname(path))
+                self._make(a, key, number, tmpdir)
+                try:
+                    os.rename(tmpdir, path)
+                except OSError:
+                    shutil.rmtree(tmpdir)
+            shuffles = dict((chrom, np.load(os.path.join(path, chrom + '.npy'), mmap_mode='r'))
+                            for chrom in a.chroms())
+        self._blocks[(a.fn, number)] = shuffles
+        return shuffles
+
+    def _make(self, a, key, number, path=None):
+        seed = hashlib.md5('%s.%s' % (key, number)).hexdigest()
+        random_state = np.random.RandomState(int(seed[:8], 16))
+        rows = min(self.block, self.iterations - number * self.block)
+        batch = _batchsize(a)
+        shuffles = {}
+        for chrom in a.chroms():
+            lengths = a.stops[chrom] - a.starts[chrom]
+            shape = (rows, len(lengths))
+            if path is None:
+                arr = np.empty(shape, dtype=np.int32)
+            else:
+                arr = np.lib.format.open_memmap(os.path.join(path, chrom + '.npy'), mode='w+',
+                                                dtype=np.int32, shape=shape)
+            for first in range(0, rows, batch):
+                n = min(batch, rows - first)
+                arr[first:first + n] = self.genome.random_starts(chrom, lengths, n, random_state)
+            if path is not None:
+                arr.flush()
+                del arr
+            else:
+                shuffles[chrom] = arr
+        return shuffles
+
+
+def percentileofscore(a, score):
+    """
+    Same as scipy.stats.percentileofscore(a, score, kind='rank').
+    """
+    a = np.asarray(a)
+    left = (a < score).sum()
+    right = (a <= score).sum()
+    if right > left:
+        right += 1
+    return (left + right) * 50.0 / len(a)
+
+
+def summarize(actual, distribution):
+    """
+    Statistics for an *actual* count compared to its randomized
+    *distribution*, with the same keys as pybedtools' randomstats().
+    """
+    distribution = np.asarray(distribution)
+    med = np.median(distribution)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = actual / med
+    return {'actual': actual,
+            'iterations': len(distribution),
+            'lower_95th': np.percentile(distribution, 2.5),
+            'median randomized': med,
+            'upper_95th': np.percentile(distribution, 97.5),
+            'percentile': percentileofscore(distribution, actual),
+            'normalized': normalized,
+            'frac randomized above actual': (distribution > actual).mean(),
+            'frac randomized below actual': (distribution < actual).mean()}
+
+
+def _results(a, b, actual, distribution):
+    results = summarize(actual, distribution)
+    results['file_a'] = a.fn
+    results['file_b'] = b.fn
+    results[a.fn] = len(a)
+    results[b.fn] = len(b)
+    return results
+
+
+def _random_state(seed, cache):
+    if seed is not None and cache is not None:
+        raise ValueError('A seed was given along with a ShuffleCache; the '
+                         'shuffles come from the cache, so give the seed to it')
+    return np.random.RandomState(seed)
+
+
+def randomstats(a, b, iterations, genome=DM3, seed=None, cache=None):
+    """
+    Randomized intersection statistics for Intervals *a* against Intervals
+    *b*.  *a* is shuffled *iterations* times with random *seed*, or its
+    shuffles are taken from the ShuffleCache *cache* (which has its own
+    seed).  The returned dict also has the feature counts of each file keyed
+    by filename, as pybedtools did.
+    """
+    distribution = shuffled_counts(a, b, iterations, genome,
+                                   _random_state(seed, cache), cache)
+    return _results(a, b, actual_count(a, b), distribution)
+
+
+def wilson_interval(p, n, z):
+    """
+    Wilson score interval for a proportion *p* observed in *n* trials, with
+    *z* standard errors on each side.
+    """
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return center - half, center + half
+
+
+def adaptive_randomstats(a, b, max_iterations, genome=DM3, seed=None, cache=None,
+                         batch=100, lower=0.1, upper=99.9, z=1.96):
+    """
+    Like randomstats(), but shuffles *batch* iterations at a time and stops
+    as soon as it's clear whether the percentile is beyond the significance
+    thresholds *lower* and *upper* (in percent), or after *max_iterations*.
+
+    The decision uses a Wilson confidence interval (*z* = 1.96 is 95%) for
+    the percentile: once the whole interval is below *lower*, above
+    *upper*, or between the two, more iterations won't change the call.
+    results['iterations'] is the number of iterations actually run.  With
+    a ShuffleCache, only the shuffles used are made.
+    """
+    random_state = _random_state(seed, cache)
+    actual = actual_count(a, b)
+    distribution = np.zeros(0, dtype=np.int64)
+    while len(distribution) < max_iterations:
+        n = min(batch, max_iterations - len(distribution))
+        counts = shuffled_counts(a, b, n, genome, random_state, cache, offset=len(distribution))
+        distribution = np.r_[distribution, counts]
+        p = percentileofscore(distribution, actual) / 100.0
+        lo, hi = wilson_interval(p, len(distribution), z)
+        if hi < lower / 100.0 or lo > upper / 100.0:
+            break
+        if lo > lower / 100.0 and hi < upper / 100.0:
+            break
+    return _results(a, b, actual, distribution)
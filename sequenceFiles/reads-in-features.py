@@ -35,24 +35,31 @@ contains the counts for the following regions:
     * exons and introns (happens often with multiple isoforms)
     * spliced reads
 
-In addition, if you use the --debug option, this script will also create WIG
-files and spliced BED files for these regions.  Use with caution, because the
-files can get quite large.
+In addition, if you use the --debug option, this script will also create a
+WIG file of read coverage for each of these regions.  Coverage is accumulated
+in memory as reads are classified, so no sorting or external tools are needed.
+Add --debug-beds to also write the classified reads out as (unsorted) BED
+files.  Use with caution, because the BED files can get quite large.
 
-Expect the counting to take about a minute per 1M reads; allow extra time for
-sorting and converting BED to WIG if --debug is specified.
+Expect the counting to take about a minute per 1M reads.
 
+Paired-end SAM files can be sorted either by read name or by coordinate.  For
+coordinate-sorted files, alignments waiting for a distant mate are held in
+memory up to --mate-buffer alignments and then spilled to temp files.
 
-Requirements:  bed2wig.py needs to be on your path
-               HTSeq needs to be installed.
+
+Requirements:  HTSeq needs to be installed.
 """
 
 import optparse
 import sys
 import HTSeq
 import os
-import time
 import pdb
+import itertools
+from pileup import Pileup
+from matepairs import pair_sam_lines
+from progress import Progress, StageTimer
 
 op = optparse.OptionParser(usage=usage)
 op.add_option('--sam',help='Input SAM file (required)')
@@ -64,11 +71,23 @@ op.add_option('--outprefix',help='Output BED file prefix for '
 op.add_option('--debug',action='store_true',
               help='Creates useful output, like BEDs and WIGs of counted reads, '
                    'useful for debugging or digging deeper into the returned counts. (optional)')
+op.add_option('--debug-beds',dest='debug_beds',action='store_true',
+              help='When used with --debug, also writes the reads in each class '
+                   'to an unsorted BED file (optional)')
 op.add_option('--verbose',action='store_true',help='Print progress to stderr (optional)')
+op.add_option('--metrics',help='Write a JSON summary of stage timings and '
+                               'throughput to this file (optional)')
 op.add_option('--label',help='Label for library that will be added to the top of count reports '
                               'and will be prefixed to track names if --debug is enabled (default '
                               'is to use the basename of the SAM file)')
 op.add_option('--stranded',action='store_true',help='stranded counting')
+op.add_option('--mate-buffer',dest='mate_buffer',type=int,default=1000000,
+              help='For paired-end data, the maximum number of alignments to hold '
+                   'in memory while waiting for their mates; beyond this, alignments '
+                   'are spilled to temp files.  Only matters for coordinate-sorted '
+                   'input. (default is %default)')
+op.add_option('--tmpdir',help='Directory for temp files used when pairing mates '
+                              '(default is the system temp dir)')
 options,args = op.parse_args()
 
 reqs = ['sam','gff','outprefix']
@@ -87,6 +106,37 @@ if not os.path.exists(outdir) and len(outdir) > 0:
 
 class UnknownChrom( Exception ):
     pass
+
+def invert_strand( iv ):
+    """
+    Returns a copy of HTSeq.GenomicInterval *iv* on the opposite strand.  Used
+    for the second mate of a pair, which comes from the opposite strand of the
+    fragment.
+    """
+    iv2 = iv.copy()
+    if iv2.strand == "+":
+        iv2.strand = "-"
+    elif iv2.strand == "-":
+        iv2.strand = "+"
+    else:
+        raise ValueError, "Illegal strand"
+    return iv2
+
+# HTSeq renamed the line parser at some point; use whichever is available.
+parse_sam_line = getattr(HTSeq.SAM_Alignment, 'from_SAM_line', HTSeq.SAM_Alignment)
+
+def paired_alignments(f):
+    """
+    Yields (first, second) tuples of HTSeq.SAM_Alignment objects for the mates
+    in open paired-end SAM file *f*.  Either can be None if the mate is
+    missing.  Works for name-sorted or coordinate-sorted files.
+    """
+    for first, second in pair_sam_lines(f, options.mate_buffer, options.tmpdir):
+        if first is not None:
+            first = parse_sam_line(first)
+        if second is not None:
+            second = parse_sam_line(second)
+        yield first, second
     
 
 def sam2bed(r,splice=False):
@@ -124,29 +174,37 @@ def sam2bed(r,splice=False):
 # fail early on bad filenames
 open(options.sam).close()
 
-t0 = time.time()
+stages = StageTimer()
 counts = {}
 output_beds = {}
+pileups = {}
 featuretypes = ['gene','exon','intron','spliced','exon-and-intron','exon-only','intron-only','empty','total']
 
-# Create new files for each class of features; write a header line too
+# Buffer size for the optional debugging BED files, which are written to a
+# line at a time
+BED_BUFFER = 4 * 1024 * 1024
+
+# Coverage for each class of features is accumulated in memory as reads are
+# classified; optionally create new BED files for each class too, with a header
+# line.
 for ft in featuretypes:
     counts[ft] = 0
     if options.debug:
-        output_beds[ft] = open(options.outprefix+'.'+ft+'.bed','w')
-        output_beds[ft].write('track name="%s reads"\n' % ft)
+        pileups[ft] = Pileup()
+        if options.debug_beds:
+            output_beds[ft] = open(options.outprefix+'.'+ft+'.bed','w',BED_BUFFER)
+            output_beds[ft].write('track name="%s reads"\n' % ft)
 
 
 # Here we go: time to read in the GFF features as an HTSeq.GenomicArrayOfSets
-featurecount = 0
-gff = HTSeq.GFF_Reader(options.gff)
+stages.start('annotation')
+gff_handle = open(options.gff)
+gff = HTSeq.GFF_Reader(gff_handle)
+gff_progress = Progress('GFF features', fileobj=gff_handle, enabled=options.verbose)
 features = HTSeq.GenomicArrayOfSets([],stranded=options.stranded)
 try:
     for f in gff:
-        featurecount += 1
-        if options.verbose:
-            if featurecount % 5000:
-                sys.stderr.write('\r%s GFF features imported...'%featurecount)
+        gff_progress.tick()
         if f.type not in featuretypes:
             continue
 
@@ -168,7 +226,11 @@ try:
 except ValueError as e:
     e.args += ( gff.get_line_number_string(), )
     raise
+gff_progress.done()
+gff_metrics = gff_progress.summary()
+gff_handle.close()
 
+stages.start('classification')
 try:
     # Get the first read to see if we're dealing with paired-end data
     read_seq = HTSeq.SAM_Reader(options.sam)
@@ -176,21 +238,24 @@ try:
     pe_mode = first_read.paired_end
     
     # Re-initialize read_seq depending on if it's paired-end data or not
-    read_seq = HTSeq.SAM_Reader(options.sam)
+    sam_handle = open(options.sam)
+    read_seq = HTSeq.SAM_Reader(sam_handle)
     if pe_mode:
-        read_seq = HTSeq.pair_SAM_alignments(read_seq)
+        read_seq = paired_alignments(sam_handle)
 
     # Read counter, for feedback to user
-    i = 0 
+    read_progress = Progress('reads', fileobj=sam_handle, enabled=options.verbose)
     total = 0
     # Here we go, through each read...
     for r in read_seq:
+        read_progress.tick()
         spliced = False
         if not pe_mode:
             if not r.aligned:
                 continue
             total += 1
             iv_seq = []
+            alignments = [r]
 
             # Check to see if it's spliced
             for co in r.cigar:
@@ -214,11 +279,12 @@ try:
             # . . . so it's possible the splice counts are underestimating the
             # true number, for paired-end data
             if r[1] is not None and r[1].aligned:                
-                iv_seq = itertools.chain( iv_seq, 
-                    ( invert_strand( co.ref_iv ) for co in r[1].cigar if co.type == "M" ) )
+                iv_seq = list(itertools.chain( iv_seq, 
+                    ( invert_strand( co.ref_iv ) for co in r[1].cigar if co.type == "M" ) ))
             else:
                 if ( r[0] is None ) or not ( r[0].aligned ):
                     continue            
+            alignments = [mate for mate in r if mate is not None and mate.aligned]
         try:
 
             # This empty set will have GFF feature IDs "unioned" to it
@@ -290,37 +356,42 @@ try:
                 else:
                     splice=False
 
-                # Dispatch dictionary of files to write to, depending on
-                # featuretype.  Converts to BED format on the fly, and tries to
-                # be smart about splices.
+                # Add the read to this featuretype's coverage and, if asked,
+                # dispatch to the file for this featuretype.  Converts to BED
+                # format on the fly, and tries to be smart about splices.
                 if options.debug:
-                    output_beds[featuretype].writelines(sam2bed(r,splice))
+                    for aln in alignments:
+                        pileups[featuretype].add(aln.iv.chrom, aln.iv.start, aln.iv.end)
+                        if options.debug_beds:
+                            output_beds[featuretype].write(sam2bed(aln,splice))
 
             counts['total'] += 1
+            if options.debug:
+                for aln in alignments:
+                    pileups['total'].add(aln.iv.chrom, aln.iv.start, aln.iv.end)
+                    if options.debug_beds:
+                        output_beds['total'].write(sam2bed(aln,spliced))
 
         except UnknownChrom:
             if not pe_mode:
                 rr = r
             else: 
                 rr = r[0] if r[0] is not None else r[1]
-            if not quiet:
+            if options.verbose:
                 sys.stderr.write( ( "Warning: Skipping read '%s', because chromosome " +
                     "'%s', to which it has been aligned, did not appear in the GFF file.\n" ) % 
                     ( rr.read.name, iv.chrom ) )
 
-        i += 1
-        if options.verbose:
-            if i % 5000 == 0:
-                sys.stderr.write('\r%d reads processed, %ds elapsed'%(i, time.time()-t0))
-                sys.stderr.flush()
-
 except ValueError as e:
-    e.args += ( read_seq.get_line_number_string(), )
+    if not pe_mode:
+        e.args += ( read_seq.get_line_number_string(), )
     raise
-if options.verbose:
-    sys.stderr.write('\n\n')
+read_progress.done()
+read_metrics = read_progress.summary()
+sam_handle.close()
 
 # write out counts to the report
+stages.start('output')
 fout = open(options.outprefix+'.counts.report','w')
 fout.write(('%s'%options.label)+'\n')
 for fn in sorted( counts.keys() ):
@@ -330,17 +401,20 @@ fout.close()
 
 if options.debug:
     if options.verbose:
-        sys.stderr.write('Sorting output BED files and converting to WIG...\n')
-    for featuretype,f in output_beds.items():
-        fn = f.name
+        sys.stderr.write('Writing coverage to WIG...\n')
+    for f in output_beds.values():
+        f.close()
+    for featuretype,pileup in pileups.items():
+        fn = options.outprefix+'.'+featuretype+'.bed.wig'
         if options.verbose:
             sys.stderr.write(fn+'\n')
             sys.stderr.flush()
-        
-        # make sure you flush the tempfile
-        f.close()
-        label = options.label
-        os.system('sortBed -i %(fn)s > %(fn)s.sorted'%locals())
-        os.system('bed2wig.py -i %(fn)s.sorted -o %(fn)s.wig --type bed --track="name=\"%(label)s-%(featuretype)s\""' % locals())
-        os.unlink('%(fn)s.sorted'%locals())
-
+        fout = open(fn,'w')
+        pileup.write_wig(fout, trackinfo='name="%s-%s"' % (options.label,featuretype))
+        fout.close()
+
+if options.metrics:
+    stages.write_json(options.metrics,
+                      annotation=gff_metrics,
+                      classification=read_metrics,
+                      counts=counts)
@@ -0,0 +1,165 @@
+"""
+Module for robust centering and combining of log ratios from many arrays,
+held as one probe x array matrix (NaN where an array has no value for a
+probe).
+
+The matrix can be a numpy.memmap; everything here works on blocks of rows or
+columns at a time, so hundreds of high-density arrays don't need to fit in
+memory at once.
+
+Usage::
+
+    m = np.load('ratios.npy', mmap_mode='r+')
+    center_columns(m)                        # per-array biweight centering
+    combined = row_biweights(m)              # robust per-probe combination
+    overall, rows, cols, residuals = median_polish(m)
+"""
+import warnings
+import numpy as np
+
+# Number of matrix elements handled at once
+BLOCKSIZE = 1 << 22
+
+
+def _median(x, axis=None):
+    if np.isnan(x).any():
+        with warnings.catch_warnings():
+            # All-NaN rows or columns just give NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmedian(x, axis=axis)
+    return np.median(x, axis=axis)
+
+
+def biweight(x, c=5.0, epsilon=1e-4, axis=None):
+    """
+    Tukey biweight M-estimator of location of *x* (one step from the median,
+    scaled by *c* times the median absolute deviation), along *axis* or of
+    all of *x*.  NaNs are ignored.
+    """
+    x = np.asarray(x, dtype=float)
+    if axis is None:
+        x = x.ravel()
+        axis = 0
+    m = np.expand_dims(_median(x, axis), axis)
+    s = np.expand_dims(_median(np.abs(x - m), axis), axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u = (x - m) / (c * s + epsilon)
+        inside = np.abs(u) <= 1
+        w = np.where(inside, (1 - u ** 2) ** 2, 0)
+        return (w * np.where(inside, x, 0)).sum(axis) / w.sum(axis)
+
+
+def _blocks(n, width, blocksize):
+    step = max(1, blocksize // max(width, 1))
+    for start in range(0, n, step):
+        yield slice(start, min(start + step, n))
+
+
+def row_means(matrix, blocksize=BLOCKSIZE, weights=None):
+    """
+    Mean of each row (probe) of *matrix*, ignoring NaNs, with each value
+    weighted by the matching element of *weights* if given.
+    """
+    n, m = matrix.shape
+    out = np.empty(n)
+    for rows in _blocks(n, m, blocksize):
+        if weights is None:
+            out[rows] = np.nanmean(matrix[rows], axis=1)
+            continue
+        x = matrix[rows]
+        w = np.where(np.isnan(x), 0, weights[rows])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[rows] = np.nansum(x * w, axis=1) / w.sum(axis=1)
+    return out
+
+
+def row_biweights(matrix, c=5.0, epsilon=1e-4, blocksize=BLOCKSIZE):
+    """
+    Biweight of each row (probe) of *matrix*, across arrays.
+    """
+    n, m = matrix.shape
+    out = np.empty(n)
+    for rows in _blocks(n, m, blocksize):
+        out[rows] = biweight(matrix[rows], c, epsilon, axis=1)
+    return out
+
+
+def column_biweights(matrix, c=5.0, epsilon=1e-4, blocksize=BLOCKSIZE):
+    """
+    Biweight of each column (array) of *matrix*, across probes.
+    """
+    n, m = matrix.shape
+    out = np.empty(m)
+    for cols in _blocks(m, n, blocksize):
+        out[cols] = biweight(matrix[:, cols], c, epsilon, axis=0)
+    return out
+
+
+def _subtract(matrix, rowvals=None, colvals=None, blocksize=BLOCKSIZE):
+    n, m = matrix.shape
+    for rows in _blocks(n, m, blocksize):
+        if rowvals is not None:
+            matrix[rows] -= rowvals[rows, None]
+        if colvals is not None:
+            matrix[rows] -= colvals
+
+
+def center_columns(matrix, c=5.0, epsilon=1e-4, blocksize=BLOCKSIZE):
+    """
+    Subtracts the biweight of each column (array) of *matrix* in place.
+    Returns the biweights.
+    """
+    locations = column_biweights(matrix, c, epsilon, blocksize)
+    _subtract(matrix, colvals=locations, blocksize=blocksize)
+    return locations
+
+
+def center_rows(matrix, c=5.0, epsilon=1e-4, blocksize=BLOCKSIZE):
+    """
+    Subtracts the biweight of each row (probe) of *matrix* in place.
+    Returns the biweights.
+    """
+    locations = row_biweights(matrix, c, epsilon, blocksize)
+    _subtract(matrix, rowvals=locations, blocksize=blocksize)
+    return locations
+
+
+def median_polish(matrix, maxiter=10, eps=0.01, blocksize=BLOCKSIZE):
+    """
+    Tukey's median polish of *matrix*, done in place: *matrix* is left
+    holding the residuals.  Returns (overall, row effects, column effects,
+    residuals), so that each value is overall + row + column + residual.
+    Stops when the sum of absolute residuals changes by less than a
+    fraction *eps*, as R's medpolish() does.
+    """
+    n, m = matrix.shape
+    overall = 0.
+    roweffects = np.zeros(n)
+    coleffects = np.zeros(m)
+    oldsum = 0.
+    for i in range(maxiter):
+        delta = np.empty(n)
+        for rows in _blocks(n, m, blocksize):
+            delta[rows] = _median(matrix[rows], axis=1)
+        delta[np.isnan(delta)] = 0
+        _subtract(matrix, rowvals=delta, blocksize=blocksize)
+        roweffects += delta
+        shift = _median(coleffects)
+        coleffects -= shift
+        overall += shift
+
+        delta = np.empty(m)
+        for cols in _blocks(m, n, blocksize):
+            delta[cols] = _median(matrix[:, cols], axis=0)
+        delta[np.isnan(delta)] = 0
+        _subtract(matrix, colvals=delta, blocksize=blocksize)
+        coleffects += delta
+        shift = _median(roweffects)
+        roweffects -= shift
+        overall += shift
+
+        newsum = sum(np.nansum(np.abs(matrix[rows])) for rows in _blocks(n, m, blocksize))
+        if newsum == 0 or abs(newsum - oldsum) < eps * newsum:
+            break
+        oldsum = newsum
+    return overall, roweffects, coleffects, matrix
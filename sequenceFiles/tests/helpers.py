@@ -0,0 +1,71 @@
+"""
+Helpers shared by the test modules, for writing small input files to a
+temporary directory that is removed once the test module is done.
+
+Usage::
+
+    from helpers import TempDir
+    tmp = TempDir()
+    teardown_module = tmp.cleanup
+
+    fn = tmp.write('a.gff', lines)
+    bedfn = tmp.write_bed([('chr2L', 0, 100), ('chrX', 50, 60)])
+"""
+import os
+import shutil
+import tempfile
+
+
+class TempDir(object):
+    def __init__(self):
+        """
+        Temporary directory, created the first time it's used.  Every file
+        name handed out is unique, so tests can't clobber each other's files.
+        """
+        self.path = None
+        self.count = 0
+
+    def filename(self, name):
+        """
+        New path ending in *name* inside the directory.
+        """
+        if self.path is None:
+            self.path = tempfile.mkdtemp(prefix='sequenceFiles-tests-')
+        self.count += 1
+        return os.path.join(self.path, '%s.%s' % (self.count, name))
+
+    def mkdir(self, name='dir'):
+        """
+        New empty subdirectory.
+        """
+        path = self.filename(name)
+        os.mkdir(path)
+        return path
+
+    def write(self, name, lines):
+        """
+        Writes *lines* to a new file ending in *name*; returns its path.
+        """
+        fn = self.filename(name)
+        fout = open(fn, 'w')
+        fout.writelines(lines)
+        fout.close()
+        return fn
+
+    def write_bed(self, features, name='a.bed'):
+        """
+        Writes (chrom, start, stop) tuples as a BED file with a track line,
+        naming the features f0, f1, ... in order; returns its path.
+        """
+        lines = ['track name="test"\n']
+        for i, (chrom, start, stop) in enumerate(features):
+            lines.append('%s\t%s\t%s\tf%s\n' % (chrom, start, stop, i))
+        return self.write(name, lines)
+
+    def cleanup(self):
+        """
+        Removes the directory and everything in it.
+        """
+        if self.path is not None:
+            shutil.rmtree(self.path)
+            self.path = None
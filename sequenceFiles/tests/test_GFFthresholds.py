@@ -0,0 +1,105 @@
+"""Test functions for GFFthresholds.py"""
+
+import random
+import numpy as np
+import GFFthresholds
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+def make_gff(seed=0, n=3000):
+    r = random.Random(seed)
+    fn = tmp.filename('a.gff')
+    fout = open(fn, 'w')
+    fout.write('##gff-version 3\n')
+    probes = []
+    for chrom in ['chr2L', 'chrX']:
+        pos = 0
+        for i in range(n):
+            pos += r.choice([100, 200, 300, 800])
+            # clusters of high ratios
+            ratio = r.gauss(0, 1) + (6 if (i // 20) % 30 == 0 else 0)
+            probes.append((chrom, pos, pos + 50, ratio))
+    r.shuffle(probes)
+    for i, (chrom, start, stop, ratio) in enumerate(probes):
+        fout.write('%s\tNimbleGen\tp%s\t%s\t%s\t%s\t.\t.\tprobe=%s\n'
+                   % (chrom, i, start, stop, ratio, i))
+    fout.close()
+    return fn, probes
+
+def reference(probes, nsd=2.5, maxgap=500, minprobes=4):
+    """The original row-by-row loop"""
+    ratios = np.array([p[3] for p in probes])
+    thresh = ratios.mean() + nsd * ratios.std()
+    regions = []
+    region = []
+    lastpos = None
+    lastchr = None
+    for chrom, start, stop, ratio in sorted(probes):
+        if ratio < thresh:
+            continue
+        dist = 0 if lastpos is None else start - lastpos
+        if dist > maxgap or chrom != lastchr:
+            if len(region) >= minprobes:
+                regions.append((region[0][0], region[0][1], region[-1][2]))
+            region = []
+        lastpos = stop
+        lastchr = chrom
+        region.append((chrom, start, stop))
+    if len(region) >= minprobes:
+        regions.append((region[0][0], region[0][1], region[-1][2]))
+    return regions
+
+def read_bed(fn):
+    return [(L[0], int(L[1]), int(L[2])) for L in (line.split() for line in open(fn))]
+
+def test_GFFthreshold():
+    fn, probes = make_gff()
+    expected = reference(probes)
+    assert len(expected) > 10
+    for streaming in [False, True]:
+        outfn = fn + '.%s.bed' % streaming
+        GFFthresholds.GFFthreshold(fn, outfn, streaming=streaming)
+        assert read_bed(outfn) == expected
+
+def test_ratio_stats():
+    fn, probes = make_gff()
+    ratios = np.array([p[3] for p in probes])
+    mean, sd = GFFthresholds.ratio_stats(fn, chunksize=77)
+    assert abs(mean - ratios.mean()) < 1e-9
+    assert abs(sd - ratios.std()) < 1e-9
+
+def test_find_runs():
+    starts = np.array([0, 100, 200, 300, 1000, 1100, 1200, 1300, 1400, 3000])
+    starts, stops = GFFthresholds.find_runs(starts, starts + 50, maxgap=500, minprobes=4)
+    assert starts.tolist() == [0, 1000]
+    assert stops.tolist() == [350, 1450]
+
+def test_call_peaks():
+    fn, probes = make_gff()
+    criteria = [GFFthresholds.Criteria(),
+                GFFthresholds.Criteria.parse('nsd=2,maxgap=300,minprobes=3'),
+                GFFthresholds.Criteria.parse('cutoff=4.5,minprobes=5'),
+                GFFthresholds.Criteria.parse('per_chrom,nsd=2.5')]
+    assert criteria[1].name == 'nsd2.0-gap300-min3'
+    assert criteria[3].name == 'nsd2.5-chrom-gap500-min4'
+    outbeds = [fn + '.%s.bed' % c.name for c in criteria]
+    for streaming in [False, True]:
+        thresholds = GFFthresholds.call_peaks(fn, criteria, outbeds, streaming=streaming)
+        assert read_bed(outbeds[0]) == reference(probes)
+        assert read_bed(outbeds[1]) == reference(probes, nsd=2, maxgap=300, minprobes=3)
+        assert thresholds[2] == {'chr2L': 4.5, 'chrX': 4.5}
+        for chrom in ['chr2L', 'chrX']:
+            ratios = np.array([p[3] for p in probes if p[0] == chrom])
+            assert abs(thresholds[3][chrom] - (ratios.mean() + 2.5 * ratios.std())) < 1e-9
+        expected = [f for chrom in ['chr2L', 'chrX']
+                    for f in reference([p for p in probes if p[0] == chrom])]
+        assert read_bed(outbeds[3]) == expected
+
+    try:
+        GFFthresholds.Criteria.parse('nsd=2,gap=300')
+    except ValueError:
+        pass
+    else:
+        assert False
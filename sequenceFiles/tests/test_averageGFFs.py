@@ -0,0 +1,81 @@
+"""Test functions for averageGFFs.py"""
+
+import random
+import numpy as np
+import averageGFFs
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+def make_gffs(seed=0, nfiles=3, nprobes=500):
+    r = random.Random(seed)
+    fns = []
+    expected = {}
+    for i in range(nfiles):
+        fn = tmp.filename('%s.gff' % i)
+        fout = open(fn, 'w')
+        fout.write('##gff-version 3\n')
+        # each file is missing some probes, and has them in its own order
+        probes = [j for j in range(nprobes) if r.random() > 0.1]
+        r.shuffle(probes)
+        for j in probes:
+            ratio = round(r.gauss(0, 1), 4)
+            expected.setdefault('probe=%s' % j, []).append(ratio)
+            fout.write('chr2L\tNimbleGen\tp%s\t%s\t%s\t%s\t.\t.\tprobe=%s\n'
+                       % (j, j * 100, j * 100 + 50, ratio, j))
+        fout.close()
+        fns.append(fn)
+    return fns, expected
+
+def test_average():
+    fns, expected = make_gffs()
+    index, means = averageGFFs.average(fns)
+    assert len(index) == len(expected)
+    for key, row in index.rows.items():
+        assert abs(means[row] - np.mean(expected[key])) < 1e-12
+
+    outfn = fns[0] + '.out'
+    averageGFFs.write_gff(index, means, outfn)
+    lines = [line.rstrip('\n').split('\t') for line in open(outfn)]
+    assert len(lines) == len(expected)
+    for L in lines:
+        assert L[:5] == ['chr2L', 'NimbleGen', L[8].replace('probe=', 'p'),
+                         L[3], str(int(L[3]) + 50)]
+        assert abs(float(L[5]) - np.mean(expected[L[8]])) < 1e-9
+
+def test_ratio_matrix():
+    fns, expected = make_gffs()
+    index, matrix, counts = averageGFFs.ratio_matrix(fns)
+    assert counts is None
+    assert matrix.shape == (len(expected), len(fns))
+    index2, means = averageGFFs.average(fns)
+    assert np.allclose(averageGFFs.combine(matrix.copy()), means)
+
+    # Memory-mapped the same way
+    old = averageGFFs.MAX_IN_MEMORY
+    averageGFFs.MAX_IN_MEMORY = 0
+    try:
+        index3, mm, counts = averageGFFs.ratio_matrix(fns, tmp.mkdir())
+    finally:
+        averageGFFs.MAX_IN_MEMORY = old
+    assert isinstance(mm, np.memmap)
+    assert np.array_equal(np.isnan(mm), np.isnan(matrix))
+    assert np.allclose(mm, matrix, equal_nan=True)
+
+    for method in ['biweight', 'median-polish']:
+        values = averageGFFs.combine(matrix.copy(), method, center_arrays=True)
+        assert values.shape == means.shape and not np.isnan(values).any()
+
+def test_repeated_probes():
+    """A probe in a file twice is averaged the same way in both paths."""
+    line = 'chr2L\tNimbleGen\tp%s\t%s\t%s\t%s\t.\t.\tprobe=%s\n'
+    fns = [tmp.write('dup.gff', [line % (0, 0, 50, 1.0, 0), line % (1, 100, 150, 2.0, 1),
+                                 line % (0, 0, 50, 3.0, 0)]),
+           tmp.write('dup.gff', [line % (0, 0, 50, 5.0, 0)])]
+    index, means = averageGFFs.average(fns)
+    index2, matrix, counts = averageGFFs.ratio_matrix(fns)
+    assert np.allclose(matrix, [[2.0, 5.0], [2.0, np.nan]], equal_nan=True)
+    assert counts.tolist() == [[2, 1], [1, 0]]
+    assert np.allclose(means, [3.0, 2.0])
+    assert np.allclose(averageGFFs.combine(matrix, counts=counts), means)
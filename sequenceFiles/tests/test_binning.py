@@ -0,0 +1,50 @@
+"""Test functions for binning.py"""
+
+import random
+import numpy as np
+import binning
+
+def test_known_bins():
+    # values from the UCSC binFromRange()
+    assert binning.bin_from_range(0, 1) == 585
+    assert binning.bin_from_range(1000, 2000) == 585
+    assert binning.bin_from_range(131072, 131073) == 586
+    assert binning.bin_from_range(131071, 131073) == 73
+    assert binning.bin_from_range(0, 512*1024*1024) == 0
+    assert binning.bin_from_range(600000000, 600000001) == 4681 + 4681 + (600000000 >> 17)
+    assert binning.overlapping_bins(1000, 200000) == [585, 586, 73, 9, 1, 0,
+                                                     9362, 9363, 5266, 4754, 4690, 4682, 4681]
+
+def random_ranges(n=5000, seed=0):
+    r = random.Random(seed)
+    starts, stops = [], []
+    for i in range(n):
+        start = r.randint(0, 600000000)
+        starts.append(start)
+        stops.append(start + r.choice([0, 1, 25, 1000, 200000, 5000000, 100000000]))
+    return starts, stops
+
+def test_vectorized():
+    starts, stops = random_ranges()
+    expected = [binning.bin_from_range(a, b) for a, b in zip(starts, stops)]
+    assert binning.bins_from_ranges(starts, stops).tolist() == expected
+
+def test_overlapping():
+    """Any feature overlapping a query range is in one of its bins."""
+    starts, stops = random_ranges(500, seed=1)
+    r = random.Random(2)
+    for start, stop in zip(starts, stops):
+        bins = set(binning.overlapping_bins(start, stop))
+        for i in range(20):
+            fstart = r.randint(max(0, start - 10000), max(start, stop - 1))
+            fstop = max(fstart + r.choice([1, 50, 300000]), start + 1)
+            assert binning.bin_from_range(fstart, fstop) in bins
+
+def test_invalid():
+    for start, stop in [(-1, 10), (10, 5), (0, 2**32)]:
+        try:
+            binning.bin_from_range(start, stop)
+        except ValueError:
+            pass
+        else:
+            assert False
@@ -0,0 +1,78 @@
+"""Test functions for compare_cell_types.py"""
+
+import random
+import compare_cell_types
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+def make_files(seed=0):
+    r = random.Random(seed)
+    wigfn = tmp.filename('a.wig')
+    bedfn = tmp.filename('a.bed')
+    fout = open(wigfn, 'w')
+    # chrY is only in the WIG, chrM only in the BED
+    for chrom in ['chr2L', 'chrY', 'chrX']:
+        fout.write('track type=wiggle_0\nvariableStep chrom=%s span=10\n' % chrom)
+        for i in range(1, 5000, 10):
+            fout.write('%s\t%s\n' % (i, r.random()))
+    fout.close()
+    fout = open(bedfn, 'w')
+    for chrom in ['chr2L', 'chrM', 'chrX']:
+        features = []
+        for i in range(50):
+            start = r.randint(0, 4900)
+            features.append((start, start + r.choice([5, 50, 500])))
+        for start, stop in sorted(features):
+            fout.write('%s\t%s\t%s\n' % (chrom, start, stop))
+    fout.close()
+    return bedfn, wigfn
+
+def check_raises(bedfn, wigfn):
+    try:
+        list(compare_cell_types.intersect(bedfn, wigfn))
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_intersect():
+    bedfn, wigfn = make_files()
+    wigs = list(compare_cell_types.wig_features(wigfn))
+    expected = []
+    for b in compare_cell_types.bed_features(bedfn):
+        expected.extend((w.chrom, w.start, w.value) for w in wigs
+                        if w.chrom == b.chrom and w.start >= b.start and w.stop <= b.stop)
+    got = [(w.chrom, w.start, w.value) for w in compare_cell_types.intersect(bedfn, wigfn)]
+    assert len(expected) > 0
+    assert got == expected
+
+def test_unsorted():
+    bedfn, wigfn = make_files()
+    lines = open(bedfn).readlines()
+    lines[1], lines[2] = lines[2], lines[1]
+    open(bedfn, 'w').writelines(lines)
+    check_raises(bedfn, wigfn)
+
+def test_wig_order():
+    bedfn = tmp.write('b.bed', ['chr2L\t0\t100\n', 'chrX\t0\t100\n'])
+    wig = ['variableStep chrom=chrX span=10\n', '11\t1.0\n',
+           'variableStep chrom=chr2L span=10\n', '11\t2.0\n']
+    check_raises(bedfn, tmp.write('b.wig', wig))
+
+    # same order works, with chromosomes only in the WIG anywhere
+    wig = wig[2:] + ['variableStep chrom=chrY span=10\n', '5\t3.0\n'] + wig[:2]
+    got = [(w.chrom, w.value) for w in
+           compare_cell_types.intersect(bedfn, tmp.write('b.wig', wig))]
+    assert got == [('chr2L', 2.0), ('chrX', 1.0)]
+
+    # not sorted within a chromosome
+    wig = ['variableStep chrom=chr2L span=10\n', '51\t1.0\n', '11\t2.0\n']
+    check_raises(bedfn, tmp.write('b.wig', wig))
+
+    # a chromosome split in two
+    wig = ['variableStep chrom=chr2L span=10\n', '11\t1.0\n',
+           'variableStep chrom=chrY span=10\n', '11\t1.0\n',
+           'variableStep chrom=chr2L span=10\n', '51\t2.0\n']
+    check_raises(bedfn, tmp.write('b.wig', wig))
@@ -0,0 +1,68 @@
+"""Test functions for dbload.py and bed2db.py"""
+
+import os
+import sqlite3
+import bedparser
+import binning
+import dbload
+import bed2db
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+def test_bulk_load():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (a int, b text)')
+    rows = ((i, str(i)) for i in xrange(1234))
+    assert dbload.bulk_load(conn, 'INSERT INTO t VALUES (?,?)', rows, batchsize=100) == 1234
+    assert conn.execute('SELECT count(*), sum(a) FROM t').fetchone() == (1234, sum(range(1234)))
+    dbload.create_indexes(conn, 't', [('idx_ab', 'a, b')])
+    names = [i[0] for i in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")]
+    assert names == ['idx_ab']
+
+def test_rollback():
+    """A failed load leaves nothing behind."""
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (a int UNIQUE)')
+    try:
+        dbload.bulk_load(conn, 'INSERT INTO t VALUES (?)', [(1,), (2,), (1,)], batchsize=2)
+    except sqlite3.IntegrityError:
+        pass
+    else:
+        assert False
+    assert conn.execute('SELECT count(*) FROM t').fetchone() == (0,)
+
+def test_bed2db():
+    fn = os.path.join(os.path.dirname(__file__), 'inputfiles', 'single.track.9.fields.bed')
+    dbfn = tmp.filename('features.db')
+    conn = bed2db.bed2db(fn, dbfn)
+    rows = conn.execute('SELECT * FROM features').fetchall()
+    features = list(bedparser.bedfile(fn))
+    assert len(rows) == len(features)
+    for row, f in zip(rows, features):
+        assert row[:5] == (f.chr, f.start, f.stop, f.name, f.value)
+        assert row[6:8] == (f.thickStart, f.thickStop)
+        assert row[12] == binning.bin_from_range(f.start, f.stop)
+
+def test_pragmas_restored():
+    """The database's own settings are put back after a load."""
+    conn = sqlite3.connect(tmp.filename('wal.db'))
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('CREATE TABLE t (a int)')
+    before = dbload.get_pragmas(conn, dbload.LOAD_PRAGMAS + dbload.INDEX_PRAGMAS)
+    dbload.bulk_load(conn, 'INSERT INTO t VALUES (?)', [(i,) for i in range(10)])
+    dbload.create_indexes(conn, 't', [('idx_a', 'a')])
+    assert dbload.get_pragmas(conn, dbload.LOAD_PRAGMAS + dbload.INDEX_PRAGMAS) == before
+    assert dict(before)['journal_mode'] == 'wal'
+
+def test_extra_columns():
+    """Fields past the 12th are ignored."""
+    fn = tmp.write('extra.bed', ['chr2L\t10\t20\tname\t1.5\t+\t10\t20\t0,0,0\t1\t10,\t0,\textra\n',
+                                 'chrX\t5\t6\n'])
+    rows = list(bed2db.bed_rows(fn))
+    assert [len(row) for row in rows] == [13, 13]
+    assert rows[0][:3] == ['chr2L', 10, 20] and rows[0][11] == '0,'
+    conn = bed2db.bed2db(fn, tmp.filename('extra.db'))
+    assert conn.execute('SELECT count(*) FROM features').fetchone() == (2,)
@@ -0,0 +1,86 @@
+"""Test functions for featuredb.py"""
+
+import random
+import sqlite3
+import bed2db
+import featuredb
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+def make_db(seed=0):
+    r = random.Random(seed)
+    bedfn = tmp.filename('a.bed')
+    dbfn = tmp.filename('a.db')
+    features = []
+    fout = open(bedfn, 'w')
+    for chrom in ['chr2L', 'chrX']:
+        for i in range(500):
+            start = r.randint(0, 300000)
+            stop = start + r.choice([0, 1, 30, 2000, 150000])
+            features.append((chrom, start, stop, 'f%s' % i))
+            fout.write('%s\t%s\t%s\tf%s\n' % (chrom, start, stop, i))
+    fout.close()
+    bed2db.bed2db(bedfn, dbfn)
+    return featuredb.FeatureDB(dbfn), features, bedfn
+
+def check_queries(db, features):
+    r = random.Random(1)
+    for i in range(100):
+        chrom = r.choice(['chr2L', 'chrX'])
+        start = r.randint(0, 310000)
+        stop = start + r.choice([1, 100, 50000])
+        expected = sorted(f[3] for f in features
+                          if f[0] == chrom and f[1] < stop and f[2] > start)
+        got = sorted(f.name for f in db.overlapping(chrom, start, stop))
+        assert got == expected
+
+        near = db.nearest(chrom, start, k=3)
+        dists = sorted(featuredb._distance(f, start) for f in db.overlapping(chrom, 0, 10**9))
+        assert [featuredb._distance(f, start) for f in near] == dists[:3]
+    assert db.overlapping('chrM', 0, 1000) == []
+    assert db.nearest('chrM', 0) == []
+
+def test_rtree():
+    db, features, bedfn = make_db()
+    assert db.has_rtree
+    check_queries(db, features)
+
+def test_bins():
+    db, features, bedfn = make_db()
+    db.has_rtree = False
+    check_queries(db, features)
+
+def test_batch():
+    db, features, bedfn = make_db()
+    results = list(db.batch(bedfn))
+    assert len(results) == len(features)
+    for region, found in results:
+        if region.stop > region.start:
+            assert region.name in [f.name for f in found]
+
+def test_pool():
+    db, features, bedfn = make_db()
+    pool = featuredb.ConnectionPool(db.dbfn, size=3)
+    results = pool.batch(bedfn)
+    expected = list(db.batch(bedfn))
+    assert [[f.name for f in found] for region, found in results] == \
+           [[f.name for f in found] for region, found in expected]
+    counts = pool.execute('SELECT count(*) FROM features WHERE chrom=?', [('chr2L',), ('chrX',)])
+    assert counts == [[(500,)], [(500,)]]
+    conn = pool.acquire()
+    try:
+        conn.execute('DELETE FROM features')
+    except sqlite3.OperationalError:
+        pass
+    else:
+        assert False
+    pool.release(conn)
+    pool.close()
+
+    # The database file is only switched to WAL when asked
+    journal_mode = lambda: sqlite3.connect(db.dbfn).execute('PRAGMA journal_mode').fetchone()[0]
+    assert journal_mode() == 'delete'
+    featuredb.ConnectionPool(db.dbfn, size=1, wal=True).close()
+    assert journal_mode() == 'wal'
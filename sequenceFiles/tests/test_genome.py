@@ -0,0 +1,66 @@
+"""Test functions for genome.py"""
+
+import numpy as np
+import genome
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+def write(lines):
+    return tmp.write('a.txt', lines)
+
+def test_merge_and_subtract():
+    starts, stops = genome.merge_intervals([0, 5, 8, 20, 30], [10, 20, 9, 25, 40])
+    assert starts.tolist() == [0, 20, 30]
+    assert stops.tolist() == [20, 25, 40]
+
+    starts, stops = genome.subtract_intervals(np.array([0, 50]), np.array([40, 100]),
+                                              np.array([10, 35, 90]), np.array([20, 60, 200]))
+    assert starts.tolist() == [0, 20, 60]
+    assert stops.tolist() == [10, 35, 90]
+
+def test_from_files():
+    sizes = write(['chr1\t1000\n', 'chr2\t500\n'])
+    exclude = write(['track name=gaps\n', 'chr1\t100\t200\n', 'chr1\t150\t300\n', 'chrUn\t0\t10\n'])
+    include = write(['chr1\t0\t600\n', 'chr2\t400\t800\n'])
+    g = genome.Genome.from_files(sizes)
+    assert g.chroms() == ['chr1', 'chr2']
+    assert g['chr1'] == 1000 and 'chr2' in g and 'chr3' not in g
+    assert g.effective_size() == 1500
+    assert g.regions_key() is None
+
+    g = genome.Genome.from_files(sizes, exclude=exclude)
+    assert g.effective_size('chr1') == 800 and g.effective_size('chr2') == 500
+    assert g.regions_key() is not None
+
+    g = genome.Genome.from_files(sizes, exclude=exclude, include=include)
+    assert g.allowed('chr1')[0].tolist() == [0, 300]
+    assert g.allowed('chr1')[1].tolist() == [100, 600]
+    assert g.allowed('chr2')[0].tolist() == [400]
+    assert g.allowed('chr2')[1].tolist() == [500]
+
+def test_random_starts():
+    rs = np.random.RandomState(0)
+    g = genome.Genome({'chr1': 10000})
+    lengths = np.array([1, 50, 10000])
+    starts = g.random_starts('chr1', lengths, 200, rs)
+    assert starts.shape == (200, 3)
+    assert (starts >= 0).all() and (starts + lengths <= 10000).all()
+    assert (starts[:, 2] == 0).all()
+
+    exclude = {'chr1': (np.array([1000, 5000]), np.array([4000, 9000]))}
+    g = genome.Genome({'chr1': 10000}, exclude=exclude)
+    lengths = np.array([1, 100, 900, 1000])
+    starts = g.random_starts('chr1', lengths, 500, rs)
+    stops = starts + lengths
+    outside = lambda lo, hi: (stops <= lo) | (starts >= hi)
+    assert (starts >= 0).all() and (stops <= 10000).all()
+    assert (outside(1000, 4000) & outside(5000, 9000)).all()
+    assert set(starts[:, 3]) == set([0, 4000, 9000])
+    try:
+        g.random_starts('chr1', [1001], 1, rs)
+    except ValueError:
+        pass
+    else:
+        assert False
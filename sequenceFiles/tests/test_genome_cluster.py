@@ -0,0 +1,103 @@
+"""Test functions for genome_cluster.py"""
+
+import random
+import numpy as np
+import genome_cluster
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+def random_features(seed, n=2000):
+    r = random.Random(seed)
+    features = []
+    for chrom in ['chr2L', 'chr2R', 'chrX']:
+        pos = r.choice([0, 10])
+        for i in range(n):
+            pos += r.choice([0, 1, 2, 5, 13, 40, 300, 5000])
+            value = r.choice([0.1, 0.2, 1, 2.25, -1])
+            features.append(genome_cluster.Feature(chrom, pos, pos + r.choice([21, 26, 400]), value))
+    return features
+
+def to_arrays(features):
+    chroms = []
+    for f in features:
+        if f.chrom not in chroms:
+            chroms.append(f.chrom)
+    return genome_cluster.FeatureArrays(chroms,
+                                        [chroms.index(f.chrom) for f in features],
+                                        [f.start for f in features],
+                                        [f.stop for f in features],
+                                        [f.value for f in features])
+
+def legacy_clusters(features, kwargs):
+    """Clusters yielded by the Cluster-object loop, as (chrom, start, stop,
+    count, clusterscore, unique features) tuples."""
+    results = []
+    cluster = genome_cluster.Cluster(**kwargs)
+    for feature in features:
+        if cluster.check_feature(feature):
+            cluster.extend(feature)
+        else:
+            if cluster.check_yield():
+                results.append((cluster.chrom, cluster.start, cluster.stop, cluster.count,
+                                cluster.clusterscore, cluster.unique_features()))
+            cluster = genome_cluster.Cluster(feature=feature, **kwargs)
+    return results
+
+def check_same(kwargs, seed):
+    features = random_features(seed)
+    expected = legacy_clusters(features, kwargs)
+    clusters = genome_cluster.cluster_arrays(to_arrays(features), kwargs['gapwidth'],
+                                             kwargs['threshold'], kwargs.get('forceclustersize'))
+    mask = clusters.check_yield(minclustersize=kwargs.get('minclustersize'),
+                                minfeaturecount=kwargs.get('minfeaturecount'),
+                                forceclustersize=kwargs.get('forceclustersize'),
+                                minclusterscore=kwargs.get('minclusterscore'))
+    chroms = clusters.chrom
+    got = [(chroms[i], clusters.start[i], clusters.stop[i], clusters.count[i],
+            clusters.score[i], clusters.unique[i]) for i in np.flatnonzero(mask)]
+    assert len(got) == len(expected)
+    for a, b in zip(got, expected):
+        assert a == b, (a, b)
+
+def test_hannon_params():
+    for seed in range(3):
+        check_same({'gapwidth': 1e15, 'threshold': 1, 'minfeaturecount': 3,
+                    'minclustersize': 1, 'forceclustersize': 200}, seed)
+        check_same({'gapwidth': 200, 'threshold': 1}, seed)
+
+def test_brennecke_params():
+    for seed in range(3):
+        check_same({'gapwidth': 1e15, 'threshold': 0, 'minclusterscore': 5,
+                    'forceclustersize': 5000}, seed)
+        check_same({'gapwidth': 20000, 'threshold': 0}, seed)
+
+def test_sweep():
+    features = to_arrays(random_features(0))
+    grid = {'gapwidth': [200, 1e15], 'threshold': [0],
+            'forceclustersize': [None, 200], 'minfeaturecount': [None, 3]}
+    results = list(genome_cluster.sweep(features, grid, processes=1))
+    assert len(results) == 8
+    for result in results:
+        clusters = genome_cluster.cluster_arrays(features, result['gapwidth'], 0,
+                                                 result['forceclustersize'])
+        mask = clusters.check_yield(minfeaturecount=result['minfeaturecount'],
+                                    forceclustersize=result['forceclustersize'])
+        mask[0] = False
+        assert result['clusters'] == mask.sum()
+        assert result['features'] == clusters.count[mask].sum()
+
+def test_parallel():
+    """Splitting by chrom gives the same output as the serial version."""
+    fn = tmp.filename('features.bed')
+    fout = open(fn, 'w')
+    for f in random_features(1):
+        fout.write(f.tostring())
+    fout.close()
+    for func, fn2 in [(genome_cluster.hannon_cluster, fn + '.clusters.clustered'),
+                      (genome_cluster.brennecke_cluster, fn + '.bren.clusters.clustered')]:
+        func(fn, processes=1)
+        serial = open(fn2).read()
+        func(fn, processes=2)
+        assert open(fn2).read() == serial
@@ -0,0 +1,85 @@
+"""Test functions for matepairs.py"""
+
+import os
+import random
+import matepairs
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+def samline(name, flag, chrom, pos, mpos, tlen):
+    return '\t'.join(map(str, [name, flag, chrom, pos, 255, '10M', '=', mpos,
+                               tlen, 'ACGTACGTAC', 'IIIIIIIIII'])) + '\n'
+
+# two pairs plus an unpaired read, coordinate-sorted
+lines = ['@HD\tVN:1.0\tSO:coordinate\n',
+         samline('a', 0x1|0x40, 'chrX', 10, 500, 500),
+         samline('b', 0x1|0x80, 'chrX', 20, 30, 20),
+         samline('u', 0x0,      'chrX', 25, 0, 0),
+         samline('b', 0x1|0x40, 'chrX', 30, 20, -20),
+         samline('a', 0x1|0x80, 'chrX', 500, 10, -500)]
+
+def check_pairs(pairs):
+    names = sorted((a.split('\t')[0] if a else None,
+                    b.split('\t')[0] if b else None) for a, b in pairs)
+    assert names == [('a', 'a'), ('b', 'b'), ('u', None)], names
+    for a, b in pairs:
+        if b is not None:
+            assert int(a.split('\t')[1]) & 0x40
+            assert int(b.split('\t')[1]) & 0x80
+
+def test_in_memory():
+    check_pairs(list(matepairs.pair_sam_lines(lines)))
+
+def test_spill():
+    """With a tiny buffer, mates are paired up from the spill files."""
+    check_pairs(list(matepairs.pair_sam_lines(lines, max_buffer=1)))
+
+def test_missing_mate():
+    pairs = list(matepairs.pair_sam_lines(lines[:2], max_buffer=1))
+    assert len(pairs) == 1
+    assert pairs[0][1] is None
+
+def spill_counts(lines, **kwargs):
+    """
+    Pairs up *lines*, returning the pairs and the most spill files that were
+    open at once.
+    """
+    spilldir = tmp.mkdir()
+    opened = [0, 0]
+    original = matepairs._SpillFile.__iter__
+    def counting_iter(self):
+        opened[0] += 1
+        opened[1] = max(opened)
+        for record in original(self):
+            yield record
+        opened[0] -= 1
+    matepairs._SpillFile.__iter__ = counting_iter
+    try:
+        pairs = list(matepairs.pair_sam_lines(lines, tmpdir=spilldir, **kwargs))
+    finally:
+        matepairs._SpillFile.__iter__ = original
+    assert os.listdir(spilldir) == []
+    return pairs, opened[1]
+
+def test_bounded_spills():
+    """Many spills are merged so only a few files are ever open."""
+    r = random.Random(0)
+    pairs = []
+    for i in range(300):
+        pos, mpos = r.randint(1, 10000), r.randint(1, 10000)
+        pairs.append((samline('r%s' % i, 0x1|0x40, 'chrX', pos, mpos, mpos - pos),
+                      samline('r%s' % i, 0x1|0x80, 'chrX', mpos, pos, pos - mpos)))
+    sam = [line for pair in pairs for line in pair]
+    r.shuffle(sam)
+    got, most_open = spill_counts(sam, max_buffer=4, max_spills=3)
+    assert sorted(got) == sorted(pairs)
+    assert most_open == 3
+
+def test_same_key():
+    """Lines that share a key and a mate don't each get a spill file."""
+    a = samline('a', 0x1|0x40, 'chrX', 10, 500, 500)
+    got, most_open = spill_counts([a] * 5, max_buffer=10)
+    assert got == [(a, None)] * 5
+    assert most_open == 0
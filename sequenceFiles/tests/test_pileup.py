@@ -0,0 +1,45 @@
+"""Test functions for pileup.py"""
+
+import pileup
+from cStringIO import StringIO
+
+def test_runs():
+    """Overlapping and abutting intervals form a single run."""
+    p = pileup.Pileup(buffersize=2)
+    p.add('chrX', 10, 15)
+    p.add('chrX', 12, 14)
+    p.add('chrX', 15, 17)
+    p.add('chrX', 30, 31)
+    runs = list(p.runs('chrX'))
+    assert len(runs) == 2
+    start, values = runs[0]
+    assert start == 10
+    assert list(values) == [1, 1, 2, 2, 1, 1, 1]
+    start, values = runs[1]
+    assert start == 30
+    assert list(values) == [1]
+
+def test_unsorted_input():
+    """Input order doesn't matter."""
+    a = pileup.Pileup()
+    b = pileup.Pileup(buffersize=1)
+    intervals = [('chr2L', 5, 9), ('chrX', 1, 3), ('chr2L', 0, 6)]
+    for i in intervals:
+        a.add(*i)
+    for i in reversed(intervals):
+        b.add(*i)
+    fa = StringIO()
+    fb = StringIO()
+    a.write_wig(fa)
+    b.write_wig(fb)
+    assert fa.getvalue() == fb.getvalue()
+
+def test_write_wig():
+    p = pileup.Pileup()
+    p.add('chrX', 0, 2)
+    p.add('chrX', 1, 3)
+    f = StringIO()
+    p.write_wig(f, trackinfo='name="test"')
+    assert f.getvalue() == ('track type=wiggle_0 alwaysZero=on name="test"\n'
+                            'fixedStep chrom=chrX start=1 step=1\n'
+                            '1.0\n2.0\n1.0\n')
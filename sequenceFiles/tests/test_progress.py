@@ -0,0 +1,58 @@
+"""Test functions for progress.py"""
+
+import json
+from cStringIO import StringIO
+import progress
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+def test_progress():
+    fn = tmp.write('a.txt', ['line %s\n' % i for i in range(5000)])
+    f = open(fn)
+    stream = StringIO()
+    p = progress.Progress('lines', fileobj=f, interval=0, check_every=1000, stream=stream)
+    for line in f:
+        p.tick()
+    p.done()
+    f.close()
+    assert p.count == 5000
+    assert p.size == len(open(fn).read())
+    # one report per check_every lines, plus the final one
+    reports = stream.getvalue().split('\r')[1:]
+    assert len(reports) == 6
+    assert reports[-1].startswith('5000 lines') and '100%' in reports[-1]
+
+    # bytes are still in the summary after the file is closed
+    summary = p.summary()
+    assert summary['count'] == 5000
+    assert summary['bytes'] == p.size
+    assert summary['bytes_per_second'] > 0
+
+def test_disabled():
+    stream = StringIO()
+    p = progress.Progress('items', interval=0, check_every=1, stream=stream, enabled=False)
+    for i in range(10):
+        p.tick()
+    p.done()
+    assert stream.getvalue() == ''
+    assert 'bytes' not in p.summary()
+
+def test_format_seconds():
+    assert progress._format_seconds(5) == '5s'
+    assert progress._format_seconds(65) == '1m05s'
+    assert progress._format_seconds(3725) == '1h02m'
+
+def test_stage_timer():
+    stages = progress.StageTimer()
+    stages.start('load')
+    stages.start('count')
+    stages.stop()
+    fn = tmp.filename('metrics.json')
+    stages.write_json(fn, counts={'total': 3})
+    metrics = json.load(open(fn))
+    assert metrics['stage_order'] == ['load', 'count']
+    assert sorted(metrics['stages']) == ['count', 'load']
+    assert metrics['counts'] == {'total': 3}
+    assert metrics['total_seconds'] >= sum(metrics['stages'].values())
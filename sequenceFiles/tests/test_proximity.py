@@ -0,0 +1,69 @@
+"""Test functions for proximity.py"""
+
+import random
+import proximity
+import randomization
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+write_bed = tmp.write_bed
+
+def random_features(seed, chroms, n=200):
+    r = random.Random(seed)
+    features = []
+    for i in range(n):
+        start = r.randint(0, 50000)
+        features.append((r.choice(chroms), start, start + r.choice([1, 20, 500, 5000])))
+    return features
+
+def gap(fa, fb):
+    return max(fa[1] - fb[2], fb[1] - fa[2], 0)
+
+def test_window():
+    a = random_features(0, ['chr2L', 'chrX', 'chrM'])
+    b = random_features(1, ['chr2L', 'chrX'])
+    ia = randomization.Intervals(write_bed(a), keep_lines=True)
+    ib = randomization.Intervals(write_bed(b))
+    for w in [0, 100, 5000]:
+        expected = [any(fa[0] == fb[0] and max(fa[1] - w, 0) < fb[2] and fa[2] + w > fb[1]
+                        for fb in b) for fa in a]
+        assert proximity.window(ia, ib, w).tolist() == expected
+
+    fn = tmp.filename('out.bed')
+    hits = proximity.window(ia, ib, 100)
+    assert proximity.write_features(ia, ~hits, fn, 'far') == (~hits).sum()
+    lines = open(fn).readlines()
+    assert lines[0] == 'track name="far"\n'
+    assert [l.split()[3] for l in lines[1:]] == ['f%s' % i for i, h in enumerate(hits) if not h]
+
+def test_closest():
+    a = random_features(2, ['chr2L', 'chrX', 'chrM'])
+    b = random_features(3, ['chr2L', 'chrX'])
+    ia = randomization.Intervals(write_bed(a))
+    ib = randomization.Intervals(write_bed(b))
+    for chrom in ['chr2L', 'chrX']:
+        idx, gaps = proximity.closest(ia, ib, chrom)
+        fas = zip(ia.starts[chrom], ia.stops[chrom])
+        fbs = zip(ib.starts[chrom], ib.stops[chrom])
+        for (start, stop), i, g in zip(fas, idx, gaps):
+            best = min(gap((chrom, start, stop), (chrom, s, e)) for s, e in fbs)
+            assert g == best
+            # ties go to the first in b's file order
+            tied = [j for j, (s, e) in enumerate(fbs)
+                    if gap((chrom, start, stop), (chrom, s, e)) == best]
+            assert ib.index[chrom][i] == min(ib.index[chrom][tied])
+
+    dists = proximity.closest_center_distances(ia, ib)
+    assert len(dists) == len([f for f in a if f[0] != 'chrM'])
+
+def test_closest_ties():
+    """Of two overlapping b features, the first in the file is reported, as
+    with closestBed -t first."""
+    ia = randomization.Intervals(write_bed([('chr2L', 100, 200), ('chr2L', 1000, 1010)]))
+    ib = randomization.Intervals(write_bed([('chr2L', 150, 160), ('chr2L', 50, 500),
+                                            ('chr2L', 1020, 1030), ('chr2L', 980, 990)]))
+    idx, gaps = proximity.closest(ia, ib, 'chr2L')
+    assert gaps.tolist() == [0, 10]
+    assert ib.index['chr2L'][idx].tolist() == [0, 2]
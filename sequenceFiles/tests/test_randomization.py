@@ -0,0 +1,201 @@
+"""Test functions for randomization.py"""
+
+import os
+import random
+import numpy as np
+import genome
+import randomization
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+write_bed = tmp.write_bed
+
+def random_features(seed, n=300, size=100000):
+    r = random.Random(seed)
+    features = []
+    for i in range(n):
+        chrom = r.choice(['chr2L', 'chrX'])
+        start = r.randint(0, size - 5000)
+        features.append((chrom, start, start + r.choice([1, 20, 500, 5000])))
+    return features
+
+def brute_force(a, b):
+    return sum(1 for fa in a
+               if any(fa[0] == fb[0] and fa[1] < fb[2] and fa[2] > fb[1] for fb in b))
+
+def test_actual_count():
+    for seed in range(3):
+        a = random_features(seed)
+        b = random_features(seed + 100)
+        ia = randomization.Intervals(write_bed(a))
+        ib = randomization.Intervals(write_bed(b))
+        assert len(ia) == len(a)
+        assert randomization.actual_count(ia, ib) == brute_force(a, b)
+        assert randomization.actual_count(ia, ia) == len(a)
+
+def test_merged():
+    b = randomization.Intervals(write_bed([('chr2L', 0, 10), ('chr2L', 5, 20), ('chr2L', 8, 9),
+                                           ('chr2L', 20, 25), ('chr2L', 30, 40)]))
+    starts, stops = b.merged('chr2L')
+    assert starts.tolist() == [0, 20, 30]
+    assert stops.tolist() == [20, 25, 40]
+    assert len(b.merged('chrX')[0]) == 0
+
+def test_shuffled_counts():
+    a = random_features(0)
+    b = random_features(1)
+    ia = randomization.Intervals(write_bed(a))
+    ib = randomization.Intervals(write_bed(b))
+    genome = {'chr2L': 100000, 'chrX': 100000}
+    counts = randomization.shuffled_counts(ia, ib, 50, genome, np.random.RandomState(0))
+    assert counts.shape == (50,)
+    assert (counts >= 0).all() and (counts <= len(a)).all()
+
+    # Same as shuffling feature by feature with the same random numbers
+    rs = np.random.RandomState(0)
+    placements = {}
+    for chrom in ia.chroms():
+        lengths = ia.stops[chrom] - ia.starts[chrom]
+        starts = (rs.random_sample((50, len(lengths))) * (genome[chrom] - lengths + 1)).astype(int)
+        assert (starts + lengths <= genome[chrom]).all()
+        placements[chrom] = (starts, lengths)
+    for i in range(5):
+        shuffled = []
+        for chrom, (starts, lengths) in placements.items():
+            shuffled.extend((chrom, s, s + l) for s, l in zip(starts[i], lengths))
+        assert brute_force(shuffled, b) == counts[i]
+
+def test_randomstats():
+    ia = randomization.Intervals(write_bed(random_features(0)))
+    ib = randomization.Intervals(write_bed(random_features(1)))
+    genome = {'chr2L': 100000, 'chrX': 100000}
+    r1 = randomization.randomstats(ia, ib, 200, genome, seed=1)
+    r2 = randomization.randomstats(ia, ib, 200, genome, seed=1)
+    assert r1 == r2
+    assert r1['lower_95th'] <= r1['median randomized'] <= r1['upper_95th']
+    assert r1[ia.fn] == 300
+
+def test_percentileofscore():
+    a = [1, 2, 3, 3, 4]
+    assert randomization.percentileofscore(a, 3) == 70.0
+    assert randomization.percentileofscore(a, 0) == 0.0
+    assert randomization.percentileofscore(a, 10) == 100.0
+    assert randomization.percentileofscore(a, 2.5) == 40.0
+
+def test_shuffle_cache():
+    ia = randomization.Intervals(write_bed(random_features(0)))
+    ib = randomization.Intervals(write_bed(random_features(1)))
+    genome = {'chr2L': 100000, 'chrX': 100000}
+    memory = randomization.ShuffleCache(100, genome, seed=3)
+    ondisk = randomization.ShuffleCache(100, genome, seed=3, cachedir=tmp.mkdir())
+    assert memory.get(ia)['chrX'].base is memory.get(ia)['chrX'].base
+    for chrom in ia.chroms():
+        assert (memory.get(ia)[chrom] == ondisk.get(ia)[chrom]).all()
+        assert (memory.get(ia)[chrom] + ia.stops[chrom] - ia.starts[chrom] <= genome[chrom]).all()
+
+    c1 = randomization.shuffled_counts(ia, ib, 100, genome, cache=memory)
+    c2 = randomization.shuffled_counts(ia, ib, 100, genome, cache=ondisk)
+    assert (c1 == c2).all()
+
+    # a fresh on-disk cache picks up the saved shuffles
+    again = randomization.ShuffleCache(100, genome, seed=3, cachedir=ondisk.cachedir)
+    assert (randomization.shuffled_counts(ia, ib, 100, genome, cache=again) == c1).all()
+
+    other = randomization.ShuffleCache(100, genome, seed=4)
+    assert not (randomization.shuffled_counts(ia, ib, 100, genome, cache=other) == c1).all()
+
+    try:
+        randomization.shuffled_counts(ia, ib, 101, genome, cache=memory)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_adaptive():
+    ia = randomization.Intervals(write_bed(random_features(0)))
+    ib = randomization.Intervals(write_bed(random_features(1)))
+    genome = {'chr2L': 100000, 'chrX': 100000}
+    cache = randomization.ShuffleCache(1000, genome)
+
+    # self vs self is always extreme, so it can't stop before the maximum
+    r = randomization.adaptive_randomstats(ia, ia, 1000, genome, cache=cache, batch=100)
+    assert r['iterations'] == 1000
+    full = randomization.randomstats(ia, ia, 1000, genome, cache=cache)
+    assert r == full
+
+    # unrelated files stop early, on an unremarkable percentile
+    r = randomization.adaptive_randomstats(ia, ib, 1000, genome, cache=cache, batch=100)
+    assert r['iterations'] < 1000
+    assert 0.1 < r['percentile'] < 99.9
+
+def test_lazy_shuffle_cache():
+    ia = randomization.Intervals(write_bed(random_features(0)))
+    ib = randomization.Intervals(write_bed(random_features(1)))
+    genome = {'chr2L': 100000, 'chrX': 100000}
+    cache = randomization.ShuffleCache(1000, genome, cachedir=tmp.mkdir(), block=100)
+
+    # stopping early only makes the blocks that were used
+    r = randomization.adaptive_randomstats(ia, ib, 1000, genome, cache=cache, batch=100)
+    assert r['iterations'] < 1000
+    assert sorted(map(int, os.listdir(cache.path(ia)))) == range(r['iterations'] // 100)
+
+    # the same shuffles whichever blocks are made first, or where from
+    later = randomization.ShuffleCache(1000, genome, block=100).get(ia, 150, 100)
+    full = cache.get(ia)
+    for chrom in ia.chroms():
+        assert (later[chrom] == full[chrom][150:250]).all()
+
+    try:
+        randomization.randomstats(ia, ib, 100, genome, seed=1, cache=cache)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_prune_shuffle_cache():
+    fa = write_bed(random_features(0))
+    fb = write_bed(random_features(1))
+    cachedir = tmp.mkdir()
+    genome = {'chr2L': 100000, 'chrX': 100000}
+    cache = randomization.ShuffleCache(100, genome, cachedir=cachedir)
+    for fn in (fa, fb):
+        cache.get(randomization.Intervals(fn))
+    other = randomization.ShuffleCache(100, genome, seed=1, cachedir=cachedir)
+    other.get(randomization.Intervals(fa))
+    assert len(os.listdir(cachedir)) == 3
+
+    cache.prune([fa])
+    assert os.listdir(cachedir) == [os.path.basename(cache.path(fa))]
+
+def test_wilson_interval():
+    lo, hi = randomization.wilson_interval(0.5, 100, 1.96)
+    assert abs(lo - 0.4038) < 1e-4 and abs(hi - 0.5962) < 1e-4
+
+def test_cache_key():
+    fn = write_bed(random_features(0))
+    cache = randomization.ShuffleCache(10)
+    key = cache.key(randomization.Intervals(fn))
+    assert key == cache.key(randomization.Intervals(fn))
+    assert key != randomization.ShuffleCache(10, seed=1).key(randomization.Intervals(fn))
+    open(fn, 'a').write('chrX\t1\t2\n')
+    assert key != cache.key(randomization.Intervals(fn))
+
+def test_excluded_regions():
+    ia = randomization.Intervals(write_bed(random_features(0)))
+    ib = randomization.Intervals(write_bed(random_features(1)))
+    exclude = {'chr2L': (np.array([0]), np.array([60000]))}
+    g = genome.Genome({'chr2L': 100000, 'chrX': 100000}, exclude=exclude)
+    cache = randomization.ShuffleCache(100, g)
+    shuffles = cache.get(ia)
+    assert (shuffles['chr2L'] >= 60000).all()
+    assert cache.key(ia) != randomization.ShuffleCache(100, g.sizes).key(ia)
+    assert (randomization.shuffled_counts(ia, ib, 100, cache=cache) ==
+            randomization.shuffled_counts(ia, ib, 100, cache=randomization.ShuffleCache(100, g))).all()
+    try:
+        randomization.randomstats(ia, ib, 10, {'chr2L': 100000})
+    except ValueError:
+        pass
+    else:
+        assert False
@@ -0,0 +1,72 @@
+"""Test functions for robust.py"""
+
+import numpy as np
+import robust
+from helpers import TempDir
+
+tmp = TempDir()
+teardown_module = tmp.cleanup
+
+def make_matrix(seed=0, n=2000, m=30, missing=0.05):
+    rs = np.random.RandomState(seed)
+    probe = rs.normal(0, 2, n)
+    array = rs.normal(0, 1, m)
+    x = 1.5 + probe[:, None] + array[None, :] + rs.standard_cauchy((n, m)) * 0.1
+    x[rs.random_sample((n, m)) < missing] = np.nan
+    return x
+
+def reference_biweight(x, c=5.0, epsilon=1e-4):
+    x = np.asarray(x)
+    x = x[~np.isnan(x)]
+    m = np.median(x)
+    s = np.median(abs(x - m))
+    u = (x - m) / (c * s + epsilon)
+    w = np.where(abs(u) <= 1, (1 - u ** 2) ** 2, 0)
+    return (w * x).sum() / w.sum()
+
+def test_biweight():
+    x = make_matrix()
+    assert np.allclose(robust.biweight(x), reference_biweight(x))
+    assert np.allclose(robust.row_biweights(x, blocksize=1000),
+                       [reference_biweight(row) for row in x])
+    assert np.allclose(robust.column_biweights(x, blocksize=1000),
+                       [reference_biweight(col) for col in x.T])
+    assert np.allclose(robust.row_means(x, blocksize=1000), [np.nanmean(row) for row in x])
+
+def test_centering_memmap():
+    x = make_matrix()
+    fn = tmp.filename('m.npy')
+    mm = np.lib.format.open_memmap(fn, mode='w+', dtype=float, shape=x.shape)
+    mm[:] = x
+    locations = robust.center_columns(mm, blocksize=5000)
+    expected = x - [reference_biweight(col) for col in x.T]
+    assert np.allclose(locations, [reference_biweight(col) for col in x.T])
+    assert np.allclose(np.load(fn, mmap_mode='r'), expected, equal_nan=True)
+
+    robust.center_rows(mm, blocksize=5000)
+    expected -= np.array([reference_biweight(row) for row in expected])[:, None]
+    assert np.allclose(mm, expected, equal_nan=True)
+
+def test_median_polish():
+    rs = np.random.RandomState(1)
+    probe = rs.normal(0, 2, 300)
+    array = rs.normal(0, 1, 8)
+    x = 3 + probe[:, None] + array[None, :]
+    overall, rows, cols, residuals = robust.median_polish(x.copy())
+    assert np.allclose(residuals, 0)
+    assert np.allclose(overall + rows[:, None] + cols[None, :], x)
+
+    x = make_matrix(n=500, m=10)
+    original = x.copy()
+    overall, rows, cols, residuals = robust.median_polish(x, blocksize=700)
+    assert residuals is x
+    assert np.allclose(overall + rows[:, None] + cols[None, :] + residuals, original,
+                       equal_nan=True)
+    assert abs(np.median(rows)) < 1e-9
+
+def test_weighted_row_means():
+    x = make_matrix(n=300, m=6)
+    weights = np.random.RandomState(2).randint(1, 4, x.shape)
+    expected = [np.average(row[~np.isnan(row)], weights=w[~np.isnan(row)])
+                for row, w in zip(x, weights)]
+    assert np.allclose(robust.row_means(x, blocksize=100, weights=weights), expected)
@@ -0,0 +1,41 @@
+"""Checks that plotting scripts don't import heavy modules for --help"""
+
+import os
+import subprocess
+import sys
+from nose.plugins.skip import SkipTest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = ['theComparator.py', 'GFFthresholds.py', 'fastaSizeFilter.py',
+           'random-intersection-pipeline.py']
+HEAVY = ['matplotlib', 'pylab', 'scipy', 'Bio']
+
+RUNNER = """
+import runpy, sys
+sys.argv = [sys.argv[1], '--help']
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+print ' '.join(m for m in %r if m in sys.modules)
+""" % HEAVY
+
+def check_help(script):
+    if script == 'random-intersection-pipeline.py':
+        try:
+            import ruffus
+        except ImportError:
+            raise SkipTest('ruffus is not installed')
+    path = os.path.join(HERE, '..', script)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.join(HERE, '..'), env.get('PYTHONPATH', '')])
+    p = subprocess.Popen([sys.executable, '-c', RUNNER, path], stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, env=env)
+    stdout, stderr = p.communicate()
+    assert p.returncode == 0, stderr
+    assert 'Usage' in stdout or 'usage' in stdout
+    assert stdout.splitlines()[-1].strip() == '', stdout.splitlines()[-1]
+
+def test_help():
+    for script in SCRIPTS:
+        yield check_help, script